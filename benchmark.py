@@ -0,0 +1,1048 @@
+"""Benchmark & verifikasi offline untuk whatsapp_ai_bot (tanpa Gemini / jaringan asli)
+
+Usage:
+    python benchmark.py upload --size-mb 10
+    python benchmark.py loop-lag --size-mb 10 --uploads 4
+    python benchmark.py normalize [--seconds 60] [file ...]
+    python benchmark.py disk-read --size-mb 50 --chats 4
+    python benchmark.py detect --iterations 20000
+    python benchmark.py logging --iterations 50000
+    python benchmark.py load --workload all --requests 200 --concurrency 16
+    python benchmark.py stream --latency 4 --paragraphs 8
+    python benchmark.py resilience --rate 30 --quota 20 --error-rate 0.05
+    python benchmark.py keys --keys 4 --rate 60 --quota 20
+    python benchmark.py combined --requests 50 --latency 1.0 --transcript-chars 20000
+    python benchmark.py stitch
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import resource
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+import whatsapp_ai_bot as bot
+
+
+class StubGemini:
+    """Stub lokal untuk endpoint generateContent / streamGenerateContent (SSE) Gemini"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, save_bodies: bool = False,
+                 paragraphs: int = 1, quota_per_second: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.save_bodies = save_bodies
+        self.paragraphs = paragraphs  # Jumlah paragraf jawaban; streaming mengirim satu paragraf per event
+        self.quota_per_second = quota_per_second  # > 0: request di atas kuota per detik per key dijawab 429 + Retry-After
+        self.requests = 0
+        self.rejected = 0
+        self._windows: Dict[str, List[float]] = {}
+        self.bytes_received = 0
+        self.last_body_path: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def handle_generate(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        # Body dibaca per chunk agar stub tidak ikut menambah peak memory
+        structured, tail = False, b""
+        if self.save_bodies:
+            fd, path = tempfile.mkstemp(prefix="stub_body_", suffix=".json")
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in request.content.iter_chunked(64 * 1024):
+                    self.bytes_received += len(chunk)
+                    structured = structured or b'"responseSchema"' in tail + chunk
+                    tail = chunk[-32:]
+                    f.write(chunk)
+            if self.last_body_path:
+                os.remove(self.last_body_path)
+            self.last_body_path = path
+        else:
+            async for chunk in request.content.iter_chunked(64 * 1024):
+                self.bytes_received += len(chunk)
+                structured = structured or b'"responseSchema"' in tail + chunk
+                tail = chunk[-32:]
+
+        if self.quota_per_second:
+            now = time.monotonic()
+            window = [t for t in self._windows.get(request.query.get("key", ""), []) if now - t < 1.0]
+            self._windows[request.query.get("key", "")] = window
+            if len(window) >= self.quota_per_second:
+                self.rejected += 1
+                retry_after = max(0.1, 1.0 - (now - window[0]))
+                return web.json_response(
+                    {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                               "details": [{"retryDelay": f"{retry_after:.1f}s"}]}},
+                    status=429, headers={"Retry-After": str(int(retry_after + 0.999))})
+            window.append(now)
+        if self.error_rate and random.random() < self.error_rate:
+            await asyncio.sleep(self.latency)
+            return web.json_response({"error": {"code": 503, "message": "stub overload"}}, status=503)
+        paragraphs = [f"stub response #{self.requests} paragraph {index + 1}. " + "lorem ipsum dolor sit amet " * 8
+                      for index in range(self.paragraphs)]
+        if structured:
+            # responseSchema transkrip + ringkasan: jawaban berupa satu objek JSON
+            paragraphs = [json.dumps({
+                "transcription": "\n\n".join(paragraphs),
+                "summary": f"stub summary #{self.requests}",
+                "key_points": ["stub point 1", "stub point 2"],
+                "category": "podcast",
+            })]
+        if request.match_info["model"].endswith(":streamGenerateContent"):
+            # Latency dibagi rata per paragraf, seperti model yang menulis bertahap
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for index, paragraph in enumerate(paragraphs):
+                await asyncio.sleep(self.latency / len(paragraphs))
+                text = paragraph + ("\n\n" if index < len(paragraphs) - 1 else "")
+                event = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+                await response.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            await response.write_eof()
+            return response
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({
+            "candidates": [{"content": {"parts": [{"text": "\n\n".join(paragraphs)}]}}]
+        })
+
+    async def start(self) -> str:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/v1beta/models/{model}", self.handle_generate)
+        app.router.add_get("/", lambda request: web.Response(text="ok"))
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self.last_body_path and os.path.exists(self.last_body_path):
+            os.remove(self.last_body_path)
+
+
+FAKE_YTDLP_SCRIPT = r'''
+"""yt-dlp palsu untuk benchmark: info JSON kalengan + file dummy, tanpa jaringan
+
+Env: FAKE_YTDLP_LATENCY (detik), FAKE_YTDLP_ERROR_RATE (0-1), FAKE_YTDLP_BYTES (ukuran file hasil download)
+"""
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+args = sys.argv[1:]
+url = args[-1]
+time.sleep(float(os.environ.get("FAKE_YTDLP_LATENCY", "0")))
+if random.random() < float(os.environ.get("FAKE_YTDLP_ERROR_RATE", "0")):
+    sys.stderr.write("ERROR: [fake] simulated extractor failure\n")
+    sys.exit(1)
+
+video_id = hashlib.sha1(url.encode()).hexdigest()[:11]
+info = {
+    "id": video_id, "extractor_key": "Youtube", "title": f"Benchmark media {video_id}",
+    "uploader": "benchmark", "duration": 180, "view_count": 12345, "webpage_url": url,
+    "description": "Fake yt-dlp output", "thumbnail": "",
+}
+if "--dump-json" in args:
+    print(json.dumps(info))
+    sys.exit(0)
+
+if "-x" in args:
+    ext = "mp3"
+elif args[args.index("-f") + 1].startswith("bestaudio"):
+    ext = "webm"
+else:
+    ext = "mp4"
+path = args[args.index("-o") + 1].replace("%(ext)s", ext)
+remaining = int(os.environ.get("FAKE_YTDLP_BYTES", str(1024 * 1024)))
+block = os.urandom(64 * 1024)
+with open(path, "wb") as f:
+    while remaining > 0:
+        f.write(block[:remaining])
+        remaining -= len(block)
+info["filepath"] = path
+print(json.dumps(info))
+'''
+
+
+def write_fake_ytdlp(workdir: str) -> str:
+    """Tulis executable yt-dlp palsu (dijalankan dengan interpreter Python yang sama)"""
+    path = os.path.join(workdir, "yt-dlp")
+    with open(path, "w") as f:
+        f.write(f"#!{sys.executable}\n" + FAKE_YTDLP_SCRIPT.lstrip())
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def current_rss() -> int:
+    """RSS proses saat ini (byte); fallback ke peak RSS jika /proc tidak ada"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class RSSSampler:
+    """Sampling RSS di background untuk mendapatkan peak selama satu workload"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, current_rss())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = current_rss()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+def make_sample_file(size_bytes: int, suffix: str = ".bin") -> str:
+    """Buat file media dummy (random bytes) untuk benchmark"""
+    fd, path = tempfile.mkstemp(prefix="bench_media_", suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        remaining = size_bytes
+        while remaining > 0:
+            chunk = os.urandom(min(remaining, 1024 * 1024))
+            f.write(chunk)
+            remaining -= len(chunk)
+    return path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_uploaded_body(body_path: str, media_path: str) -> bool:
+    """Cek bahwa inline_data di body yang diterima stub identik dengan file sumber"""
+    with open(body_path, "rb") as f:
+        payload = json.load(f)
+    data = payload["contents"][0]["parts"][0]["inline_data"]["data"]
+    return hashlib.sha256(base64.b64decode(data)).hexdigest() == file_sha256(media_path)
+
+
+async def measure_peak(coro) -> Dict[str, Any]:
+    """Jalankan coroutine dan ukur peak alokasi Python (tracemalloc) + waktu"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = await coro
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"result": result, "peak_bytes": peak, "seconds": elapsed}
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoopLagProbe:
+    """Simulasi command kecil: tugas yang seharusnya bangun tiap interval, catat keterlambatannya"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def report(self) -> str:
+        ms = 1000.0
+        return (f"p50={percentile(self.samples, 50) * ms:6.2f}ms  p99={percentile(self.samples, 99) * ms:6.2f}ms  "
+                f"max={max(self.samples or [0]) * ms:6.2f}ms")
+
+
+async def legacy_upload(url: str, media_path: str, mime_type: str) -> int:
+    """Jalur lama: baca file utuh -> base64 string -> json=payload"""
+    with open(media_path, "rb") as f:
+        media_bytes = f.read()
+    payload = {"contents": [{"parts": [
+        {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(media_bytes).decode("utf-8")}},
+        {"text": "Analyze this video content"},
+    ]}]}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=payload) as response:
+            await response.read()
+            return response.status
+
+
+async def bench_upload(args):
+    stub = StubGemini(save_bodies=True)
+    base_url = await stub.start()
+    media_path = make_sample_file(int(args.size_mb * 1024 * 1024), ".mp4")
+    processor = bot.AIProcessor("bench-key", api_base=base_url)
+    try:
+        legacy = await measure_peak(legacy_upload(processor.key_pool.keys[0].url, media_path, "video/mp4"))
+        legacy_ok = verify_uploaded_body(stub.last_body_path, media_path)
+
+        streaming = await measure_peak(processor.analyze_media(media_path, "video/mp4", "Analyze this video content"))
+        streaming_ok = streaming["result"].get("success") and verify_uploaded_body(stub.last_body_path, media_path)
+
+        mb = 1024 * 1024
+        print(f"Media size: {args.size_mb:.1f} MB")
+        print(f"{'mode':<12}{'peak MB':>10}{'seconds':>10}{'verified':>10}")
+        print(f"{'legacy':<12}{legacy['peak_bytes'] / mb:>10.1f}{legacy['seconds']:>10.2f}{str(legacy_ok):>10}")
+        print(f"{'streaming':<12}{streaming['peak_bytes'] / mb:>10.1f}{streaming['seconds']:>10.2f}{str(streaming_ok):>10}")
+    finally:
+        await processor.close()
+        await stub.stop()
+        os.remove(media_path)
+
+
+async def bench_loop_lag(args):
+    stub = StubGemini()
+    base_url = await stub.start()
+    media_path = make_sample_file(int(args.size_mb * 1024 * 1024), ".mp4")
+    processor = bot.AIProcessor("bench-key", api_base=base_url)
+    try:
+        print(f"Event-loop lag for small commands while {args.uploads} x {args.size_mb:.1f} MB media are encoded")
+        for label, make_upload in (
+            ("inline", lambda: legacy_upload(processor.key_pool.keys[0].url, media_path, "video/mp4")),
+            ("offloaded", lambda: processor.analyze_media(media_path, "video/mp4", "Analyze this video content")),
+        ):
+            probe = LoopLagProbe()
+            probe.start()
+            await asyncio.gather(*[make_upload() for _ in range(args.uploads)])
+            await probe.stop()
+            print(f"{label:<10} {probe.report()}")
+    finally:
+        await processor.close()
+        await stub.stop()
+        os.remove(media_path)
+
+
+async def make_sample_media(workdir: str, seconds: int) -> List[Any]:
+    """Generate media contoh (mp3 bitrate tinggi, video mp4, gambar besar) dengan ffmpeg lavfi"""
+    samples = [
+        ("audio.mp3", "audio/mp3", ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                                    "-ac", "2", "-ar", "44100", "-b:a", "320k"]),
+        ("video.mp4", "video/mp4", ["-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={seconds}",
+                                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                                    "-c:v", "libx264", "-preset", "veryfast", "-c:a", "aac", "-b:a", "192k", "-shortest"]),
+        ("image.png", "image/png", ["-f", "lavfi", "-i", "testsrc2=size=4000x3000", "-frames:v", "1"]),
+    ]
+    media = []
+    for name, mime_type, args in samples:
+        path = os.path.join(workdir, name)
+        returncode, _, err = await bot.run_subprocess("ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args, path)
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed for {name}: {err.decode(errors='ignore')[-200:]}")
+        media.append((path, mime_type))
+    return media
+
+
+async def bench_normalize(args):
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found in PATH, normalize benchmark needs it")
+        return
+    stub = StubGemini(latency=args.latency)
+    base_url = await stub.start()
+    workdir = tempfile.mkdtemp(prefix="bench_normalize_")
+    os.makedirs("temp_media", exist_ok=True)
+    try:
+        if args.files:
+            media = [(path, bot.guess_mime_type(path)) for path in args.files]
+        else:
+            media = await make_sample_media(workdir, args.seconds)
+
+        print(f"{'file':<24}{'mode':<8}{'upload KB':>12}{'transcode s':>13}{'request s':>11}")
+        for path, mime_type in media:
+            speech_only = mime_type.startswith(("audio/", "video/"))
+            for mode, normalize in (("raw", False), ("opus" if speech_only else "jpeg", True)):
+                processor = bot.AIProcessor("bench-key", api_base=base_url, normalize=normalize)
+                before = stub.bytes_received
+                transcode = 0.0
+                if normalize:
+                    start = time.perf_counter()
+                    with tempfile.TemporaryDirectory(dir=workdir) as normalize_dir:
+                        await bot.normalize_media(path, mime_type, normalize_dir, speech_only)
+                    transcode = time.perf_counter() - start
+                start = time.perf_counter()
+                if speech_only:
+                    result = await processor.transcribe_audio(path, mime_type)
+                else:
+                    result = await processor.analyze_media(path, mime_type)
+                elapsed = time.perf_counter() - start
+                await processor.close()
+                status = "" if result.get("success") else f"  ({result.get('error')})"
+                print(f"{os.path.basename(path):<24}{mode:<8}{(stub.bytes_received - before) / 1024:>12.1f}"
+                      f"{transcode:>13.2f}{elapsed:>11.2f}{status}")
+    finally:
+        await stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def drop_page_cache(path: str):
+    """Minta kernel membuang page cache file agar pembacaan berikutnya benar-benar dari disk"""
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+async def legacy_disk_job(processor: "bot.AIProcessor", path: str) -> Dict[str, Any]:
+    """Jalur lama handler: open().read() + os.path.exists/os.remove langsung di coroutine"""
+    with open(path, "rb") as f:
+        audio_bytes = f.read()
+    result = await processor.transcribe_audio(audio_bytes, "audio/mp3", normalize=False)
+    if os.path.exists(path):
+        os.remove(path)
+    return result
+
+
+async def async_disk_job(processor: "bot.AIProcessor", path: str) -> Dict[str, Any]:
+    """Jalur baru: file di-stream dari path (dibaca di executor) lalu dihapus lewat io_executor"""
+    result = await processor.transcribe_audio(path, "audio/mp3", normalize=False)
+    await bot.remove_file(path)
+    return result
+
+
+async def bench_disk_read(args):
+    stub = StubGemini()
+    base_url = await stub.start()
+    source = make_sample_file(int(args.size_mb * 1024 * 1024), ".mp3")
+    processor = bot.AIProcessor("bench-key", api_base=base_url, normalize=False)
+    try:
+        print(f"Event-loop lag for small commands while {args.chats} chats each read a {args.size_mb:.1f} MB file (cold cache)")
+        for label, job in (("blocking", legacy_disk_job), ("async", async_disk_job)):
+            paths = []
+            for index in range(args.chats):
+                fd, path = tempfile.mkstemp(prefix="bench_disk_", suffix=".mp3")
+                os.close(fd)
+                shutil.copyfile(source, path)
+                drop_page_cache(path)
+                paths.append(path)
+            probe = LoopLagProbe()
+            probe.start()
+            start = time.perf_counter()
+            results = await asyncio.gather(*[job(processor, path) for path in paths])
+            elapsed = time.perf_counter() - start
+            await probe.stop()
+            ok = sum(1 for result in results if result.get("success"))
+            print(f"{label:<10} {probe.report()}  total={elapsed:5.2f}s  ok={ok}/{args.chats}")
+    finally:
+        await processor.close()
+        await stub.stop()
+        os.remove(source)
+
+
+def legacy_get_quoted_message_info(message):
+    """Deteksi quoted message versi lama (jalur manual): hasattr/ByteSize per field + dump dir() jika gagal"""
+    log = bot.log
+    has_quoted = False
+    quoted_message = None
+    quoted_type = None
+    if (hasattr(message.Message, 'extendedTextMessage') and
+        hasattr(message.Message.extendedTextMessage, 'contextInfo') and
+        hasattr(message.Message.extendedTextMessage.contextInfo, 'quotedMessage')):
+        quoted_message = message.Message.extendedTextMessage.contextInfo.quotedMessage
+        has_quoted = True
+        log.info("Quoted message detected, analyzing type...")
+        log.info("Using manual detection method...")
+        detected_types = []
+        for attr, name in (("audioMessage", "audio"), ("videoMessage", "video"), ("imageMessage", "image"),
+                           ("documentMessage", "document"), ("stickerMessage", "sticker")):
+            if hasattr(quoted_message, attr) and getattr(quoted_message, attr) and getattr(quoted_message, attr).ByteSize() > 0:
+                detected_types.append(name)
+                log.info(f"Found {name.upper()} message - mime: {getattr(getattr(quoted_message, attr), 'mimetype', 'unknown')}")
+        log.info(f"Detected message types: {detected_types}")
+        if detected_types:
+            quoted_type = detected_types[0]
+            log.info(f"Single type detected: {quoted_type}")
+        else:
+            log.warning("No valid message types detected")
+            log.info("Debugging unknown message type:")
+            for attr in dir(quoted_message):
+                if not attr.startswith('_') and not attr in ['SerializeToString', 'ParseFromString']:
+                    try:
+                        val = getattr(quoted_message, attr)
+                        if val and hasattr(val, 'ByteSize') and val.ByteSize() > 0:
+                            log.info(f"  {attr}: {type(val)} (size: {val.ByteSize()})")
+                        elif val and not callable(val):
+                            log.info(f"  {attr}: {type(val)} = {str(val)[:100]}")
+                    except Exception as e:
+                        log.info(f"  {attr}: Error - {e}")
+    log.info(f"Final detection result - has_quoted: {has_quoted}, quoted_type: {quoted_type}")
+    return has_quoted, quoted_message, quoted_type
+
+
+def make_detect_messages() -> Dict[str, Any]:
+    """Contoh event pesan: plain text, link (extendedText tanpa quote), reply ke audio/image, reply ke teks"""
+    from neonize.proto.Neonize_pb2 import Message as MessageEvent
+
+    plain = MessageEvent()
+    plain.Message.conversation = "ping"
+
+    link = MessageEvent()
+    link.Message.extendedTextMessage.text = "mp3 https://youtu.be/dQw4w9WgXcQ"
+
+    quoted_audio = MessageEvent()
+    quoted_audio.Message.extendedTextMessage.text = "transcribe"
+    audio = quoted_audio.Message.extendedTextMessage.contextInfo.quotedMessage.audioMessage
+    audio.mimetype = "audio/ogg; codecs=opus"
+    audio.seconds = 42
+    audio.PTT = True
+
+    quoted_image = MessageEvent()
+    quoted_image.Message.extendedTextMessage.text = "analyze"
+    image = quoted_image.Message.extendedTextMessage.contextInfo.quotedMessage.imageMessage
+    image.mimetype = "image/jpeg"
+    image.JPEGThumbnail = os.urandom(2048)
+
+    quoted_text = MessageEvent()
+    quoted_text.Message.extendedTextMessage.text = "analyze"
+    quoted_text.Message.extendedTextMessage.contextInfo.quotedMessage.conversation = "just text"
+
+    return {"plain": plain, "link": link, "quoted-audio": quoted_audio,
+            "quoted-image": quoted_image, "quoted-text": quoted_text}
+
+
+async def bench_detect(args):
+    # Log tetap diformat (bagian dari biaya per pesan) tapi output dibuang
+    devnull = open(os.devnull, "w")
+    handlers = [h for h in bot.log_listener.handlers if isinstance(h, logging.StreamHandler)]
+    streams = [h.setStream(devnull) for h in handlers]
+    try:
+        rows = []
+        for name, message in make_detect_messages().items():
+            legacy_result = legacy_get_quoted_message_info(message)
+            new_result = await bot.get_quoted_message_info(message)
+            timings = {}
+            for label, detect in (
+                ("legacy", lambda: legacy_get_quoted_message_info(message)),
+                ("new", lambda: bot.get_quoted_message_info(message).send(None)),
+            ):
+                start = time.perf_counter()
+                for _ in range(args.iterations):
+                    try:
+                        detect()
+                    except StopIteration:
+                        pass
+                timings[label] = (time.perf_counter() - start) / args.iterations * 1e6
+            rows.append((name, timings["legacy"], timings["new"], legacy_result[2], new_result[2], new_result[0]))
+    finally:
+        # Kuras antrean log sebelum stream dikembalikan
+        bot.log_listener.stop()
+        bot.log_listener.start()
+        for handler, stream in zip(handlers, streams):
+            handler.setStream(stream)
+        devnull.close()
+
+    print(f"Per-message quoted detection cost ({args.iterations} iterations, logging formatted to /dev/null)")
+    print(f"{'message':<14}{'legacy us':>11}{'new us':>9}{'speedup':>9}   type legacy -> new (has_quoted)")
+    for name, legacy_us, new_us, legacy_type, new_type, has_quoted in rows:
+        print(f"{name:<14}{legacy_us:>11.1f}{new_us:>9.1f}{legacy_us / new_us:>8.1f}x   {legacy_type} -> {new_type} ({has_quoted})")
+
+
+async def bench_logging(args):
+    """Biaya log di thread pemanggil (event loop): handler sinkron + f-string vs queue + lazy + sampling"""
+    devnull = open(os.devnull, "w")
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+
+    def make_logger(name: str, level: int) -> logging.Logger:
+        logger = logging.getLogger(f"benchmark.{name}")
+        logger.propagate = False
+        logger.handlers = []
+        logger.setLevel(level)
+        return logger
+
+    # Jalur lama: basicConfig DEBUG, StreamHandler menulis langsung di thread pemanggil
+    legacy = make_logger("legacy", logging.DEBUG)
+    legacy_handler = logging.StreamHandler(devnull)
+    legacy_handler.setFormatter(formatter)
+    legacy.addHandler(legacy_handler)
+
+    # Jalur baru: level INFO, QueueHandler + sampler, penulisan di thread listener
+    queued = make_logger("queued", logging.INFO)
+    queued_handler = logging.StreamHandler(devnull)
+    queued_handler.setFormatter(formatter)
+    queue_handler = bot.DeferredQueueHandler(queue.SimpleQueue())
+    sampler = bot.LogSampler()
+    queue_handler.addFilter(sampler)
+    queued.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, queued_handler)
+    listener.start()
+
+    chat = "6281234567890@s.whatsapp.net"
+    url = "https://youtu.be/dQw4w9WgXcQ"
+    info = {"title": "Never Gonna Give You Up", "duration": 213, "formats": list(range(50))}
+    cases = (
+        ("legacy info", lambda: legacy.info(f"Processing {chat} {url}")),
+        ("legacy debug", lambda: legacy.debug(f"Media info: {info}")),
+        ("queued info", lambda: queued.info("Processing %s %s", chat, url)),
+        ("queued debug", lambda: queued.debug("Media info: %s", info)),
+    )
+    rows = []
+    try:
+        for label, emit in cases:
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                emit()
+            rows.append((label, (time.perf_counter() - start) / args.iterations * 1e6))
+    finally:
+        listener.stop()
+        devnull.close()
+
+    print(f"Caller-side logging cost ({args.iterations} iterations, output to /dev/null)")
+    for label, us in rows:
+        print(f"{label:<14}{us:>8.2f} us/call")
+    print(f"sampler suppressed {sampler.suppressed} of {args.iterations} queued info records")
+
+
+async def drive_load(op, total: int, concurrency: int) -> Dict[str, Any]:
+    """Closed-loop load: `concurrency` worker mengambil request berikutnya sampai `total` selesai"""
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def worker():
+        while True:
+            index = next(counter)
+            if index >= total:
+                return
+            start = time.perf_counter()
+            try:
+                error = await op(index)
+            except Exception as e:
+                error = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+
+    sampler = RSSSampler()
+    sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    peak_rss = await sampler.stop()
+    return {"latencies": latencies, "errors": errors, "seconds": elapsed, "peak_rss": peak_rss}
+
+
+async def bench_load(args):
+    """Throughput + latency AIProcessor / MediaDownloader dengan stub Gemini dan yt-dlp palsu"""
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    stub = StubGemini(latency=args.gemini_latency, error_rate=args.gemini_error_rate)
+    base_url = await stub.start()
+    ytdlp = write_fake_ytdlp(workdir)
+    os.environ.update({
+        "FAKE_YTDLP_LATENCY": str(args.ytdlp_latency),
+        "FAKE_YTDLP_ERROR_RATE": str(args.ytdlp_error_rate),
+        "FAKE_YTDLP_BYTES": str(int(args.media_kb * 1024)),
+    })
+    os.makedirs("downloads", exist_ok=True)
+    unique = args.unique_urls or args.requests
+
+    def url_for(index: int) -> str:
+        return f"https://www.youtube.com/watch?v=bench{index % unique:06d}"
+
+    def result_error(result: Dict[str, Any]) -> Optional[str]:
+        if result.get("success"):
+            return None
+        return str(result.get("error", "failed")).split(":")[0][:40]
+
+    workloads = ("info", "download", "transcribe", "chat") if args.workload == "all" else (args.workload,)
+    print(f"{args.requests} requests x {args.concurrency} concurrent, {unique} unique URLs, "
+          f"gemini latency {args.gemini_latency * 1000:.0f}ms err {args.gemini_error_rate:.0%}, "
+          f"yt-dlp latency {args.ytdlp_latency * 1000:.0f}ms err {args.ytdlp_error_rate:.0%}, media {args.media_kb:.0f} KB")
+    print(f"{'workload':<12}{'ok':>6}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'peak RSS MB':>13}")
+    try:
+        for workload in workloads:
+            # Komponen baru per workload: cache kosong, store di direktori sementara
+            # normalize=False: media dummy bukan audio asli dan ffmpeg belum tentu ada
+            processor = bot.AIProcessor("bench-key", api_base=base_url, normalize=False,
+                                        rate_per_minute=args.gemini_rpm)
+            store = bot.MediaStore(os.path.join(workdir, f"store_{workload}"))
+            downloader = bot.MediaDownloader(processor, store, ytdlp_binary=ytdlp)
+
+            async def op_info(index: int) -> Optional[str]:
+                return result_error(await downloader.get_info(url_for(index)))
+
+            async def op_download(index: int) -> Optional[str]:
+                result = await downloader.download(url_for(index), "video", "720p", "bench")
+                await downloader.release(result)
+                return result_error(result)
+
+            async def op_transcribe(index: int) -> Optional[str]:
+                audio = await downloader.download(url_for(index), "speech", "best", "bench")
+                try:
+                    if not audio.get("success"):
+                        return result_error(audio)
+                    return result_error(await processor.transcribe_audio(audio["file_path"], "audio/webm"))
+                finally:
+                    await downloader.release(audio)
+
+            async def op_chat(index: int) -> Optional[str]:
+                return result_error(await processor.chat(f"Benchmark question #{index}"))
+
+            ops = {"info": op_info, "download": op_download, "transcribe": op_transcribe, "chat": op_chat}
+            try:
+                stats = await drive_load(ops[workload], args.requests, args.concurrency)
+            finally:
+                await processor.close()
+            latencies = stats["latencies"]
+            failed = sum(stats["errors"].values())
+            ms = 1000.0
+            print(f"{workload:<12}{len(latencies) - failed:>6}{failed:>6}{len(latencies) / stats['seconds']:>9.1f}"
+                  f"{percentile(latencies, 50) * ms:>9.1f}{percentile(latencies, 95) * ms:>9.1f}"
+                  f"{percentile(latencies, 99) * ms:>9.1f}{stats['peak_rss'] / (1024 * 1024):>13.1f}")
+            for error, count in sorted(stats["errors"].items()):
+                print(f"{'':<12}  {count} x {error}")
+    finally:
+        await stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def bench_stream(args):
+    """Time-to-first-content: generateContent utuh vs streamGenerateContent + ProgressiveReply"""
+    stub = StubGemini(latency=args.latency, paragraphs=args.paragraphs)
+    base_url = await stub.start()
+    header = "🤖 *Gemini AI:*\n\n"
+
+    class RecordingClient:
+        def __init__(self, fail_at: int = 0):
+            self.started = time.perf_counter()
+            self.sent: List[float] = []
+            self.texts: List[str] = []
+            self.calls = 0
+            self.fail_at = fail_at  # > 0: send_message ke-N gagal sekali (mis. koneksi WhatsApp putus)
+
+        async def send_message(self, chat, text):
+            self.calls += 1
+            if self.calls == self.fail_at:
+                raise ConnectionError("simulated WhatsApp send failure")
+            self.sent.append(time.perf_counter() - self.started)
+            self.texts.append(text)
+
+    def words(text: str) -> List[str]:
+        return text.replace(header, "").split()
+
+    try:
+        print(f"Gemini stub: {args.latency:.1f}s total generation, {args.paragraphs} paragraphs")
+        print(f"{'mode':<12}{'first msg s':>12}{'last msg s':>12}{'messages':>10}{'ok':>6}{'complete':>10}{'undelivered':>13}")
+        # "send-fail": pesan ke-2 gagal dikirim; kalau jatuh di pesan streaming sisanya dikirim ulang oleh finish,
+        # kalau jatuh di finish sisa teksnya dilaporkan di kolom undelivered
+        for mode, streaming, fail_at in (("blocking", False, 0), ("streaming", True, 0), ("send-fail", True, 2)):
+            processor = bot.AIProcessor("bench-key", api_base=base_url, streaming=streaming)
+            client = RecordingClient(fail_at)
+            reply = bot.ProgressiveReply(client, "bench-chat", header, min_chars=args.min_chars)
+            result = await processor.chat("Benchmark question", reply.feed)
+            if result["success"]:
+                await reply.finish(result["response"])
+            await processor.close()
+            complete = result["success"] and words("\n\n".join(client.texts)) == words(result["response"])
+            # Sisa teks yang tidak sampai ke user (mis. pesan terakhir gagal terkirim)
+            undelivered = len(result["response"]) - reply.delivered if result["success"] else 0
+            print(f"{mode:<12}{client.sent[0] if client.sent else 0:>12.2f}{client.sent[-1] if client.sent else 0:>12.2f}"
+                  f"{len(client.sent):>10}{str(result['success']):>6}{str(complete):>10}{undelivered:>13}")
+    finally:
+        await stub.stop()
+
+
+async def drive_open_loop(op, total: int, rate: float) -> Dict[str, Any]:
+    """Open loop: request datang dengan laju tetap, tidak menunggu jawaban sebelumnya (seperti pesan user)"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def run(index: int):
+        started = time.perf_counter()
+        error = await op(index)
+        latencies.append(time.perf_counter() - started)
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+
+    start = time.perf_counter()
+    tasks = []
+    for index in range(total):
+        tasks.append(asyncio.create_task(run(index)))
+        await asyncio.sleep(1.0 / rate)
+    await asyncio.gather(*tasks)
+    return {"latencies": latencies, "errors": errors, "seconds": time.perf_counter() - start}
+
+
+async def run_chat_open_loop(processor, args) -> Dict[str, Any]:
+    async def op_chat(index: int) -> Optional[str]:
+        result = await processor.chat(f"Benchmark question #{index}")
+        return None if result["success"] else str(result.get("error", "failed"))[:40]
+
+    try:
+        return await drive_open_loop(op_chat, args.requests, args.rate)
+    finally:
+        await processor.close()
+
+
+def print_goodput_row(mode: str, stats: Dict[str, Any], rejected: int):
+    latencies = stats["latencies"]
+    failed = sum(stats["errors"].values())
+    print(f"{mode:<12}{len(latencies) - failed:>6}{failed:>6}{(len(latencies) - failed) / stats['seconds']:>11.1f}"
+          f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}{rejected:>10}")
+    for error, count in sorted(stats["errors"].items()):
+        print(f"{'':<12}  {count} x {error}")
+
+
+async def bench_resilience(args):
+    """Goodput chat ke stub Gemini dengan kuota: tanpa retry vs rate limiter + retry/backoff + circuit breaker"""
+    stub = StubGemini(latency=args.latency, error_rate=args.error_rate, quota_per_second=args.quota)
+    base_url = await stub.start()
+    print(f"{args.requests} chat requests arriving at {args.rate:.0f}/s, stub quota {args.quota:.0f} req/s, "
+          f"latency {args.latency * 1000:.0f}ms, 503 rate {args.error_rate:.0%}")
+    print(f"{'mode':<12}{'ok':>6}{'err':>6}{'goodput/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'stub 429':>10}")
+    try:
+        for mode in ("naive", "resilient"):
+            if mode == "naive":
+                # Perilaku lama: satu attempt, tanpa rate limit / circuit breaker
+                processor = bot.AIProcessor("bench-key", api_base=base_url, rate_per_minute=0, max_retries=0)
+                processor.breaker = bot.CircuitBreaker(threshold=args.requests + 1)
+            else:
+                # Sedikit di bawah kuota: jitter timing tidak langsung memicu 429
+                processor = bot.AIProcessor("bench-key", api_base=base_url, rate_per_minute=args.quota * 60 * 0.9)
+            stub.rejected = 0
+            print_goodput_row(mode, await run_chat_open_loop(processor, args), stub.rejected)
+    finally:
+        await stub.stop()
+
+
+async def bench_keys(args):
+    """Goodput chat dengan 1..N API key, masing-masing berkuota sendiri di stub Gemini"""
+    stub = StubGemini(latency=args.latency, quota_per_second=args.quota)
+    base_url = await stub.start()
+    print(f"{args.requests} chat requests arriving at {args.rate:.0f}/s, stub quota {args.quota:.0f} req/s per key, "
+          f"latency {args.latency * 1000:.0f}ms")
+    print(f"{'keys':<12}{'ok':>6}{'err':>6}{'goodput/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'stub 429':>10}")
+    try:
+        count = 1
+        while count <= args.keys:
+            keys = [f"bench-key-{index}" for index in range(count)]
+            processor = bot.AIProcessor(keys, api_base=base_url, rate_per_minute=args.quota * 60 * 0.9)
+            stub.rejected = 0
+            print_goodput_row(str(count), await run_chat_open_loop(processor, args), stub.rejected)
+            count *= 2
+    finally:
+        await stub.stop()
+
+
+async def bench_combined(args):
+    """download_with_ai summary: transkrip lalu summary (dua request) vs satu request JSON terstruktur"""
+    workdir = tempfile.mkdtemp(prefix="bench_combined_")
+    # Panjang transkrip diatur lewat jumlah paragraf jawaban stub (~250 karakter per paragraf)
+    stub = StubGemini(latency=args.latency, paragraphs=max(1, args.transcript_chars // 250))
+    base_url = await stub.start()
+    ytdlp = write_fake_ytdlp(workdir)
+    os.environ.update({"FAKE_YTDLP_LATENCY": "0", "FAKE_YTDLP_ERROR_RATE": "0",
+                       "FAKE_YTDLP_BYTES": str(int(args.media_kb * 1024))})
+    os.makedirs("downloads", exist_ok=True)
+    combined_default = bot.COMBINED_TRANSCRIBE_SUMMARY
+    print(f"{args.requests} summary requests x {args.concurrency} concurrent, Gemini latency {args.latency * 1000:.0f}ms "
+          f"per request, transcript ~{args.transcript_chars} chars, media {args.media_kb:.0f} KB")
+    print(f"{'mode':<12}{'ok':>6}{'p50 ms':>9}{'p95 ms':>9}{'gemini req':>12}{'KB sent/req':>13}")
+    try:
+        for mode, combined in (("separate", False), ("combined", True)):
+            bot.COMBINED_TRANSCRIBE_SUMMARY = combined
+            processor = bot.AIProcessor("bench-key", api_base=base_url, normalize=False, rate_per_minute=0)
+            store = bot.MediaStore(os.path.join(workdir, f"store_{mode}"))
+            downloader = bot.MediaDownloader(processor, store, ytdlp_binary=ytdlp)
+            requests_before, bytes_before = stub.requests, stub.bytes_received
+
+            async def op_summary(index: int) -> Optional[str]:
+                url = f"https://www.youtube.com/watch?v={mode}{index:06d}"
+                result = await downloader.download_with_ai(url, ["transcribe", "summary"], "720p", "bench")
+                await downloader.release(result.get("video_file"))
+                summary = result.get("ai_results", {}).get("summary") or {}
+                return None if summary.get("success") else str(summary.get("error") or result.get("error", "failed"))[:40]
+
+            try:
+                stats = await drive_load(op_summary, args.requests, args.concurrency)
+            finally:
+                await processor.close()
+            latencies = stats["latencies"]
+            failed = sum(stats["errors"].values())
+            print(f"{mode:<12}{len(latencies) - failed:>6}{percentile(latencies, 50) * 1000:>9.1f}"
+                  f"{percentile(latencies, 95) * 1000:>9.1f}{(stub.requests - requests_before) / args.requests:>12.1f}"
+                  f"{(stub.bytes_received - bytes_before) / args.requests / 1024:>13.1f}")
+            for error, count in sorted(stats["errors"].items()):
+                print(f"{'':<12}  {count} x {error}")
+    finally:
+        bot.COMBINED_TRANSCRIBE_SUMMARY = combined_default
+        await stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def bench_stitch(args):
+    """Verifikasi stitch_transcripts: overlap di ujung segment dibuang, frasa berulang di tengah tidak memotong teks"""
+    filler = " ".join(f"kata{index}" for index in range(60))
+    cases = (
+        ("tail overlap",
+         ["ini adalah bagian pertama dan kita lanjut ke topik berikutnya",
+          "lanjut ke topik berikutnya yaitu cuaca hari ini"],
+         "ini adalah bagian pertama dan kita lanjut ke topik berikutnya yaitu cuaca hari ini"),
+        ("cut-off word",
+         ["kita bahas harga beras naik lagi minggu ini",
+          "ras naik lagi minggu ini dan seterusnya"],
+         "kita bahas harga beras naik lagi minggu ini dan seterusnya"),
+        # Frasa pembuka segment berikut muncul di tengah segment sebelumnya, bukan di ujungnya
+        ("mid repeat",
+         [f"awal {filler} dan saya juga suka kopi {filler} akhir cerita",
+          "dan saya juga suka kopi di pagi hari"],
+         f"awal {filler} dan saya juga suka kopi {filler} akhir cerita\ndan saya juga suka kopi di pagi hari"),
+        ("no overlap",
+         ["segment satu selesai di sini", "segment dua mulai di sini"],
+         "segment satu selesai di sini\nsegment dua mulai di sini"),
+    )
+    failed = 0
+    print(f"{'case':<16}{'ok':>6}")
+    for label, texts, expected in cases:
+        result = bot.stitch_transcripts(texts)
+        ok = result == expected
+        failed += not ok
+        print(f"{label:<16}{str(ok):>6}")
+        if not ok:
+            print(f"  expected: {expected!r}\n  got:      {result!r}")
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for whatsapp_ai_bot")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    upload = sub.add_parser("upload", help="Peak memory: legacy vs streaming media upload to a stub Gemini")
+    upload.add_argument("--size-mb", type=float, default=10.0)
+    upload.set_defaults(func=bench_upload)
+
+    loop_lag = sub.add_parser("loop-lag", help="Event-loop latency for small commands during large media encoding")
+    loop_lag.add_argument("--size-mb", type=float, default=10.0)
+    loop_lag.add_argument("--uploads", type=int, default=4)
+    loop_lag.set_defaults(func=bench_loop_lag)
+
+    normalize = sub.add_parser("normalize", help="Upload bytes and latency: raw media vs AI-normalized media")
+    normalize.add_argument("files", nargs="*", help="Sample media files (default: generated with ffmpeg)")
+    normalize.add_argument("--seconds", type=int, default=60, help="Duration of generated audio/video samples")
+    normalize.add_argument("--latency", type=float, default=0.0, help="Stub Gemini latency per request (s)")
+    normalize.set_defaults(func=bench_normalize)
+
+    disk_read = sub.add_parser("disk-read", help="Event-loop latency while chats read media files: blocking vs async I/O")
+    disk_read.add_argument("--size-mb", type=float, default=50.0)
+    disk_read.add_argument("--chats", type=int, default=4)
+    disk_read.set_defaults(func=bench_disk_read)
+
+    detect = sub.add_parser("detect", help="Per-message cost of quoted-media detection: legacy vs single pass")
+    detect.add_argument("--iterations", type=int, default=20000)
+    detect.set_defaults(func=bench_detect)
+
+    logging_bench = sub.add_parser("logging", help="Caller-side logging cost: sync handler + f-strings vs queue + lazy + sampling")
+    logging_bench.add_argument("--iterations", type=int, default=50000)
+    logging_bench.set_defaults(func=bench_logging)
+
+    load = sub.add_parser("load", help="Throughput, p50/p95/p99 latency and peak RSS with stub Gemini and fake yt-dlp")
+    load.add_argument("--workload", choices=("info", "download", "transcribe", "chat", "all"), default="all")
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--unique-urls", type=int, default=0, help="0 = setiap request memakai URL berbeda")
+    load.add_argument("--media-kb", type=float, default=1024.0)
+    load.add_argument("--gemini-latency", type=float, default=0.2)
+    load.add_argument("--gemini-error-rate", type=float, default=0.0)
+    load.add_argument("--gemini-rpm", type=float, default=0.0, help="Client-side rate limit (0 = tanpa batas)")
+    load.add_argument("--ytdlp-latency", type=float, default=0.3)
+    load.add_argument("--ytdlp-error-rate", type=float, default=0.0)
+    load.set_defaults(func=bench_load)
+
+    stream = sub.add_parser("stream", help="Time-to-first-content: blocking generateContent vs streaming delivery")
+    stream.add_argument("--latency", type=float, default=4.0)
+    stream.add_argument("--paragraphs", type=int, default=8)
+    stream.add_argument("--min-chars", type=int, default=bot.STREAM_MIN_CHARS)
+    stream.set_defaults(func=bench_stream)
+
+    resilience = sub.add_parser("resilience", help="Goodput against a rate-limited stub Gemini: naive vs retry/backoff/rate limiter")
+    resilience.add_argument("--requests", type=int, default=200)
+    resilience.add_argument("--rate", type=float, default=30.0, help="Arrival rate (requests per second)")
+    resilience.add_argument("--quota", type=float, default=20.0, help="Stub quota (requests per second)")
+    resilience.add_argument("--latency", type=float, default=0.2)
+    resilience.add_argument("--error-rate", type=float, default=0.05, help="Random 503 rate")
+    resilience.set_defaults(func=bench_resilience)
+
+    keys = sub.add_parser("keys", help="Goodput with a pool of 1, 2, 4... Gemini API keys, each with its own quota")
+    keys.add_argument("--keys", type=int, default=4)
+    keys.add_argument("--requests", type=int, default=300)
+    keys.add_argument("--rate", type=float, default=60.0, help="Arrival rate (requests per second)")
+    keys.add_argument("--quota", type=float, default=20.0, help="Stub quota per key (requests per second)")
+    keys.add_argument("--latency", type=float, default=0.2)
+    keys.set_defaults(func=bench_keys)
+
+    combined = sub.add_parser("combined", help="Summary pipeline: transcribe + summarize requests vs one structured request")
+    combined.add_argument("--requests", type=int, default=50)
+    combined.add_argument("--concurrency", type=int, default=8)
+    combined.add_argument("--latency", type=float, default=1.0, help="Stub Gemini latency per request (s)")
+    combined.add_argument("--transcript-chars", type=int, default=20000)
+    combined.add_argument("--media-kb", type=float, default=512.0)
+    combined.set_defaults(func=bench_combined)
+
+    stitch = sub.add_parser("stitch", help="Verify long-audio transcript stitching (overlap removal, repeated phrases)")
+    stitch.set_defaults(func=bench_stitch)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,50 @@
 import asyncio
+import atexit
+import bisect
+import contextvars
+import functools
 import logging
+import logging.handlers
+import queue
 import os
+import re
 import sys
-import traceback
 import subprocess
 import tempfile
 import shutil
+import contextlib
+import email.utils
+import mimetypes
 import base64
 import json
+import hashlib
+import random
+import heapq
+import sqlite3
+import threading
+import time
+import uuid
 import aiohttp
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from aiohttp import web
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable, Union, Iterable, Sequence, Set
+from urllib.parse import urlsplit, parse_qsl, urlencode
 from neonize.aioze.client import ClientFactory, NewAClient
 from neonize.events import (
     ConnectedEv,
     MessageEv,
 )
 from neonize.proto.waE2E.WAWebProtobufsE2E_pb2 import Message
-from neonize.utils import log
+
+log = logging.getLogger("bot")
+# Logger per kategori, level bisa diatur terpisah lewat LOG_LEVELS
+ai_log = log.getChild("ai")
+download_log = log.getChild("download")
+store_log = log.getChild("store")
+media_log = log.getChild("media")
+message_log = log.getChild("message")
 
 # Tambahkan import dari thundra_io
 try:
@@ -31,83 +58,1649 @@ except ImportError:
 
 sys.path.insert(0, os.getcwd())
 
-# Konfigurasi logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-log.setLevel(logging.DEBUG)
+# Konfigurasi logging (env): LOG_LEVEL, LOG_LEVELS="ai=DEBUG,download=WARNING", LOG_FORMAT=text|json
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_BURST = int(os.environ.get("LOG_SAMPLE_BURST", "20"))   # Pesan INFO/DEBUG sejenis yang selalu ditulis per window
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", "100"))  # Setelah burst, hanya 1 dari N yang ditulis
+LOG_SAMPLE_WINDOW = 60.0                                           # Detik
+
+# Request id yang sedang diproses (diisi tracer), ditempel ke setiap log record
+current_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_request_id", default=None)
+
+class RequestIdFilter(logging.Filter):
+    """Tempel request_id dari context ke record; harus jalan di thread pemanggil, bukan listener"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id.get()
+        return True
+
+class LogSampler(logging.Filter):
+    """Sampling event INFO/DEBUG berulang (key = logger + template pesan); WARNING ke atas selalu lolos"""
+    
+    def __init__(self, burst: int = LOG_SAMPLE_BURST, every: int = LOG_SAMPLE_EVERY, window: float = LOG_SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.every = max(1, every)
+        self.window = window
+        self.suppressed = 0
+        self._windows: Dict[Tuple[str, str], List[float]] = {}  # key -> [awal window, jumlah]
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        # Template (bukan pesan jadi) sebagai key: berkat lazy formatting jumlahnya terbatas
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        state = self._windows.get(key)
+        if state is None or record.created - state[0] >= self.window:
+            if len(self._windows) > 10000:
+                self._windows.clear()
+            state = self._windows[key] = [record.created, 0]
+        state[1] += 1
+        if state[1] <= self.burst or (state[1] - self.burst) % self.every == 0:
+            return True
+        self.suppressed += 1
+        return False
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler yang tidak memformat di thread pemanggil; format + tulis dilakukan thread listener"""
+    
+    # Args immutable aman diformat belakangan; selain ini (list, dict, objek) bisa berubah sebelum listener jalan
+    SCALAR_ARGS = (str, int, float, bool, bytes, type(None))
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Record apa adanya; msg diformat sekarang hanya jika args berisi nilai mutable"""
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, self.SCALAR_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+class JSONLogFormatter(logging.Formatter):
+    """Satu objek JSON per baris log"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Semua log lewat queue: event loop hanya enqueue record, handler asli menulis dari thread listener"""
+    root = logging.getLogger()
+    handlers = list(root.handlers) or [logging.StreamHandler()]
+    if LOG_FORMAT == "json":
+        for handler in handlers:
+            handler.setFormatter(JSONLogFormatter())
+    
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(LogSampler())
+    queue_handler.addFilter(RequestIdFilter())
+    root.handlers = [queue_handler]
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    log.setLevel(LOG_LEVEL)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        category, _, level = item.partition("=")
+        try:
+            log.getChild(category.strip()).setLevel(level.strip().upper())
+        except ValueError:
+            log.warning("Invalid LOG_LEVELS entry: %s", item)
+    return listener
+
+log_listener = setup_logging()
 
 # AI Configuration
 GEMINI_API_KEY = "<APIKEY-GEMINI>"
+# Pool key: GEMINI_API_KEYS="key1,key2,key3@https://endpoint-lain" (satu key per project, kuota dijumlahkan)
+GEMINI_API_KEYS = [entry.strip() for entry in os.environ.get("GEMINI_API_KEYS", "").split(",") if entry.strip()] or [GEMINI_API_KEY]
 GEMINI_MODEL = "gemini-2.0-flash"
-GEMINI_CONTENT_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com"
+
+# Connection pool Gemini (satu pool keep-alive untuk semua request)
+GEMINI_POOL_LIMIT = 32              # Total koneksi terbuka
+GEMINI_POOL_LIMIT_PER_HOST = 16     # Koneksi per host
+GEMINI_KEEPALIVE_TIMEOUT = 60       # Detik koneksi idle dipertahankan
+GEMINI_REQUEST_TIMEOUT = 300        # Timeout total per request (detik)
+
+# Streaming (streamGenerateContent): teks panjang dikirim per paragraf selagi Gemini masih menulis
+# (summary hanya jika COMBINED_TRANSCRIBE_SUMMARY mati: response JSON gabungan dikirim sekaligus)
+GEMINI_STREAMING = os.environ.get("GEMINI_STREAMING", "1") != "0"
+STREAM_MIN_CHARS = 300              # Minimal panjang potongan paragraf per pesan WhatsApp
+
+# Resilience Gemini: rate limit client-side, retry dengan backoff, circuit breaker
+GEMINI_RATE_PER_MINUTE = int(os.environ.get("GEMINI_RATE_PER_MINUTE", "60"))  # Per key, samakan dengan kuota RPM (0 = tanpa batas)
+GEMINI_RATE_BURST = 10              # Request yang boleh langsung jalan setelah idle
+GEMINI_MAX_RETRIES = 3              # Retry untuk 429/5xx/error koneksi
+GEMINI_BACKOFF_BASE = 1.0           # Detik; backoff = random(0, base * 2^attempt)
+GEMINI_BACKOFF_MAX = 20.0
+GEMINI_RETRY_MAX_WAIT = 60.0        # Retry-After lebih lama dari ini tidak ditunggu
+GEMINI_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+CIRCUIT_FAILURE_THRESHOLD = 5       # Kegagalan beruntun sebelum circuit open
+CIRCUIT_RESET_TIMEOUT = 30.0        # Detik sebelum satu request percobaan (half-open)
+
+# Upload media di-stream per chunk (kelipatan 3 byte agar base64 per chunk tanpa padding)
+UPLOAD_CHUNK_SIZE = 3 * 64 * 1024
+PAYLOAD_WORKERS = 2                 # Thread untuk baca/base64/hash payload di luar event loop
+IO_WORKERS = 4                      # Thread untuk file I/O media (stat, tulis, hapus, temp dir)
+
+# Cache hasil AI (key = hash media + mime + prompt + model)
+AI_CACHE_DB = "ai_cache.sqlite3"
+AI_CACHE_MEMORY_ENTRIES = 256       # Entry LRU di memory
+AI_CACHE_MAX_ENTRIES = 5000         # Entry maksimal di SQLite
+AI_CACHE_TTL = 7 * 24 * 3600        # Umur maksimal entry (detik)
+
+# Scheduler job: lane "heavy" (yt-dlp / Gemini) dan "light" (ping, help, info)
+SCHEDULER_MAX_HEAVY = 4             # Job berat berjalan bersamaan (global)
+SCHEDULER_MAX_HEAVY_PER_CHAT = 1    # Job berat berjalan bersamaan per chat
+SCHEDULER_MAX_LIGHT = 32            # Job ringan berjalan bersamaan (global)
+SCHEDULER_MAX_QUEUED_PER_CHAT = 5   # Job menunggu per chat per lane; lebih dari ini ditolak
+SCHEDULER_MAX_QUEUED = 200          # Job menunggu per lane (global)
+
+# Executable yt-dlp (bisa diganti, mis. yt-dlp palsu untuk benchmark offline)
+YTDLP_BINARY = os.environ.get("YTDLP_BINARY", "yt-dlp")
+
+# Cache metadata yt-dlp (key = extractor + video id)
+INFO_CACHE_MAX_ENTRIES = 1000
+INFO_CACHE_TTL = 6 * 3600
+
+# Media store: hasil download disimpan per (extractor:id, format), LRU dengan kuota disk
+MEDIA_STORE_DIR = "media_store"
+MEDIA_STORE_MAX_BYTES = 2 * 1024 ** 3
+
+# Disk janitor: batas umur + budget disk total untuk downloads/, temp_media/ dan media store
+JANITOR_DIRS = ("downloads", "temp_media", "traces")
+JANITOR_INTERVAL = 300              # Detik antar sweep
+JANITOR_MAX_AGE = 24 * 3600         # File lebih tua dari ini selalu dihapus
+JANITOR_DISK_BUDGET = 4 * 1024 ** 3 # Total byte semua direktori kerja
+JANITOR_MIN_AGE = 3600              # File lepas yang lebih muda tidak dihapus demi budget (mungkin sedang ditulis)
+JANITOR_BATCH = 200                 # Maksimal file diproses per sweep
+JANITOR_RESCAN_INTERVAL = 6 * 3600  # Scan ulang direktori untuk file yang tidak ter-track
+
+# Transkripsi audio panjang: dipotong di titik hening lalu ditranskrip paralel
+LONG_AUDIO_THRESHOLD = 15 * 60      # Durasi (detik) mulai memakai mode long-audio
+LONG_AUDIO_SEGMENT = 8 * 60         # Target panjang segment (detik)
+LONG_AUDIO_OVERLAP = 4              # Overlap antar segment (detik)
+LONG_AUDIO_CONCURRENCY = 4          # Segment yang ditranskrip bersamaan
+SILENCE_NOISE_DB = -30              # Ambang hening untuk silencedetect
+SILENCE_MIN_DURATION = 0.4          # Durasi hening minimal (detik)
+
+# Normalisasi media sebelum dikirim ke Gemini (format optimal, upload lebih kecil)
+AI_AUDIO_SAMPLE_RATE = 16000        # Gemini memproses audio sebagai 16 kHz mono
+AI_AUDIO_BITRATE = "24k"            # Bitrate Opus untuk speech
+AI_IMAGE_MAX_SIDE = 1536            # Sisi terpanjang gambar (px)
+SPEECH_AUDIO_FORMAT = "bestaudio[abr<=96]/bestaudio/worst"  # Format yt-dlp untuk audio yang hanya ditranskrip
+
+# Storyboard video untuk analisis AI: frame kunci (scene change) + audio kecil
+STORYBOARD_MAX_FRAMES = 12          # Jumlah frame maksimal per video
+STORYBOARD_SCENE_THRESHOLD = 0.3    # Ambang scene change ffmpeg (0-1)
+STORYBOARD_FRAME_WIDTH = 512        # Lebar frame JPEG (px)
+STORYBOARD_FALLBACK_MAX_BYTES = 15 * 1024 * 1024  # Kirim video utuh jika ffmpeg gagal dan file kecil
+
+# Metrics: endpoint format Prometheus di GET /metrics (METRICS_PORT=0 untuk mematikan)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Tracing per request: trace terakhir bisa diambil di GET /traces, request lambat ditulis ke TRACE_DIR
+TRACE_KEEP = 200                    # Trace terakhir yang disimpan di memory
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", "30"))  # 0 = tulis semua trace ke file
+TRACE_DIR = "traces"
 
 # Setup client
 client_factory = ClientFactory("db.sqlite3")
 os.makedirs("downloads", exist_ok=True)
 os.makedirs("temp_media", exist_ok=True)
+os.makedirs(TRACE_DIR, exist_ok=True)
 
 # Load existing sessions
 sessions = client_factory.get_all_devices()
 for device in sessions:
     client_factory.new_client(device.JID)
 
+TRANSCRIBE_PROMPT = "Please transcribe this audio to text. Provide the transcription in the same language as the audio. If the audio is in Indonesian, respond in Indonesian. If it's in English, respond in English. Just provide the transcription without additional commentary."
+
+# Mode gabungan summary/smart: transkrip + ringkasan dalam satu request dengan response JSON terstruktur
+# Menggantikan streaming per paragraf untuk summary (JSON baru bisa di-parse setelah lengkap)
+COMBINED_TRANSCRIBE_SUMMARY = os.environ.get("COMBINED_TRANSCRIBE_SUMMARY", "1") != "0"
+TRANSCRIBE_SUMMARY_PROMPT = """Transcribe this audio and summarize it.
+- transcription: the full transcription in the same language as the audio, without additional commentary
+- summary: a concise summary in Indonesian (2-3 main sentences)
+- key_points: the important points, in Indonesian
+- category: one category in Indonesian (musik, tutorial, berita, podcast, dll)"""
+TRANSCRIBE_SUMMARY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "transcription": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+        "key_points": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "category": {"type": "STRING"},
+    },
+    "required": ["transcription", "summary", "key_points", "category"],
+    "propertyOrdering": ["transcription", "summary", "key_points", "category"],
+}
+
+def format_structured_summary(data: Dict[str, Any]) -> str:
+    """Susun ringkasan terstruktur dengan bagian yang sama seperti prompt summary biasa"""
+    lines = [f"📝 *Ringkasan Singkat*\n{data['summary'].strip()}"]
+    key_points = [point.strip() for point in data.get("key_points") or [] if point.strip()]
+    if key_points:
+        lines.append("🎯 *Poin-poin Penting*\n" + "\n".join(f"• {point}" for point in key_points))
+    if data.get("category"):
+        lines.append(f"🏷️ *Kategori:* {data['category'].strip()}")
+    return "\n\n".join(lines)
+
+def default_analysis_prompt(mime_type: str) -> str:
+    """Default prompt analisis berdasarkan mime type"""
+    if "image" in mime_type:
+        return "Describe this image in detail. What do you see? Respond in Indonesian."
+    elif "video" in mime_type:
+        return "Describe this video. What's happening? Respond in Indonesian."
+    elif "audio" in mime_type:
+        return "Transcribe and summarize this audio content. Respond in Indonesian."
+    return "Analyze this media content and provide insights. Respond in Indonesian."
+
+def youtube_prompt(media_type: str) -> str:
+    """Prompt analisis untuk YouTube content creation"""
+    return f"""Analisis {media_type} ini dan buatkan:
+
+JUDUL YOUTUBE (3 pilihan terbaik):
+- Maksimal 60 karakter, menarik, SEO-friendly
+- [berikan 3 variasi judul]
+
+DESKRIPSI:
+- Paragraf pembuka yang hook (2-3 kalimat)
+- Ringkasan isi {media_type}
+- Call-to-action
+- Timestamps jika perlu
+
+HASHTAG (15 hashtag):
+- Mix antara viral, niche, dan long-tail
+- Urutkan dari umum ke spesifik
+
+BONUS:
+- Target audience utama
+- Waktu upload terbaik
+- Ide thumbnail
+
+Fokus pada konten yang benar-benar ada di {media_type}. Buat yang viral tapi tetap relevan!
+
+Respond dalam bahasa Indonesia dengan format yang rapi dan mudah dibaca."""
+
+# Pekerjaan CPU untuk payload (base64, hashing) tidak boleh memblokir event loop
+payload_executor = ThreadPoolExecutor(max_workers=PAYLOAD_WORKERS, thread_name_prefix="payload")
+
+# File I/O media di thread pool sendiri: disk lambat tidak boleh menahan chat lain
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="file-io")
+
+async def run_io(func: Callable[..., Any], *args: Any) -> Any:
+    """Jalankan operasi filesystem blocking di io_executor"""
+    return await asyncio.get_running_loop().run_in_executor(io_executor, func, *args)
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return None
+
+async def file_size(path: str) -> Optional[int]:
+    """Ukuran file, None jika file tidak ada"""
+    return await run_io(_file_size, path)
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def read_file(path: str) -> bytes:
+    """Baca seluruh file tanpa memblokir event loop"""
+    return await run_io(_read_file, path)
+
+def _write_file(path: str, data: Union[bytes, bytearray, memoryview]):
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def write_file(path: str, data: Union[bytes, bytearray, memoryview]):
+    """Tulis bytes ke file tanpa memblokir event loop"""
+    await run_io(_write_file, path, data)
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+async def remove_file(path: str) -> bool:
+    """Hapus file (tidak error jika sudah tidak ada)"""
+    return await run_io(_remove_file, path)
+
+# DiskJanitor aktif (diisi saat inisialisasi komponen); file kerja dilaporkan saat dibuat / dihapus
+janitor: Optional["DiskJanitor"] = None
+
+@contextlib.asynccontextmanager
+async def temp_workdir(parent: str = "temp_media"):
+    """Direktori kerja sementara; mkdtemp dan rmtree berjalan di io_executor"""
+    workdir = await run_io(tempfile.mkdtemp, "", "tmp", parent)
+    try:
+        yield workdir
+    finally:
+        await run_io(shutil.rmtree, workdir, True)
+        # Sisa yang gagal dihapus langsung masuk index janitor, tidak menunggu rescan
+        if janitor is not None and await run_io(os.path.exists, workdir):
+            await janitor.track_tree(workdir)
+
+# Tracing: span bersarang per stage dalam satu request, export ke Chrome trace format
+class Span:
+    """Satu stage dalam trace; args berisi ukuran payload, outcome, dll"""
+    __slots__ = ("name", "start", "end", "tid", "args")
+    
+    def __init__(self, name: str, start: float, tid: int, args: Dict[str, Any]):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.tid = tid
+        self.args = args
+
+class Trace:
+    """Timeline satu request: span dari task yang sama ditaruh di track (tid) yang sama"""
+    
+    def __init__(self, request_id: str, name: str, **args: Any):
+        self.request_id = request_id
+        self.name = name
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+        self._tids: Dict[int, int] = {}
+        self.root = self.open(name, tid=1, **args)
+    
+    def bind_task(self, tid: int = 1):
+        """Task yang sedang berjalan memakai track tid (handler utama = track root)"""
+        self._tids[id(asyncio.current_task())] = tid
+    
+    def open(self, name: str, tid: Optional[int] = None, **args: Any) -> Span:
+        if tid is None:
+            task_id = id(asyncio.current_task())
+            tid = self._tids.get(task_id)
+            if tid is None:
+                tid = self._tids[task_id] = max(self._tids.values(), default=1) + 1
+        span = Span(name, time.perf_counter(), tid, args)
+        self.spans.append(span)
+        return span
+    
+    def finish(self):
+        self.root.end = time.perf_counter()
+    
+    @property
+    def duration(self) -> float:
+        return (self.root.end or time.perf_counter()) - self.root.start
+    
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="milliseconds"),
+            "duration": round(self.duration, 3),
+            "outcome": self.root.args.get("outcome", "running"),
+            "spans": len(self.spans),
+        }
+    
+    def to_chrome(self) -> Dict[str, Any]:
+        """Format Chrome trace (chrome://tracing / Perfetto): complete event "X", ts/dur dalam mikrodetik"""
+        now = time.perf_counter()
+        events: List[Dict[str, Any]] = [
+            {"name": "process_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": f"{self.name} {self.request_id}"}},
+        ]
+        for tid in sorted({span.tid for span in self.spans}):
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                           "args": {"name": "request" if tid == 1 else f"task-{tid - 1}"}})
+        for span in self.spans:
+            end = span.end if span.end is not None else now
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".", 1)[0],
+                "ph": "X",
+                "pid": 1,
+                "tid": span.tid,
+                "ts": round((span.start - self.origin) * 1e6, 1),
+                "dur": round((end - span.start) * 1e6, 1),
+                "args": span.args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.summary()}
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+@contextlib.contextmanager
+def trace_span(name: str, **args: Any):
+    """Span anak dari span aktif; tanpa trace aktif (mis. benchmark) tidak melakukan apa-apa"""
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    span = trace.open(name, **args)
+    token = current_span.set(span)
+    try:
+        yield span
+    except asyncio.CancelledError:
+        span.args["outcome"] = "cancelled"
+        raise
+    except Exception as e:
+        span.args["outcome"] = "error"
+        span.args["error"] = type(e).__name__
+        raise
+    finally:
+        span.args.setdefault("outcome", "ok")
+        span.end = time.perf_counter()
+        current_span.reset(token)
+
+def annotate_span(**args: Any):
+    """Tambahkan atribut (ukuran payload, status, dll) ke span aktif"""
+    span = current_span.get()
+    if span is not None:
+        span.args.update(args)
+
+class Tracer:
+    """Buat trace per request, simpan yang terbaru, tulis trace request lambat ke disk"""
+    
+    def __init__(self, keep: int = TRACE_KEEP, slow_seconds: float = TRACE_SLOW_SECONDS, trace_dir: str = TRACE_DIR):
+        self.keep = keep
+        self.slow_seconds = slow_seconds
+        self.trace_dir = trace_dir
+        self.recent: "OrderedDict[str, Trace]" = OrderedDict()
+    
+    def start(self, name: str, **args: Any) -> Trace:
+        trace = Trace(uuid.uuid4().hex[:12], name, **args)
+        self.recent[trace.request_id] = trace
+        while len(self.recent) > self.keep:
+            self.recent.popitem(last=False)
+        return trace
+    
+    async def run(self, trace: Trace, job: Callable[[], Awaitable[Any]]) -> Any:
+        """Jalankan job di dalam context trace (dipanggil dari task scheduler, bukan task intake)"""
+        trace.bind_task()
+        tokens = (current_trace.set(trace), current_span.set(trace.root), current_request_id.set(trace.request_id))
+        try:
+            return await job()
+        except Exception as e:
+            trace.root.args["outcome"] = "error"
+            trace.root.args["error"] = type(e).__name__
+            raise
+        finally:
+            trace.root.args.setdefault("outcome", "ok")
+            trace.finish()
+            current_trace.reset(tokens[0])
+            current_span.reset(tokens[1])
+            current_request_id.reset(tokens[2])
+            if trace.duration >= self.slow_seconds:
+                await self.export(trace)
+    
+    async def export(self, trace: Trace) -> Optional[str]:
+        """Tulis trace ke TRACE_DIR/<request_id>.json (buka di chrome://tracing atau ui.perfetto.dev)"""
+        path = os.path.join(self.trace_dir, f"{trace.request_id}.json")
+        try:
+            data = await run_io(lambda: json.dumps(trace.to_chrome(), default=str).encode("utf-8"))
+            await write_file(path, data)
+        except (OSError, TypeError, ValueError) as e:
+            log.warning("Failed to export trace %s: %s", trace.request_id, e)
+            return None
+        log.info("Trace %s (%s, %.1fs) written to %s", trace.request_id, trace.name, trace.duration, path)
+        if janitor is not None:
+            await janitor.track(path)
+        return path
+    
+    async def _handle_list(self, request: web.Request) -> web.Response:
+        return web.json_response([trace.summary() for trace in reversed(self.recent.values())])
+    
+    async def _handle_trace(self, request: web.Request) -> web.Response:
+        trace = self.recent.get(request.match_info["request_id"])
+        if trace is None:
+            raise web.HTTPNotFound(text="Unknown request id")
+        return web.json_response(trace.to_chrome(), dumps=lambda data: json.dumps(data, default=str))
+
+tracer = Tracer()
+
+# Metrics in-process, dirender ke format teks Prometheus
+LabelKey = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """Histogram bucket tetap (le = batas atas inklusif)"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Slot terakhir = +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+def format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metrics:
+    """Registry counter + histogram, plus collector untuk nilai yang dibaca saat scrape (queue, cache)"""
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._meta: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.routes: List[Tuple[str, Callable[[web.Request], Awaitable[web.Response]]]] = []
+    
+    def describe(self, name: str, kind: str, help_text: str):
+        self._meta[name] = (kind, help_text)
+    
+    def inc(self, name: str, value: float = 1, **labels: str):
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+    
+    def observe(self, name: str, value: float, **labels: str):
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self.buckets)
+        histogram.observe(value)
+    
+    def collector(self, func: Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]):
+        """Decorator: func() menghasilkan (name, labels, value) setiap kali /metrics dibaca"""
+        self._collectors.append(func)
+        return func
+    
+    def record_stage(self, stage: str, started: float, error: Optional[str] = None):
+        self.observe("bot_stage_duration_seconds", time.perf_counter() - started,
+                     stage=stage, outcome="error" if error else "ok")
+        if error:
+            self.inc("bot_errors_total", stage=stage, type=error)
+    
+    def instrument(self, stage: str):
+        """Decorator coroutine: latency + span per stage; exception dan hasil {"success": False} dihitung sebagai error"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with trace_span(stage) as span:
+                    started = time.perf_counter()
+                    try:
+                        result = await func(*args, **kwargs)
+                    except Exception as e:
+                        self.record_stage(stage, started, type(e).__name__)
+                        raise
+                    failed = isinstance(result, dict) and result.get("success") is False
+                    self.record_stage(stage, started, "failed_result" if failed else None)
+                    if failed and span is not None:
+                        span.args.update(outcome="failed_result", error=str(result.get("error"))[:200])
+                    return result
+            return wrapper
+        return decorator
+    
+    def render(self) -> str:
+        """Snapshot semua metrics dalam format teks Prometheus 0.0.4"""
+        lines: List[str] = []
+        
+        def header(name: str, default_kind: str):
+            kind, help_text = self._meta.get(name, (default_kind, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        for name, series in self._counters.items():
+            header(name, "counter")
+            for key, value in series.items():
+                lines.append(f"{name}{format_labels(key)} {format_metric_value(value)}")
+        
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for name, series in self._histograms.items():
+            header(name, "histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(key)} {repr(histogram.sum)}")
+                lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+        
+        collected: Dict[str, List[Tuple[LabelKey, float]]] = {}
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    collected.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception as e:
+                log.warning("Metrics collector %s failed: %s", getattr(collect, "__name__", collect), e)
+        for name, samples in collected.items():
+            header(name, "gauge")
+            for key, value in samples:
+                lines.append(f"{name}{format_labels(key)} {format_metric_value(value)}")
+        return "\n".join(lines) + "\n"
+    
+    async def _handle_scrape(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    
+    async def start_server(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        """Jalankan endpoint /metrics lokal (tidak dijalankan jika port 0)"""
+        if not port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_scrape)
+        for path, handler in self.routes:
+            app.router.add_get(path, handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, host, port).start()
+        except OSError as e:
+            log.warning("Metrics endpoint unavailable on %s:%s: %s", host, port, e)
+            await self.stop_server()
+            return
+        log.info("Metrics endpoint on http://%s:%s/metrics", host, port)
+    
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics = Metrics()
+metrics.routes += [("/traces", tracer._handle_list), ("/traces/{request_id}", tracer._handle_trace)]
+metrics.describe("bot_stage_duration_seconds", "histogram", "Latency per pipeline stage (AI call, yt-dlp, send)")
+metrics.describe("bot_command_duration_seconds", "histogram", "End-to-end latency per command")
+metrics.describe("bot_queue_wait_seconds", "histogram", "Time a job waited in the scheduler queue")
+metrics.describe("bot_errors_total", "counter", "Errors by stage and type")
+metrics.describe("bot_bytes_total", "counter", "Bytes transferred by channel and direction")
+metrics.describe("bot_gemini_responses_total", "counter", "Gemini HTTP responses by status")
+metrics.describe("bot_gemini_first_chunk_seconds", "histogram", "Time to first streamed Gemini text chunk")
+metrics.describe("bot_gemini_retries_total", "counter", "Gemini request retries by reason")
+metrics.describe("bot_gemini_rejected_total", "counter", "Gemini requests rejected without being sent")
+metrics.describe("bot_gemini_key_requests_total", "counter", "Gemini request attempts per API key")
+metrics.describe("bot_gemini_throttle_seconds", "histogram", "Time spent waiting for the client-side rate limiter")
+
+class InstrumentedClient:
+    """Proxy client neonize: semua send_*/reply_*/download_* dicatat latency, byte dan error-nya"""
+    
+    def __init__(self, client):
+        self._client = client
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not name.startswith(("send_", "reply_", "download_")) or not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            stage = f"whatsapp.{name}"
+            with trace_span(stage):
+                started = time.perf_counter()
+                try:
+                    result = await attr(*args, **kwargs)
+                except Exception as e:
+                    metrics.record_stage(stage, started, type(e).__name__)
+                    raise
+                metrics.record_stage(stage, started)
+                if name.startswith("download_"):
+                    if isinstance(result, (bytes, bytearray)):
+                        metrics.inc("bot_bytes_total", len(result), channel="whatsapp", direction="in")
+                        annotate_span(bytes_in=len(result))
+                else:
+                    payload = next((arg for arg in args if isinstance(arg, (str, bytes, bytearray, memoryview))), None)
+                    sent = await self._payload_size(payload, is_text=name in ("send_message", "reply_message"))
+                    metrics.inc("bot_bytes_total", sent, channel="whatsapp", direction="out")
+                    annotate_span(bytes_out=sent)
+                return result
+        return wrapper
+    
+    @staticmethod
+    async def _payload_size(payload: Any, is_text: bool) -> int:
+        if isinstance(payload, str):
+            # Selain teks pesan, string adalah path file media (send_video/send_audio)
+            if not is_text:
+                try:
+                    size = await file_size(payload)
+                except OSError:
+                    size = None
+                if size is not None:
+                    return size
+            return len(payload.encode("utf-8"))
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            return len(payload)
+        return 0
+
+# Media bisa berupa bytes di memory atau path file di disk
+MediaSource = Union[bytes, bytearray, memoryview, str]
+
+# Callback untuk potongan teks streaming dari Gemini: return True jika ada pesan yang benar-benar terkirim;
+# None = stream diulang (retry), buang teks yang masih di-buffer
+TextCallback = Callable[[Optional[str]], Awaitable[bool]]
+
+MEDIA_PLACEHOLDER_RE = re.compile(r"@@MEDIA_(\d+)@@")
+
+def media_size(media: MediaSource) -> int:
+    """Ukuran media dalam bytes"""
+    if isinstance(media, str):
+        return os.path.getsize(media)
+    return len(media)
+
+def iter_media_chunks(media: MediaSource, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Baca media per chunk tanpa menyalin seluruh isi ke memory"""
+    if isinstance(media, str):
+        with open(media, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    else:
+        view = memoryview(media)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+
+def encode_next_chunk(chunks) -> Optional[bytes]:
+    """Baca + base64 satu chunk berikutnya (dijalankan di payload_executor)"""
+    chunk = next(chunks, None)
+    return None if chunk is None else base64.b64encode(chunk)
+
+def inline_media_part(index: int, mime_type: str) -> Dict[str, Any]:
+    """Part inline_data dengan placeholder; data asli diisi StreamingJSONBody"""
+    return {"inline_data": {"mime_type": mime_type, "data": f"@@MEDIA_{index}@@"}}
+
+class StreamingJSONBody:
+    """Body JSON Gemini yang meng-encode media ke base64 secara streaming (memory konstan)"""
+    
+    def __init__(self, payload: Dict[str, Any], media: List[MediaSource], chunk_size: int = UPLOAD_CHUNK_SIZE):
+        if chunk_size % 3:
+            raise ValueError("chunk_size must be a multiple of 3")
+        self.media = media
+        self.chunk_size = chunk_size
+        
+        pieces = MEDIA_PLACEHOLDER_RE.split(json.dumps(payload))
+        # pieces = [json, index, json, index, ..., json]
+        self._segments = [piece.encode("utf-8") for piece in pieces[0::2]]
+        self._order = [int(index) for index in pieces[1::2]]
+        
+        self.content_length = sum(len(segment) for segment in self._segments)
+        for index in self._order:
+            self.content_length += 4 * ((media_size(media[index]) + 2) // 3)
+    
+    async def stream(self):
+        """Async iterator bytes body (bisa dipanggil ulang untuk retry)"""
+        loop = asyncio.get_running_loop()
+        for position, index in enumerate(self._order):
+            yield self._segments[position]
+            chunks = iter_media_chunks(self.media[index], self.chunk_size)
+            while True:
+                encoded = await loop.run_in_executor(payload_executor, encode_next_chunk, chunks)
+                if encoded is None:
+                    break
+                yield encoded
+        yield self._segments[-1]
+
+class AIResultCache:
+    """Content-addressed cache untuk hasil AI: LRU di memory + SQLite persistent"""
+    
+    def __init__(self, db_path: str = AI_CACHE_DB, memory_entries: int = AI_CACHE_MEMORY_ENTRIES,
+                 max_entries: int = AI_CACHE_MAX_ENTRIES, ttl: float = AI_CACHE_TTL):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+    
+    @staticmethod
+    def make_key(media: MediaSource, mime_type: str, prompt: str, model: str = GEMINI_MODEL) -> str:
+        """Hash dari (media bytes, mime type, prompt, model)"""
+        digest = hashlib.sha256()
+        for chunk in iter_media_chunks(media, 1024 * 1024 * 3):
+            digest.update(chunk)
+        for field in (mime_type, prompt or "", model):
+            digest.update(b"\0")
+            digest.update(field.encode("utf-8"))
+        return digest.hexdigest()
+    
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_results ("
+                "key TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL, result TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ai_results_accessed ON ai_results (accessed)")
+            self._conn.commit()
+        return self._conn
+    
+    def _db_get(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._db_lock:
+            db = self._db()
+            row = db.execute("SELECT created, result FROM ai_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            created, result = row
+            if now - created > self.ttl:
+                db.execute("DELETE FROM ai_results WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE ai_results SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+            return created, json.loads(result)
+    
+    def _db_set(self, key: str, result: Dict[str, Any], now: float):
+        with self._db_lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO ai_results (key, created, accessed, result) VALUES (?, ?, ?, ?)",
+                (key, now, now, json.dumps(result)),
+            )
+            self._writes += 1
+            # Eviction TTL + ukuran dijalankan berkala, bukan di setiap write
+            if self._writes % 100 == 1:
+                db.execute("DELETE FROM ai_results WHERE created < ?", (now - self.ttl,))
+                db.execute(
+                    "DELETE FROM ai_results WHERE key IN ("
+                    "SELECT key FROM ai_results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            db.commit()
+    
+    def _remember(self, key: str, created: float, result: Dict[str, Any]):
+        self._memory[key] = (created, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Ambil hasil dari memory, lalu SQLite"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            created, result = entry
+            if now - created <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return dict(result, cached=True)
+            del self._memory[key]
+        
+        try:
+            row = await asyncio.get_running_loop().run_in_executor(None, self._db_get, key, now)
+        except Exception as e:
+            store_log.warning("AI cache read error: %s", e)
+            row = None
+        
+        if row is None:
+            self.misses += 1
+            return None
+        
+        created, result = row
+        self._remember(key, created, result)
+        self.hits += 1
+        return dict(result, cached=True)
+    
+    async def set(self, key: str, result: Dict[str, Any]):
+        """Simpan hasil sukses ke memory dan SQLite"""
+        if not result.get("success"):
+            return
+        now = time.time()
+        self._remember(key, now, result)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._db_set, key, result, now)
+        except Exception as e:
+            store_log.warning("AI cache write error: %s", e)
+
+# Helper ffmpeg untuk memotong audio panjang
+async def run_subprocess(*cmd: str) -> Tuple[int, bytes, bytes]:
+    """Jalankan proses eksternal, return (returncode, stdout, stderr)"""
+    with trace_span(f"subprocess.{os.path.basename(cmd[0])}"):
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        annotate_span(returncode=process.returncode, stdout_bytes=len(stdout))
+        return process.returncode, stdout, stderr
+
+async def probe_duration(path: str) -> float:
+    """Durasi media (detik) via ffprobe"""
+    returncode, stdout, stderr = await run_subprocess(
+        "ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path
+    )
+    if returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {stderr.decode(errors='replace')[:200]}")
+    return float(stdout.decode().strip() or 0)
+
+SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+async def detect_silences(path: str) -> List[float]:
+    """Titik tengah setiap jeda hening (detik) via ffmpeg silencedetect"""
+    returncode, _, stderr = await run_subprocess(
+        "ffmpeg", "-hide_banner", "-nostats", "-i", path,
+        "-af", f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION}",
+        "-f", "null", "-"
+    )
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg silencedetect failed: {stderr.decode(errors='replace')[-200:]}")
+    midpoints = []
+    start = None
+    for kind, value in SILENCE_RE.findall(stderr.decode(errors="replace")):
+        if kind == "start":
+            start = float(value)
+        elif start is not None:
+            midpoints.append((start + float(value)) / 2)
+            start = None
+    return midpoints
+
+def plan_segments(duration: float, silences: List[float], target: float = LONG_AUDIO_SEGMENT,
+                  overlap: float = LONG_AUDIO_OVERLAP) -> List[Tuple[float, float]]:
+    """Bagi durasi menjadi segment ~target detik, dipotong di hening terdekat, dengan overlap"""
+    boundaries = [0.0]
+    while duration - boundaries[-1] > target * 1.25:
+        ideal = boundaries[-1] + target
+        window = target * 0.25
+        candidates = [s for s in silences if abs(s - ideal) <= window]
+        boundaries.append(min(candidates, key=lambda s: abs(s - ideal)) if candidates else ideal)
+    boundaries.append(duration)
+    return [
+        (max(0.0, start - overlap if index else start), end)
+        for index, (start, end) in enumerate(zip(boundaries, boundaries[1:]))
+    ]
+
+async def split_audio_on_silence(path: str, workdir: str) -> List[str]:
+    """Potong audio menjadi segment overlap di batas hening, return list path segment"""
+    duration = await probe_duration(path)
+    silences = await detect_silences(path)
+    segments = plan_segments(duration, silences)
+    ext = os.path.splitext(path)[1] or ".mp3"
+    
+    async def cut(index: int, start: float, end: float) -> str:
+        out_path = os.path.join(workdir, f"segment_{index:03d}{ext}")
+        returncode, _, stderr = await run_subprocess(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", path,
+            "-vn", "-c:a", "copy", out_path
+        )
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg cut failed: {stderr.decode(errors='replace')[:200]}")
+        return out_path
+    
+    media_log.info("Splitting %.0fs audio into %s segments", duration, len(segments))
+    return list(await asyncio.gather(*[cut(i, start, end) for i, (start, end) in enumerate(segments)]))
+
+WORD_RE = re.compile(r"\S+")
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+def stitch_transcripts(texts: List[str], window: int = 80, min_match: int = 3) -> str:
+    """Gabungkan transkrip segment berurutan, buang teks duplikat di area overlap"""
+    result = ""
+    for text in texts:
+        text = text.strip()
+        if not result:
+            result = text
+            continue
+        
+        prev_words = [(m.start(), m.end(), _normalize_word(m.group())) for m in WORD_RE.finditer(result)][-window:]
+        next_words = [(m.start(), m.end(), _normalize_word(m.group())) for m in WORD_RE.finditer(text)][:window]
+        prev_norm = [w for _, _, w in prev_words]
+        next_norm = [w for _, _, w in next_words]
+        
+        # Overlap hanya sah jika menempel di ujung segment sebelumnya: ekor prev == awal next
+        # (boleh lewati 2 kata terpotong di awal next), prefix terpanjang dicoba dulu
+        next_start = None
+        for skip in range(0, 3):
+            for length in range(min(len(next_norm) - skip, len(prev_norm)), min_match - 1, -1):
+                if prev_norm[-length:] == next_norm[skip:skip + length]:
+                    next_start = skip + length
+                    break
+            if next_start:
+                break
+        
+        if next_start:
+            # Kata yang sudah ada di ekor segment sebelumnya dibuang dari awal segment berikut
+            result = (result + text[next_words[next_start - 1][1]:]).strip()
+        else:
+            result = f"{result}\n{text}"
+    return result
+
+# Helper ffmpeg untuk storyboard video
+SHOWINFO_PTS_RE = re.compile(r"pts_time:\s*([\d.]+)")
+
+async def extract_keyframes(path: str, workdir: str, duration: float,
+                            max_frames: int = STORYBOARD_MAX_FRAMES) -> List[Tuple[str, float]]:
+    """Ambil frame kunci tersebar di seluruh video, return [(path_jpeg, detik)]"""
+    # Scene change, tapi dengan jarak minimal agar frame menyebar di seluruh durasi
+    min_gap = max(duration / max_frames, 1.0) if duration else 5.0
+    filters = [
+        f"select='eq(n,0)+gt(scene,{STORYBOARD_SCENE_THRESHOLD})*gte(t-prev_selected_t,{min_gap:.2f})'",
+        # Video statis (sedikit scene change): sampling rata berdasarkan waktu
+        f"select='eq(n,0)+gte(t-prev_selected_t,{min_gap:.2f})'",
+    ]
+    frames: List[Tuple[str, float]] = []
+    for attempt, select in enumerate(filters):
+        pattern = os.path.join(workdir, f"frame{attempt}_%03d.jpg")
+        returncode, _, stderr = await run_subprocess(
+            "ffmpeg", "-hide_banner", "-y", "-i", path,
+            "-vf", f"{select},scale={STORYBOARD_FRAME_WIDTH}:-2,showinfo",
+            "-vsync", "vfr", "-frames:v", str(max_frames), "-q:v", "5", pattern
+        )
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg keyframe extraction failed: {stderr.decode(errors='replace')[-200:]}")
+        timestamps = [float(t) for t in SHOWINFO_PTS_RE.findall(stderr.decode(errors="replace"))]
+        existing = await run_io(lambda: [os.path.exists(pattern % (index + 1)) for index in range(max_frames)])
+        frames = [
+            (pattern % (index + 1), timestamps[index] if index < len(timestamps) else 0.0)
+            for index in range(max_frames)
+            if existing[index]
+        ]
+        if len(frames) >= min(max_frames, 4):
+            break
+    return frames
+
+async def extract_speech_audio(path: str, workdir: str) -> Optional[str]:
+    """Track audio sebagai Opus mono 16 kHz bitrate rendah (tanpa video), None jika tidak ada audio"""
+    out_path = os.path.join(workdir, "speech.ogg")
+    returncode, _, _ = await run_subprocess(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+        "-vn", "-ac", "1", "-ar", str(AI_AUDIO_SAMPLE_RATE), "-c:a", "libopus", "-b:a", AI_AUDIO_BITRATE, out_path
+    )
+    if returncode != 0 or not await file_size(out_path):
+        return None
+    return out_path
+
+async def transcode_image(path: str, workdir: str) -> Optional[str]:
+    """Gambar sebagai JPEG dengan sisi terpanjang maksimal AI_IMAGE_MAX_SIDE"""
+    out_path = os.path.join(workdir, "image.jpg")
+    side = AI_IMAGE_MAX_SIDE
+    returncode, _, _ = await run_subprocess(
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+        "-vf", f"scale='min({side},iw)':'min({side},ih)':force_original_aspect_ratio=decrease",
+        "-frames:v", "1", "-q:v", "4", out_path
+    )
+    if returncode != 0 or not await file_size(out_path):
+        return None
+    return out_path
+
+MEDIA_MIME_TYPES = {
+    ".mp3": "audio/mp3", ".m4a": "audio/mp4", ".aac": "audio/aac", ".opus": "audio/ogg",
+    ".ogg": "audio/ogg", ".oga": "audio/ogg", ".wav": "audio/wav", ".flac": "audio/flac",
+    ".webm": "audio/webm", ".mp4": "video/mp4", ".mkv": "video/x-matroska", ".mov": "video/quicktime",
+}
+
+def guess_mime_type(path: str, default: str = "application/octet-stream") -> str:
+    """Mime type dari ekstensi file"""
+    ext = os.path.splitext(path)[1].lower()
+    return MEDIA_MIME_TYPES.get(ext) or mimetypes.guess_type(path)[0] or default
+
+async def normalize_media(media: MediaSource, mime_type: str, workdir: str,
+                          speech_only: bool = False) -> Tuple[MediaSource, str]:
+    """Transcode media ke format optimal AI (audio -> Opus 16 kHz mono, gambar -> JPEG dibatasi)
+
+    Video hanya diubah jika speech_only (track video dibuang). Jika ffmpeg gagal atau hasilnya
+    tidak lebih kecil, media asli yang dikembalikan.
+    """
+    kind = mime_type.split("/")[0]
+    if kind not in ("audio", "image") and not (kind == "video" and speech_only):
+        return media, mime_type
+    
+    if isinstance(media, str):
+        source = media
+    else:
+        source = os.path.join(workdir, "source" + (mimetypes.guess_extension(mime_type.split(";")[0]) or ".bin"))
+        await write_file(source, media)
+    
+    try:
+        if kind == "image":
+            normalized, normalized_mime = await transcode_image(source, workdir), "image/jpeg"
+        else:
+            normalized, normalized_mime = await extract_speech_audio(source, workdir), "audio/ogg"
+    except OSError as e:
+        media_log.warning("Media normalization unavailable: %s", e)
+        return media, mime_type
+    
+    original_size = await run_io(media_size, media)
+    normalized_size = await file_size(normalized) if normalized is not None else None
+    if normalized_size is None or normalized_size >= original_size:
+        return media, mime_type
+    
+    media_log.info("Normalized %s (%s bytes) -> %s (%s bytes)", mime_type, original_size, normalized_mime, normalized_size)
+    return normalized, normalized_mime
+
+def format_timestamp(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes}:{secs:02d}"
+
+RETRY_DELAY_RE = re.compile(rb'"retryDelay"\s*:\s*"([\d.]+)s"')
+
+def parse_retry_after(header: Optional[str], body: bytes = b"") -> Optional[float]:
+    """Detik tunggu dari header Retry-After (detik / HTTP-date) atau RetryInfo.retryDelay di body error Gemini"""
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, (email.utils.parsedate_to_datetime(header) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    match = RETRY_DELAY_RE.search(body[:4096])
+    return float(match.group(1)) if match else None
+
+class TokenBucket:
+    """Rate limiter client-side: `rate` token per detik, maksimal `burst`; pause() menahan semua caller"""
+    
+    def __init__(self, rate: float, burst: int = GEMINI_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+    
+    async def acquire(self) -> float:
+        """Tunggu sampai ada token (FIFO), return lama menunggu"""
+        if self.rate <= 0:
+            return 0.0
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - started
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def pause(self, seconds: float):
+        """Tahan semua request (mis. quota habis, server minta Retry-After)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # Token tidak terkumpul selama pause, agar tidak langsung burst lagi ke quota yang baru pulih
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+class CircuitBreaker:
+    """Open setelah N kegagalan beruntun (fail fast); setelah reset_timeout satu request percobaan boleh lewat"""
+    
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+    
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        # open/half-open -> satu probe per reset_timeout
+        self.state = "half_open"
+        self.opened_at = now
+        return True
+    
+    def record_success(self):
+        if self.state != "closed":
+            ai_log.info("Gemini circuit closed")
+        self.failures = 0
+        self.state = "closed"
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state == "closed":
+                ai_log.warning("Gemini circuit open after %s consecutive failures", self.failures)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+class GeminiKey:
+    """Satu API key (opsional dengan endpoint sendiri) beserta rate limiter dan bebannya"""
+    
+    def __init__(self, api_key: str, api_base: str, rate_per_minute: float, index: int = 0):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.url = f"{api_base}/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
+        self.stream_url = f"{api_base}/v1beta/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse&key={api_key}"
+        self.name = f"key{index}...{api_key[-4:]}"  # Label log/metrics unik per posisi pool, tanpa membocorkan key
+        self.rate_limiter = TokenBucket(rate_per_minute / 60.0)
+        self.pending = 0                    # Request yang menunggu token atau sedang berjalan
+    
+    @property
+    def cooling_down(self) -> bool:
+        """True selama key ini ditahan setelah 429"""
+        return time.monotonic() < self.rate_limiter.paused_until
+
+class GeminiKeyPool:
+    """Pool API key Gemini: request ke key sehat dengan beban terkecil, 429 hanya mendinginkan key itu"""
+    
+    def __init__(self, api_keys: Union[str, Sequence[str]], api_base: str = GEMINI_API_BASE,
+                 rate_per_minute: float = GEMINI_RATE_PER_MINUTE):
+        if isinstance(api_keys, str):
+            api_keys = [api_keys]
+        self.keys: List[GeminiKey] = []
+        for index, entry in enumerate(api_keys):
+            # "key" atau "key@https://endpoint" untuk project / endpoint lain
+            api_key, _, base = entry.partition("@")
+            self.keys.append(GeminiKey(api_key.strip(), (base.strip() or api_base).rstrip("/"), rate_per_minute, index))
+        if not self.keys:
+            raise ValueError("At least one Gemini API key is required")
+    
+    def pick(self) -> GeminiKey:
+        healthy = [key for key in self.keys if not key.cooling_down]
+        if healthy:
+            return min(healthy, key=lambda key: (key.pending, -key.rate_limiter.tokens))
+        # Semua key kena quota: pakai yang paling cepat pulih
+        return min(self.keys, key=lambda key: key.rate_limiter.paused_until)
+    
+    def has_healthy(self) -> bool:
+        return any(not key.cooling_down for key in self.keys)
+    
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        """Pilih key lalu tunggu token rate limiter-nya; yield (key, detik menunggu)"""
+        key = self.pick()
+        key.pending += 1
+        try:
+            waited = await key.rate_limiter.acquire()
+            yield key, waited
+        finally:
+            key.pending -= 1
+
 class AIProcessor:
     """AI processing untuk transcription dan summarization"""
     
-    def __init__(self, gemini_api_key: str):
-        self.gemini_api_key = gemini_api_key
-        self.gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={gemini_api_key}"
+    def __init__(self, gemini_api_keys: Union[str, Sequence[str]], pool_limit: int = GEMINI_POOL_LIMIT,
+                 pool_limit_per_host: int = GEMINI_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = GEMINI_KEEPALIVE_TIMEOUT,
+                 cache: Optional[AIResultCache] = None, api_base: str = GEMINI_API_BASE,
+                 normalize: bool = True, streaming: bool = GEMINI_STREAMING,
+                 rate_per_minute: float = GEMINI_RATE_PER_MINUTE, max_retries: int = GEMINI_MAX_RETRIES):
+        self.api_base = api_base
+        self.key_pool = GeminiKeyPool(gemini_api_keys, api_base, rate_per_minute)
+        self.streaming = streaming
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.cache = cache
+        self.normalize = normalize
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Session keep-alive yang dipakai bersama oleh semua request Gemini"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=GEMINI_REQUEST_TIMEOUT),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._session
     
-    async def transcribe_audio(self, audio_bytes: bytes, mime_type: str) -> Dict[str, Any]:
-        """Transcribe audio menggunakan Gemini AI"""
+    async def start(self):
+        """Buka connection pool dan prewarm koneksi (DNS + TCP + TLS) ke Gemini"""
+        session = self._get_session()
         try:
-            log.info(f"Transcribing audio, type: {mime_type}, size: {len(audio_bytes)} bytes")
+            async with session.get(self.api_base) as response:
+                await response.read()
+            ai_log.info("Gemini connection pool warmed up (limit=%s, per_host=%s)", self.pool_limit, self.pool_limit_per_host)
+        except Exception as e:
+            ai_log.warning("Gemini prewarm failed: %s", e)
+    
+    async def close(self):
+        """Tutup connection pool"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _cache_get(self, media: MediaSource, mime_type: str, prompt: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """Cari hasil AI yang sudah pernah dihitung untuk media yang sama"""
+        if self.cache is None:
+            return None, None
+        # Hash media berukuran MB dihitung di thread, bukan di event loop
+        key = await asyncio.get_running_loop().run_in_executor(
+            payload_executor, self.cache.make_key, media, mime_type, prompt
+        )
+        cached = await self.cache.get(key)
+        if cached is not None:
+            ai_log.info("AI cache hit: %s", key[:12])
+        return key, cached
+    
+    async def _cache_put(self, key: Optional[str], result: Dict[str, Any]):
+        if key is not None:
+            await self.cache.set(key, result)
+    
+    @contextlib.asynccontextmanager
+    async def _normalized(self, media: MediaSource, mime_type: str, speech_only: bool = False, enabled: bool = True):
+        """Context (media, mime_type) yang sudah dinormalisasi; file sementara dihapus saat keluar"""
+        if not (self.normalize and enabled):
+            yield media, mime_type
+            return
+        async with temp_workdir() as workdir:
+            yield await normalize_media(media, mime_type, workdir, speech_only)
+    
+    @metrics.instrument("gemini.generate")
+    async def _generate(self, payload: Dict[str, Any], label: str, result_key: str,
+                        media: Optional[List[MediaSource]] = None,
+                        on_text: Optional[TextCallback] = None) -> Dict[str, Any]:
+        """Core request ke Gemini lewat key pool (rate limiter per key), retry (backoff + jitter, Retry-After) dan circuit breaker
+
+        Dengan on_text (dan streaming aktif) request memakai streamGenerateContent (SSE) dan
+        on_text dipanggil untuk setiap potongan teks; hasil akhir tetap teks lengkap.
+        """
+        stream = on_text is not None and self.streaming
+        if media:
+            # Media di-encode base64 sambil dikirim, tidak pernah utuh di memory; stream() dibuat ulang per attempt
+            # json.dumps payload + stat setiap media di luar event loop
+            body = await run_io(StreamingJSONBody, payload, media)
+            make_data, headers, sent = body.stream, {"Content-Length": str(body.content_length)}, body.content_length
+        else:
+            # Prompt teks bisa besar (transkrip panjang); serialisasi di thread
+            data = await asyncio.get_running_loop().run_in_executor(
+                payload_executor, lambda: json.dumps(payload).encode("utf-8")
+            )
+            make_data, headers, sent = (lambda: data), None, len(data)
+        
+        delivered = False
+        
+        async def deliver(delta: str) -> bool:
+            nonlocal delivered
+            # Retry baru berhenti setelah teks benar-benar sampai ke user, bukan sekadar masuk buffer
+            sent_any = await on_text(delta)
+            delivered = delivered or sent_any
+            return sent_any
+        
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                metrics.inc("bot_gemini_rejected_total", reason="circuit_open")
+                ai_log.warning("Gemini circuit open, failing fast for %s", label)
+                return {"success": False, "error": "AI service is temporarily unavailable, please try again in a minute"}
+            async with self.key_pool.lease() as (key, waited):
+                if waited:
+                    metrics.observe("bot_gemini_throttle_seconds", waited)
+                metrics.inc("bot_gemini_key_requests_total", key=key.name)
+                outcome = await self._post(key.stream_url if stream else key.url, make_data(), headers, sent,
+                                           label, result_key, deliver if stream else None)
+            # 429 = quota key, bukan server down: ditangani rate limiter, tidak menggerakkan circuit breaker
+            if outcome["status"] == 429:
+                pass
+            elif outcome["retryable"]:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            
+            if not outcome["retryable"] or delivered or attempt == self.max_retries:
+                break
+            retry_after = outcome["retry_after"]
+            delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if outcome["status"] == 429:
+                # Quota key ini habis: tahan semua request ke key ini; kalau ada key lain yang sehat, retry langsung ke sana
+                key.rate_limiter.pause(delay)
+                if self.key_pool.has_healthy():
+                    delay = 0.0
+            if delay > GEMINI_RETRY_MAX_WAIT:
+                break
+            metrics.inc("bot_gemini_retries_total", reason=outcome["reason"])
+            ai_log.warning("Gemini %s failed on key %s (%s), retry %s/%s in %.1fs",
+                           label, key.name, outcome["reason"], attempt + 1, self.max_retries, delay)
+            if stream:
+                # Potongan attempt gagal yang belum terkirim dibuang agar tidak dobel dengan stream berikutnya
+                await on_text(None)
+            await asyncio.sleep(delay)
+        
+        annotate_span(attempts=attempt + 1, key=key.name)
+        return outcome["result"]
+    
+    async def _post(self, url: str, data: Any, headers: Optional[Dict[str, str]], sent: int, label: str,
+                    result_key: str, on_text: Optional[TextCallback]) -> Dict[str, Any]:
+        """Satu attempt POST: {"result", "status", "retryable", "retry_after", "reason"}"""
+        session = self._get_session()
+        text, error, received, retry_after, delivery_failed = None, None, 0, None, False
+        try:
+            async with session.post(url, data=data, headers=headers) as response:
+                status = response.status
+                if on_text is not None and status == 200:
+                    text, received, error, delivery_failed = await self._read_stream(response, label, on_text)
+                else:
+                    raw = await response.read()
+                    received = len(raw)
+                    if status != 200:
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"), raw)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            ai_log.warning("Gemini connection error for %s: %s", label, e or type(e).__name__)
+            metrics.inc("bot_gemini_responses_total", status="connection_error")
+            return {"result": {"success": False, "error": f"Connection error: {type(e).__name__}"},
+                    "status": None, "retryable": True, "retry_after": None, "reason": type(e).__name__}
+        metrics.inc("bot_bytes_total", sent, channel="gemini", direction="out")
+        metrics.inc("bot_bytes_total", received, channel="gemini", direction="in")
+        metrics.inc("bot_gemini_responses_total", status=str(status))
+        annotate_span(label=label, status=status, bytes_out=sent, bytes_in=received, streamed=on_text is not None)
+        
+        if status != 200:
+            retryable = status in GEMINI_RETRY_STATUSES
+            (ai_log.warning if retryable else ai_log.error)(
+                "Gemini API error for %s: %s", label, raw[:1000].decode('utf-8', errors='replace'))
+            return {"result": {"success": False, "error": f"API error: Status {status}"},
+                    "status": status, "retryable": retryable, "retry_after": retry_after, "reason": str(status)}
+        
+        if text is None:
+            try:
+                response_json = json.loads(raw)
+                text = response_json["candidates"][0]["content"]["parts"][0]["text"]
+            except (ValueError, KeyError, IndexError) as e:
+                ai_log.error("Error parsing %s response: %s", label, e)
+                error = "Failed to parse AI response"
+        result = {"success": False, "error": error} if error else {"success": True, result_key: text}
+        if delivery_failed:
+            # Caller (ProgressiveReply.finish) wajib mengirim bagian yang belum sampai dari teks lengkap
+            result["delivery_failed"] = True
+        return {"result": result, "status": status, "retryable": False, "retry_after": None, "reason": "ok"}
+    
+    async def _read_stream(self, response: aiohttp.ClientResponse, label: str,
+                           on_text: TextCallback) -> Tuple[str, int, Optional[str], bool]:
+        """Baca event SSE streamGenerateContent: return (teks lengkap, byte diterima, error, pengiriman parsial gagal)"""
+        started = time.perf_counter()
+        chunks: List[str] = []
+        received = 0
+        error = None
+        delivery_failed = False
+        async for line in response.content:
+            received += len(line)
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                event = json.loads(line[5:])
+                candidate = event["candidates"][0]
+                delta = "".join(part.get("text", "") for part in candidate.get("content", {}).get("parts", []))
+            except (ValueError, KeyError, IndexError) as e:
+                ai_log.error("Error parsing %s stream event: %s", label, e)
+                error = "Failed to parse AI response"
+                continue
+            if not delta:
+                continue
+            if not chunks:
+                metrics.observe("bot_gemini_first_chunk_seconds", time.perf_counter() - started, label=label)
+            chunks.append(delta)
+            if on_text is not None:
+                try:
+                    await on_text(delta)
+                except Exception as e:
+                    # Pengiriman parsial gagal: teks tetap dikumpulkan, caller mengirim sisanya dari teks lengkap
+                    ai_log.warning("Streaming delivery for %s failed: %s", label, e)
+                    on_text = None
+                    delivery_failed = True
+        if chunks:
+            return "".join(chunks), received, None, delivery_failed
+        return "", received, error or "Empty AI response", delivery_failed
+    
+    @metrics.instrument("ai.transcribe_audio")
+    async def transcribe_audio(self, audio: MediaSource, mime_type: str, normalize: bool = True) -> Dict[str, Any]:
+        """Transcribe audio menggunakan Gemini AI (audio berupa bytes atau path file)"""
+        try:
+            ai_log.info("Transcribing audio, type: %s, size: %s bytes", mime_type, await run_io(media_size, audio))
+            
+            cache_key, cached = await self._cache_get(audio, mime_type, TRANSCRIBE_PROMPT)
+            if cached is not None:
+                return cached
+            
+            # Hanya suara yang dibutuhkan: video dibuang, audio jadi Opus 16 kHz mono
+            async with self._normalized(audio, mime_type, speech_only=True, enabled=normalize) as (upload, upload_mime):
+                payload = {
+                    "contents": [
+                        {
+                            "parts": [
+                                inline_media_part(0, upload_mime),
+                                {
+                                    "text": TRANSCRIBE_PROMPT
+                                }
+                            ]
+                        }
+                    ]
+                }
+                
+                result = await self._generate(payload, "transcription", "transcription", [upload])
+            await self._cache_put(cache_key, result)
+            return result
+        except Exception as e:
+            ai_log.error("Error in transcribe_audio: %s", e)
+            return {"success": False, "error": str(e)}
+    
+    @metrics.instrument("ai.transcribe_long_audio")
+    async def transcribe_long_audio(self, path: str, mime_type: str) -> Dict[str, Any]:
+        """Transcribe audio panjang: potong di titik hening, transkrip paralel, lalu sambung"""
+        try:
+            cache_key, cached = await self._cache_get(path, mime_type, f"long:{TRANSCRIBE_PROMPT}")
+            if cached is not None:
+                return cached
+            
+            async with temp_workdir() as workdir:
+                # Normalisasi sekali untuk seluruh file, segment tidak perlu di-transcode ulang
+                source, source_mime = path, mime_type
+                if self.normalize:
+                    source, source_mime = await normalize_media(path, mime_type, workdir, speech_only=True)
+                try:
+                    segment_paths = await split_audio_on_silence(source, workdir)
+                except (OSError, RuntimeError) as split_error:
+                    ai_log.warning("Long-audio split failed (%s), falling back to single request", split_error)
+                    return await self.transcribe_audio(source, source_mime, normalize=False)
+                
+                semaphore = asyncio.Semaphore(LONG_AUDIO_CONCURRENCY)
+                
+                async def transcribe_segment(segment_path: str) -> Dict[str, Any]:
+                    async with semaphore:
+                        return await self.transcribe_audio(segment_path, source_mime, normalize=False)
+                
+                segment_results = await asyncio.gather(*[transcribe_segment(p) for p in segment_paths])
             
-            # Encode audio as base64
-            audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+            for index, segment_result in enumerate(segment_results):
+                if not segment_result["success"]:
+                    return {"success": False, "error": f"Segment {index + 1}/{len(segment_results)}: {segment_result['error']}"}
             
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "inline_data": {
-                                    "mime_type": mime_type,
-                                    "data": audio_b64
+            transcription = stitch_transcripts([r["transcription"] for r in segment_results])
+            result = {"success": True, "transcription": transcription, "segments": len(segment_results)}
+            await self._cache_put(cache_key, result)
+            return result
+        except Exception as e:
+            ai_log.error("Error in transcribe_long_audio: %s", e)
+            return {"success": False, "error": str(e)}
+    
+    @metrics.instrument("ai.transcribe_and_summarize")
+    async def transcribe_and_summarize(self, audio: MediaSource, mime_type: str, normalize: bool = True) -> Dict[str, Any]:
+        """Transkrip + ringkasan dalam satu request (JSON terstruktur), transkrip tidak dikirim ulang ke Gemini
+
+        Hasil: {"success", "transcription", "summary", "key_points", "category"}; "fallback" = True jika
+        response tidak bisa di-parse (mis. terpotong) dan caller sebaiknya memakai dua request terpisah.
+        """
+        try:
+            ai_log.info("Transcribing + summarizing audio, type: %s, size: %s bytes", mime_type, await run_io(media_size, audio))
+            
+            cache_key, cached = await self._cache_get(audio, mime_type, TRANSCRIBE_SUMMARY_PROMPT)
+            if cached is not None:
+                return cached
+            
+            async with self._normalized(audio, mime_type, speech_only=True, enabled=normalize) as (upload, upload_mime):
+                payload = {
+                    "contents": [
+                        {
+                            "parts": [
+                                inline_media_part(0, upload_mime),
+                                {
+                                    "text": TRANSCRIBE_SUMMARY_PROMPT
                                 }
-                            },
-                            {
-                                "text": "Please transcribe this audio to text. Provide the transcription in the same language as the audio. If the audio is in Indonesian, respond in Indonesian. If it's in English, respond in English. Just provide the transcription without additional commentary."
-                            }
-                        ]
+                            ]
+                        }
+                    ],
+                    "generationConfig": {
+                        "responseMimeType": "application/json",
+                        "responseSchema": TRANSCRIBE_SUMMARY_SCHEMA
                     }
-                ]
-            }
-            
-            headers = {"Content-Type": "application/json"}
+                }
+                
+                response = await self._generate(payload, "transcription_summary", "structured", [upload])
+            if not response["success"]:
+                return response
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.gemini_url, json=payload, headers=headers) as response:
-                    response_text = await response.text()
-                    
-                    if response.status == 200:
-                        response_json = json.loads(response_text)
-                        try:
-                            transcription = response_json["candidates"][0]["content"]["parts"][0]["text"]
-                            return {"success": True, "transcription": transcription}
-                        except (KeyError, IndexError) as e:
-                            log.error(f"Error parsing transcription response: {e}")
-                            return {"success": False, "error": "Failed to parse AI response"}
-                    else:
-                        log.error(f"Gemini API error for transcription: {response_text}")
-                        return {"success": False, "error": f"API error: Status {response.status}"}
+            try:
+                data = json.loads(response["structured"])
+                result = {
+                    "success": True,
+                    "transcription": data["transcription"].strip(),
+                    "summary": format_structured_summary(data),
+                    "key_points": data.get("key_points") or [],
+                    "category": data.get("category", "")
+                }
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                ai_log.warning("Error parsing structured transcription_summary response: %s", e)
+                return {"success": False, "error": "Failed to parse structured AI response", "fallback": True}
+            await self._cache_put(cache_key, result)
+            return result
         except Exception as e:
-            log.error(f"Error in transcribe_audio: {e}")
+            ai_log.error("Error in transcribe_and_summarize: %s", e)
             return {"success": False, "error": str(e)}
     
-    async def summarize_content(self, content: str, content_type: str = "text") -> Dict[str, Any]:
+    @metrics.instrument("ai.summarize_content")
+    async def summarize_content(self, content: str, content_type: str = "text",
+                                on_text: Optional[TextCallback] = None) -> Dict[str, Any]:
         """Summarize content menggunakan Gemini AI"""
         try:
-            log.info(f"Summarizing {content_type} content, length: {len(content)} chars")
+            ai_log.info("Summarizing %s content, length: %s chars", content_type, len(content))
             
             # Create context-aware prompt
             if content_type == "transcription":
@@ -141,161 +1734,723 @@ Please make it concise and informative."""
                 ]
             }
             
-            headers = {"Content-Type": "application/json"}
+            return await self._generate(payload, "summary", "summary", on_text=on_text)
+        except Exception as e:
+            ai_log.error("Error in summarize_content: %s", e)
+            return {"success": False, "error": str(e)}
+    
+    @metrics.instrument("ai.analyze_media")
+    async def analyze_media(self, media: MediaSource, mime_type: str, prompt: str = None) -> Dict[str, Any]:
+        """Analyze media menggunakan Gemini AI (media berupa bytes atau path file)"""
+        try:
+            ai_log.info("Analyzing media, type: %s, size: %s bytes", mime_type, await run_io(media_size, media))
+            
+            prompt = prompt or default_analysis_prompt(mime_type)
+            cache_key, cached = await self._cache_get(media, mime_type, prompt)
+            if cached is not None:
+                return cached
+            
+            async with self._normalized(media, mime_type) as (upload, upload_mime):
+                parts = [
+                    inline_media_part(0, upload_mime),
+                    {"text": prompt}
+                ]
+                
+                payload = {
+                    "contents": [
+                        {
+                            "parts": parts
+                        }
+                    ]
+                }
+                
+                result = await self._generate(payload, "analysis", "analysis", [upload])
+            await self._cache_put(cache_key, result)
+            return result
+        except Exception as e:
+            ai_log.error("Error in analyze_media: %s", e)
+            return {"success": False, "error": str(e)}
+
+    @metrics.instrument("ai.analyze_for_youtube")
+    async def analyze_for_youtube(self, media: MediaSource, mime_type: str, media_type: str,
+                                  on_text: Optional[TextCallback] = None) -> Dict[str, Any]:
+        """Analyze media untuk YouTube content creation (media berupa bytes atau path file)"""
+        try:
+            ai_log.info("Analyzing %s for YouTube content, type: %s, size: %s bytes", media_type, mime_type, await run_io(media_size, media))
+            
+            prompt = youtube_prompt(media_type)
+            cache_key, cached = await self._cache_get(media, mime_type, prompt)
+            if cached is not None:
+                return cached
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.gemini_url, json=payload, headers=headers) as response:
-                    response_text = await response.text()
+            async with self._normalized(media, mime_type) as (upload, upload_mime):
+                parts = [
+                    inline_media_part(0, upload_mime),
+                    {
+                        "text": prompt
+                    }
+                ]
+                
+                payload = {
+                    "contents": [
+                        {
+                            "parts": parts
+                        }
+                    ]
+                }
+                
+                result = await self._generate(payload, "YouTube analysis", "youtube_analysis", [upload], on_text)
+            await self._cache_put(cache_key, result)
+            return result
+        except Exception as e:
+            ai_log.error("Error in analyze_for_youtube: %s", e)
+            return {"success": False, "error": str(e)}
+    
+    @metrics.instrument("ai.analyze_video")
+    async def analyze_video(self, video: MediaSource, prompt: str = None, result_key: str = "analysis",
+                            label: str = "video analysis", on_text: Optional[TextCallback] = None) -> Dict[str, Any]:
+        """Analyze video lewat storyboard (frame kunci + audio kecil) yang mencakup seluruh durasi"""
+        try:
+            prompt = prompt or default_analysis_prompt("video/mp4")
+            cache_key, cached = await self._cache_get(video, "video/mp4", f"storyboard:{prompt}")
+            if cached is not None:
+                return cached
+            
+            async with temp_workdir() as workdir:
+                if isinstance(video, str):
+                    video_path = video
+                else:
+                    video_path = os.path.join(workdir, "source.mp4")
+                    await write_file(video_path, video)
+                
+                try:
+                    duration = await probe_duration(video_path)
+                    frames = await extract_keyframes(video_path, workdir, duration)
+                    audio_path = await extract_speech_audio(video_path, workdir)
+                except (OSError, RuntimeError, ValueError) as storyboard_error:
+                    ai_log.warning("Storyboard extraction failed: %s", storyboard_error)
+                    frames, audio_path = [], None
+                
+                if frames:
+                    media: List[MediaSource] = [frame_path for frame_path, _ in frames]
+                    parts = [inline_media_part(index, "image/jpeg") for index in range(len(frames))]
+                    if audio_path:
+                        media.append(audio_path)
+                        parts.append(inline_media_part(len(frames), "audio/ogg"))
                     
-                    if response.status == 200:
-                        response_json = json.loads(response_text)
-                        try:
-                            summary = response_json["candidates"][0]["content"]["parts"][0]["text"]
-                            return {"success": True, "summary": summary}
-                        except (KeyError, IndexError) as e:
-                            log.error(f"Error parsing summary response: {e}")
-                            return {"success": False, "error": "Failed to parse AI response"}
-                    else:
-                        log.error(f"Gemini API error for summary: {response_text}")
-                        return {"success": False, "error": f"API error: Status {response.status}"}
+                    timeline = ", ".join(
+                        f"frame {index + 1} @ {format_timestamp(seconds)}" for index, (_, seconds) in enumerate(frames)
+                    )
+                    storyboard_note = (
+                        f"The images above are {len(frames)} keyframes sampled in order across the whole video "
+                        f"(duration {format_timestamp(duration)}; {timeline})"
+                        + (", followed by the video's full audio track." if audio_path else ".")
+                        + " Treat them together as the video."
+                    )
+                    parts.append({"text": f"{storyboard_note}\n\n{prompt}"})
+                else:
+                    # Tanpa ffmpeg: kirim video utuh selama masih dalam batas ukuran
+                    if await run_io(media_size, video_path) > STORYBOARD_FALLBACK_MAX_BYTES:
+                        return {"success": False, "error": "Video too large to analyze without ffmpeg"}
+                    ai_log.info("No storyboard frames, sending the whole video instead")
+                    media = [video_path]
+                    parts = [inline_media_part(0, "video/mp4"), {"text": prompt}]
+                
+                upload_bytes = await run_io(lambda: sum(media_size(m) for m in media))
+                ai_log.info("Analyzing video: %s storyboard frames, audio: %s, upload %s bytes", len(frames), bool(audio_path), upload_bytes)
+                
+                result = await self._generate({"contents": [{"parts": parts}]}, label, result_key, media, on_text)
+            
+            await self._cache_put(cache_key, result)
+            return result
         except Exception as e:
-            log.error(f"Error in summarize_content: {e}")
+            ai_log.error("Error in analyze_video: %s", e)
             return {"success": False, "error": str(e)}
     
-    async def analyze_media(self, media_bytes: bytes, mime_type: str, prompt: str = None) -> Dict[str, Any]:
-        """Analyze media menggunakan Gemini AI"""
+    @metrics.instrument("ai.chat")
+    async def chat(self, query: str, on_text: Optional[TextCallback] = None) -> Dict[str, Any]:
+        """Direct chat dengan Gemini AI"""
         try:
-            log.info(f"Analyzing media, type: {mime_type}, size: {len(media_bytes)} bytes")
-            
-            media_b64 = base64.b64encode(media_bytes).decode('utf-8')
-            
-            parts = [
-                {
-                    "inline_data": {
-                        "mime_type": mime_type,
-                        "data": media_b64
-                    }
-                }
-            ]
-            
-            if prompt:
-                parts.append({"text": prompt})
-            else:
-                if "image" in mime_type:
-                    parts.append({"text": "Describe this image in detail. What do you see? Respond in Indonesian."})
-                elif "video" in mime_type:
-                    parts.append({"text": "Describe this video. What's happening? Respond in Indonesian."})
-                elif "audio" in mime_type:
-                    parts.append({"text": "Transcribe and summarize this audio content. Respond in Indonesian."})
+            ai_log.info("AI chat query, length: %s chars", len(query))
             
             payload = {
                 "contents": [
                     {
-                        "parts": parts
+                        "parts": [
+                            {
+                                "text": f"Respond in Indonesian. {query}"
+                            }
+                        ]
                     }
                 ]
             }
             
-            headers = {"Content-Type": "application/json"}
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.gemini_url, json=payload, headers=headers) as response:
-                    response_text = await response.text()
-                    
-                    if response.status == 200:
-                        response_json = json.loads(response_text)
-                        try:
-                            analysis = response_json["candidates"][0]["content"]["parts"][0]["text"]
-                            return {"success": True, "analysis": analysis}
-                        except (KeyError, IndexError) as e:
-                            log.error(f"Error parsing analysis response: {e}")
-                            return {"success": False, "error": "Failed to parse AI response"}
-                    else:
-                        log.error(f"Gemini API error for analysis: {response_text}")
-                        return {"success": False, "error": f"API error: Status {response.status}"}
+            return await self._generate(payload, "chat", "response", on_text=on_text)
         except Exception as e:
-            log.error(f"Error in analyze_media: {e}")
+            ai_log.error("Error in chat: %s", e)
             return {"success": False, "error": str(e)}
 
-    async def analyze_for_youtube(self, media_bytes: bytes, mime_type: str, media_type: str) -> Dict[str, Any]:
-        """Analyze media untuk YouTube content creation"""
-        try:
-            log.info(f"Analyzing {media_type} for YouTube content, type: {mime_type}, size: {len(media_bytes)} bytes")
-            
-            media_b64 = base64.b64encode(media_bytes).decode('utf-8')
-            
-            youtube_prompt = f"""Analisis {media_type} ini dan buatkan:
+# Query parameter yang tidak mengubah identitas media
+TRACKING_PARAMS = {
+    "si", "feature", "pp", "ab_channel", "t", "start", "fbclid", "gclid", "igshid", "igsh",
+    "ref", "ref_src", "ref_url", "s", "share_id", "_r", "_t", "is_from_webapp", "sender_device",
+    "mibextid", "rdid", "share_app_id", "source",
+}
+YOUTUBE_HOSTS = {"youtube.com", "youtube-nocookie.com", "youtu.be"}
+YOUTUBE_PATH_RE = re.compile(r"^/(?:shorts|embed|live|v)/([A-Za-z0-9_-]{11})")
+YOUTUBE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+TIKTOK_PATH_RE = re.compile(r"^/@[^/]+/(?:video|photo)/(\d+)")
 
-JUDUL YOUTUBE (3 pilihan terbaik):
-- Maksimal 60 karakter, menarik, SEO-friendly
-- [berikan 3 variasi judul]
+def canonical_media_key(url: str) -> str:
+    """Normalisasi URL ke identitas media: 'extractor:id' jika dikenal, selain itu URL bersih"""
+    parsed = urlsplit(url.strip())
+    host = parsed.netloc.lower().rsplit("@", 1)[-1].split(":")[0]
+    for prefix in ("www.", "m.", "mobile.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = parsed.path.rstrip("/") or "/"
+    query = parse_qsl(parsed.query)
+    
+    if host in YOUTUBE_HOSTS:
+        video_id = None
+        if host == "youtu.be":
+            video_id = path.lstrip("/").split("/")[0]
+        elif path == "/watch":
+            video_id = dict(query).get("v")
+        else:
+            match = YOUTUBE_PATH_RE.match(path)
+            video_id = match.group(1) if match else None
+        if video_id and YOUTUBE_ID_RE.match(video_id):
+            return f"youtube:{video_id}"
+    
+    if host.endswith("tiktok.com"):
+        match = TIKTOK_PATH_RE.match(path)
+        if match:
+            return f"tiktok:{match.group(1)}"
+    
+    kept = sorted(
+        (key, value) for key, value in query
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    return f"url:{host}{path}" + (f"?{urlencode(kept)}" if kept else "")
 
-DESKRIPSI:
-- Paragraf pembuka yang hook (2-3 kalimat)
-- Ringkasan isi {media_type}
-- Call-to-action
-- Timestamps jika perlu
+class TTLCache:
+    """Cache kecil in-memory dengan TTL dan ukuran maksimal (LRU)"""
+    
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is not None:
+            expires, value = entry
+            if time.monotonic() < expires:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return None
+    
+    def set(self, key: str, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._data)
 
-HASHTAG (15 hashtag):
-- Mix antara viral, niche, dan long-tail
-- Urutkan dari umum ke spesifik
+class LeaderCancelled(Exception):
+    """Job SingleFlight dibatalkan oleh pemanggil yang menjalankannya (bukan gagal)"""
 
-BONUS:
-- Target audience utama
-- Waktu upload terbaik
-- Ide thumbnail
+class SingleFlight:
+    """Gabungkan pemanggilan identik yang sedang berjalan menjadi satu job"""
+    
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self.coalesced = 0
+    
+    def __contains__(self, key: Any) -> bool:
+        return key in self._inflight
+    
+    async def do(self, key: Any, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (hasil, shared); shared=True jika menumpang job yang sudah berjalan
 
-Fokus pada konten yang benar-benar ada di {media_type}. Buat yang viral tapi tetap relevan!
+        Jika leader dibatalkan, follower tidak ikut batal: follower pertama yang bangun menjalankan func sendiri.
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        while future is not None:
+            try:
+                return await asyncio.shield(future), True
+            except LeaderCancelled:
+                future = self._inflight.get(key)
+        
+        future = asyncio.get_running_loop().create_future()
+        # Hindari warning "exception never retrieved" jika tidak ada follower
+        future.add_done_callback(lambda f: f.exception())
+        self._inflight[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled(f"In-flight job for {key!r} was cancelled"))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
 
-Respond dalam bahasa Indonesia dengan format yang rapi dan mudah dibaca."""
-            
-            parts = [
-                {
-                    "inline_data": {
-                        "mime_type": mime_type,
-                        "data": media_b64
-                    }
-                },
-                {
-                    "text": youtube_prompt
+class StagePipeline:
+    """Dependency graph stage async: stage yang independen berjalan paralel"""
+    
+    def __init__(self):
+        self._stages: "OrderedDict[str, Tuple[Tuple[str, ...], Callable[..., Awaitable[Any]]]]" = OrderedDict()
+        self.timings: Dict[str, Dict[str, float]] = {}
+    
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], deps: Tuple[str, ...] = ()):
+        """Tambah stage; func dipanggil dengan hasil dari setiap dependency (urut sesuai deps)"""
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Unknown dependency '{dep}' for stage '{name}'")
+        self._stages[name] = (tuple(deps), func)
+    
+    async def run(self) -> Dict[str, Any]:
+        """Jalankan semua stage, return {nama_stage: hasil atau exception}"""
+        origin = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        async def run_stage(name: str):
+            deps, func = self._stages[name]
+            dep_results = [await tasks[dep] for dep in deps]
+            start = time.perf_counter()
+            try:
+                with trace_span(f"pipeline.{name}"):
+                    return await func(*dep_results)
+            finally:
+                end = time.perf_counter()
+                self.timings[name] = {
+                    "start": start - origin,
+                    "end": end - origin,
+                    "duration": end - start,
                 }
-            ]
-            
-            payload = {
-                "contents": [
-                    {
-                        "parts": parts
-                    }
-                ]
-            }
-            
-            headers = {"Content-Type": "application/json"}
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.gemini_url, json=payload, headers=headers) as response:
-                    response_text = await response.text()
-                    
-                    if response.status == 200:
-                        response_json = json.loads(response_text)
-                        try:
-                            youtube_analysis = response_json["candidates"][0]["content"]["parts"][0]["text"]
-                            return {"success": True, "youtube_analysis": youtube_analysis}
-                        except (KeyError, IndexError) as e:
-                            log.error(f"Error parsing YouTube analysis response: {e}")
-                            return {"success": False, "error": "Failed to parse AI response"}
-                    else:
-                        log.error(f"Gemini API error for YouTube analysis: {response_text}")
-                        return {"success": False, "error": f"API error: Status {response.status}"}
+        
+        for name in self._stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return dict(zip(tasks.keys(), results))
+    
+    def critical_path(self) -> List[str]:
+        """Rantai stage yang menentukan total latency (dari stage yang selesai paling akhir)"""
+        if not self.timings:
+            return []
+        path = []
+        name = max(self.timings, key=lambda n: self.timings[n]["end"])
+        while name is not None:
+            path.append(name)
+            deps = [dep for dep in self._stages[name][0] if dep in self.timings]
+            name = max(deps, key=lambda n: self.timings[n]["end"]) if deps else None
+        return list(reversed(path))
+
+class MediaStore:
+    """Store download persistent: (extractor:id, format) -> file, LRU dengan kuota disk dan refcount
+
+    File yang sedang dipakai (refcount > 0) tidak pernah di-evict. Index disimpan di SQLite
+    sehingga store tetap terpakai setelah restart.
+    """
+    
+    def __init__(self, root: str = MEDIA_STORE_DIR, max_bytes: int = MEDIA_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Urutan LRU: entry yang paling lama tidak dipakai ada di depan
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._aliases: Dict[str, str] = {}  # canonical URL key -> media key
+        self._refs: Dict[str, int] = {}     # path -> jumlah pemakai aktif
+        self._orphans: Set[str] = set()     # File entry yang sudah diganti, dihapus setelah referensi terakhir lepas
+        self._db_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._load()
+    
+    def _load(self):
+        """Baca index dari SQLite, buang entry yang filenya sudah hilang"""
+        with self._db_lock:
+            db = self._conn
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS media_files ("
+                "media_key TEXT NOT NULL, format TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL, "
+                "accessed REAL NOT NULL, info TEXT NOT NULL, PRIMARY KEY (media_key, format))"
+            )
+            db.execute("CREATE TABLE IF NOT EXISTS media_aliases (url_key TEXT PRIMARY KEY, media_key TEXT NOT NULL)")
+            stale = []
+            for media_key, fmt, path, size, accessed, info in db.execute(
+                "SELECT media_key, format, path, size, accessed, info FROM media_files ORDER BY accessed"
+            ).fetchall():
+                if not os.path.isfile(path):
+                    stale.append((media_key, fmt))
+                    continue
+                self._entries[(media_key, fmt)] = {"path": path, "size": size, "accessed": accessed, "info": json.loads(info)}
+                self.total_bytes += size
+            db.executemany("DELETE FROM media_files WHERE media_key = ? AND format = ?", stale)
+            db.execute("DELETE FROM media_aliases WHERE media_key NOT IN (SELECT media_key FROM media_files)")
+            self._aliases = dict(db.execute("SELECT url_key, media_key FROM media_aliases").fetchall())
+            db.commit()
+        store_log.info("Media store loaded: %s files, %s bytes", len(self._entries), self.total_bytes)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def resolve(self, url_key: str) -> str:
+        """Media key (extractor:id) untuk canonical URL key, jika pernah di-download"""
+        return self._aliases.get(url_key, url_key)
+    
+    def entry_path(self, media_key: str, fmt: str, ext: str) -> str:
+        """Lokasi file baru di store: hash (media key, format) + suffix unik
+
+        Suffix unik agar download ulang media yang sama tidak menimpa file yang masih dibaca request lain.
+        """
+        digest = hashlib.sha256(f"{media_key}\0{fmt}".encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}_{uuid.uuid4().hex[:8]}{ext}")
+    
+    def _db_put(self, media_key: str, fmt: str, url_key: str, src_path: str, entry: Dict[str, Any]):
+        os.makedirs(os.path.dirname(entry["path"]), exist_ok=True)
+        shutil.move(src_path, entry["path"])
+        entry["size"] = os.path.getsize(entry["path"])
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_files (media_key, format, path, size, accessed, info) VALUES (?, ?, ?, ?, ?, ?)",
+                (media_key, fmt, entry["path"], entry["size"], entry["accessed"], json.dumps(entry["info"])),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO media_aliases (url_key, media_key) VALUES (?, ?)",
+                ((url_key, media_key), (media_key, media_key)),
+            )
+            self._conn.commit()
+    
+    def _db_alias(self, url_key: str, media_key: str):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media_aliases (url_key, media_key) VALUES (?, ?)", (url_key, media_key)
+            )
+            self._conn.commit()
+    
+    def _db_touch(self, media_key: str, fmt: str, accessed: float):
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE media_files SET accessed = ? WHERE media_key = ? AND format = ?", (accessed, media_key, fmt)
+            )
+            self._conn.commit()
+    
+    def _db_delete(self, victims: List[Tuple[Tuple[str, str], str]]):
+        for _, path in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._db_lock:
+            self._conn.executemany(
+                "DELETE FROM media_files WHERE media_key = ? AND format = ?", [key for key, _ in victims]
+            )
+            self._conn.commit()
+    
+    def _result(self, key: Tuple[str, str], entry: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(entry, info=dict(entry["info"]), media_key=key[0], format=key[1])
+    
+    async def acquire(self, media_key: str, fmt: str) -> Optional[Dict[str, Any]]:
+        """Ambil entry dan tambah refcount; None jika belum ada di store"""
+        key = (media_key, fmt)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        # Refcount dinaikkan dulu agar entry tidak di-evict selama cek file
+        path = entry["path"]
+        self._refs[path] = self._refs.get(path, 0) + 1
+        if not await run_io(os.path.isfile, path):
+            self._unref(path)
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                self.total_bytes -= entry["size"]
+                await run_io(self._db_delete, [(key, path)])
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        entry["accessed"] = time.time()
+        self.hits += 1
+        try:
+            await run_io(self._db_touch, media_key, fmt, entry["accessed"])
         except Exception as e:
-            log.error(f"Error in analyze_for_youtube: {e}")
-            return {"success": False, "error": str(e)}
+            store_log.warning("Media store index write error: %s", e)
+        return self._result(key, entry)
+    
+    async def put(self, media_key: str, fmt: str, url_key: str, src_path: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Pindahkan file hasil download ke store dan acquire untuk pemanggil"""
+        key = (media_key, fmt)
+        # Media yang sama sudah masuk lebih dulu (dua cache miss bersamaan): pakai entry itu, file baru dibuang
+        existing = await self.acquire(media_key, fmt)
+        if existing is not None:
+            store_log.info("Media %s (%s) already stored, discarding duplicate download", media_key, fmt)
+            await remove_file(src_path)
+            if self._aliases.get(url_key) != media_key:
+                self._aliases[url_key] = media_key
+                await run_io(self._db_alias, url_key, media_key)
+            return existing
+        
+        entry = {
+            "path": self.entry_path(media_key, fmt, os.path.splitext(src_path)[1]),
+            "size": 0,
+            "accessed": time.time(),
+            "info": info
+        }
+        await run_io(self._db_put, media_key, fmt, url_key, src_path, entry)
+        
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            # Entry lama diganti (put lain selesai duluan saat file ini dipindah): hapus filenya setelah tidak dipakai
+            self.total_bytes -= previous["size"]
+            if self._refs.get(previous["path"]):
+                self._orphans.add(previous["path"])
+            else:
+                await remove_file(previous["path"])
+        self._entries[key] = entry
+        self.total_bytes += entry["size"]
+        self._aliases[url_key] = media_key
+        self._aliases[media_key] = media_key
+        self._refs[entry["path"]] = self._refs.get(entry["path"], 0) + 1
+        await self.evict()
+        return self._result(key, entry)
+    
+    def _unref(self, path: str):
+        refs = self._refs.get(path, 0) - 1
+        if refs > 0:
+            self._refs[path] = refs
+        else:
+            self._refs.pop(path, None)
+    
+    async def release(self, path: str):
+        """Lepas satu referensi file; file di luar store (fallback download) langsung dihapus"""
+        if path not in self._refs:
+            if not os.path.abspath(path).startswith(os.path.abspath(self.root) + os.sep):
+                await remove_file(path)
+            return
+        self._unref(path)
+        if path in self._orphans and path not in self._refs:
+            self._orphans.discard(path)
+            await remove_file(path)
+        await self.evict()
+    
+    async def evict(self, max_bytes: Optional[int] = None, accessed_before: Optional[float] = None):
+        """Evict entry LRU yang tidak sedang dipakai sampai di bawah kuota (dan yang lebih lama dari accessed_before)"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        victims = []
+        for key, entry in list(self._entries.items()):
+            expired = accessed_before is not None and entry["accessed"] < accessed_before
+            if not expired and self.total_bytes <= max_bytes:
+                break
+            if self._refs.get(entry["path"]):
+                continue
+            del self._entries[key]
+            self.total_bytes -= entry["size"]
+            victims.append((key, entry["path"]))
+        
+        if victims:
+            self.evictions += len(victims)
+            store_log.info("Media store evicted %s files, now %s bytes", len(victims), self.total_bytes)
+            await run_io(self._db_delete, victims)
+
+class DiskJanitor:
+    """Pembersih disk async: index file ter-track urut mtime, eviction bertahap, operasi fs di thread
+
+    Menegakkan umur maksimal dan budget disk total untuk direktori kerja plus media store.
+    """
+    
+    def __init__(self, dirs: Tuple[str, ...] = JANITOR_DIRS, store: Optional[MediaStore] = None,
+                 max_age: float = JANITOR_MAX_AGE, disk_budget: int = JANITOR_DISK_BUDGET,
+                 interval: float = JANITOR_INTERVAL, batch: int = JANITOR_BATCH):
+        self.dirs = dirs
+        self.store = store
+        self.max_age = max_age
+        self.disk_budget = disk_budget
+        self.interval = interval
+        self.batch = batch
+        self.tracked_bytes = 0
+        self.removed = 0
+        # Heap (mtime, path) + data terkini per path; entry heap yang basi dilewati saat pop
+        self._heap: List[Tuple[float, str]] = []
+        self._files: Dict[str, Tuple[float, int]] = {}
+        self._last_scan = 0.0
+    
+    def _add(self, path: str, mtime: float, size: int):
+        previous = self._files.get(path)
+        if previous is not None:
+            self.tracked_bytes -= previous[1]
+        self._files[path] = (mtime, size)
+        self.tracked_bytes += size
+        heapq.heappush(self._heap, (mtime, path))
+    
+    def _discard(self, path: str):
+        previous = self._files.pop(path, None)
+        if previous is not None:
+            self.tracked_bytes -= previous[1]
+    
+    async def track(self, path: str):
+        """Daftarkan file baru di direktori kerja"""
+        try:
+            stat = await run_io(os.stat, path)
+        except FileNotFoundError:
+            return
+        self._add(path, stat.st_mtime, stat.st_size)
+    
+    async def track_tree(self, root: str):
+        """Daftarkan semua file di bawah root (mis. sisa direktori kerja yang gagal dihapus)"""
+        for path, mtime, size in await run_io(self._scan, (root,), False):
+            self._add(path, mtime, size)
+    
+    def forget(self, path: str):
+        """File sudah dihapus pemiliknya: keluarkan dari index dan hitungan budget"""
+        self._discard(path)
+    
+    def _is_root(self, path: str) -> bool:
+        return os.path.abspath(path) in {os.path.abspath(d) for d in self.dirs}
+    
+    def _scan(self, roots: Optional[Tuple[str, ...]] = None, prune: bool = True) -> List[Tuple[str, float, int]]:
+        """(thread) Semua file di direktori kerja, termasuk sisa yt-dlp (.part) yang tidak ter-track
+
+        Subdirektori kosong (sisa temp_workdir) yang lebih tua dari JANITOR_MIN_AGE ikut dihapus.
+        """
+        found, subdirs = [], []
+        stack = [d for d in (roots or self.dirs) if os.path.isdir(d)]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue  # Direktori dihapus (mis. temp_workdir selesai) di antara is_dir() dan scandir()
+            with it:
+                for item in it:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            stack.append(item.path)
+                            subdirs.append(item.path)
+                        elif item.is_file(follow_symlinks=False):
+                            stat = item.stat(follow_symlinks=False)
+                            found.append((item.path, stat.st_mtime, stat.st_size))
+                    except FileNotFoundError:
+                        continue
+        if prune:
+            # Terdalam dulu agar parent yang jadi kosong ikut terhapus
+            prune_before = time.time() - JANITOR_MIN_AGE
+            for path in reversed(subdirs):
+                try:
+                    if os.stat(path).st_mtime < prune_before:
+                        os.rmdir(path)
+                except OSError:
+                    continue
+        return found
+    
+    def _remove(self, candidates: List[Tuple[str, float]]) -> Tuple[List[str], List[Tuple[str, float, int]]]:
+        """(thread) Hapus kandidat; file yang berubah sejak di-track dikembalikan untuk di-index ulang"""
+        removed, changed = [], []
+        for path, mtime in candidates:
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime > mtime:
+                    changed.append((path, stat.st_mtime, stat.st_size))
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                store_log.warning("Janitor failed to remove %s: %s", path, e)
+                continue
+            removed.append(path)
+            # Subdirektori yang jadi kosong ikut dihapus (root direktori kerja tetap)
+            parent = os.path.dirname(path)
+            if parent and not self._is_root(parent):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    pass
+        return removed, changed
+    
+    def _over_budget(self) -> bool:
+        store_bytes = self.store.total_bytes if self.store is not None else 0
+        return self.tracked_bytes + store_bytes > self.disk_budget
+    
+    async def sweep(self):
+        """Satu putaran: rescan berkala, lalu evict file lepas dan media store (maksimal batch file)"""
+        now = time.time()
+        if now - self._last_scan >= JANITOR_RESCAN_INTERVAL:
+            found = await run_io(self._scan)
+            # Baru ditandai setelah scan berhasil; scan yang gagal diulang di sweep berikutnya
+            self._last_scan = now
+            for path, mtime, size in found:
+                if self._files.get(path) != (mtime, size):
+                    self._add(path, mtime, size)
+        
+        expire_before = now - self.max_age
+        candidates = []
+        while self._heap and len(candidates) < self.batch:
+            mtime, path = self._heap[0]
+            if self._files.get(path, (None,))[0] != mtime:
+                heapq.heappop(self._heap)  # Entry basi (file sudah di-index ulang / dihapus)
+                continue
+            if mtime >= expire_before and not (self._over_budget() and mtime < now - JANITOR_MIN_AGE):
+                break
+            heapq.heappop(self._heap)
+            self._discard(path)
+            candidates.append((path, mtime))
+        
+        if candidates:
+            removed, changed = await run_io(self._remove, candidates)
+            for path, mtime, size in changed:
+                self._add(path, mtime, size)
+            self.removed += len(removed)
+            if removed:
+                store_log.info("Janitor removed %s files, tracked %s bytes", len(removed), self.tracked_bytes)
+        
+        if self.store is not None:
+            await self.store.evict(
+                max_bytes=max(0, self.disk_budget - self.tracked_bytes), accessed_before=expire_before
+            )
+    
+    async def run(self):
+        """Sweep berkala di background; sweep pertama langsung membersihkan sisa run sebelumnya"""
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                store_log.error("Janitor error: %s", e)
+            await asyncio.sleep(self.interval)
 
 class MediaDownloader:
     """Universal media downloader dengan AI features"""
     
-    def __init__(self, ai_processor: AIProcessor):
+    def __init__(self, ai_processor: AIProcessor, store: MediaStore, janitor: Optional[DiskJanitor] = None,
+                 ytdlp_binary: str = YTDLP_BINARY):
         self.download_dir = "downloads"
+        self.ytdlp_binary = ytdlp_binary
         self.ai_processor = ai_processor
+        self.store = store
+        self.janitor = janitor
+        self.info_cache = TTLCache(INFO_CACHE_MAX_ENTRIES, INFO_CACHE_TTL)
+        self.inflight_downloads = SingleFlight()
         
         # Platform yang didukung yt-dlp
         self.popular_platforms = {
@@ -316,13 +2471,48 @@ class MediaDownloader:
                 return platform
         return "Unknown Platform"
     
+    def _remember_info(self, url: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        """Ringkas info JSON yt-dlp dan simpan ke info cache"""
+        # PERBAIKAN: Provide default values untuk missing keys
+        extractor = (info.get("extractor_key") or info.get("extractor") or "").lower()
+        if extractor and info.get("id"):
+            media_key = f"{extractor}:{info['id']}"
+        else:
+            media_key = canonical_media_key(url)
+        
+        result = {
+            "success": True,
+            "title": (info.get("title") or "Unknown Title")[:80],
+            "uploader": (info.get("uploader") or "Unknown")[:30],
+            "duration": info.get("duration", 0) or 0,
+            "view_count": info.get("view_count", 0) or 0,
+            "platform": self.get_platform_name(url),
+            "thumbnail": info.get("thumbnail", ""),
+            "description": (info.get("description") or "")[:150],
+            "webpage_url": info.get("webpage_url") or url,
+            "extractor": extractor,
+            "id": info.get("id", ""),
+            "media_key": media_key
+        }
+        
+        # Simpan dengan key URL dan key extractor:id agar short-link ikut kena cache
+        self.info_cache.set(canonical_media_key(url), result)
+        self.info_cache.set(media_key, result)
+        return dict(result)
+    
+    @metrics.instrument("download.get_info")
     async def get_info(self, url: str) -> Dict[str, Any]:
         """Get media information - FIXED VERSION"""
         try:
-            log.info(f"Getting info for: {url}")
+            cached = self.info_cache.get(canonical_media_key(url))
+            if cached is not None:
+                download_log.info("Info cache hit for: %s", url)
+                return dict(cached)
+            
+            download_log.info("Getting info for: %s", url)
             
             cmd = [
-                "yt-dlp",
+                self.ytdlp_binary,
                 "--dump-json",
                 "--no-warnings",
                 "--no-playlist",
@@ -342,7 +2532,7 @@ class MediaDownloader:
                 
                 # PERBAIKAN: Cek apakah stdout kosong
                 if not stdout_text:
-                    log.error("yt-dlp returned empty output")
+                    download_log.error("yt-dlp returned empty output")
                     return {"success": False, "error": "No information available for this URL"}
                 
                 try:
@@ -356,35 +2546,24 @@ class MediaDownloader:
                                 info = json.loads(line)
                                 break  # Use the first valid JSON
                             except json.JSONDecodeError as json_error:
-                                log.warning(f"Failed to parse JSON line: {json_error}")
+                                download_log.warning("Failed to parse JSON line: %s", json_error)
                                 continue
                     
                     # PERBAIKAN: Cek apakah JSON berhasil di-parse
                     if info is None:
-                        log.error("Failed to parse any JSON from yt-dlp output")
+                        download_log.error("Failed to parse any JSON from yt-dlp output")
                         return {"success": False, "error": "Failed to parse media information"}
                     
-                    # PERBAIKAN: Provide default values untuk missing keys
-                    return {
-                        "success": True,
-                        "title": info.get("title", "Unknown Title")[:80],
-                        "uploader": info.get("uploader", "Unknown")[:30],
-                        "duration": info.get("duration", 0) or 0,
-                        "view_count": info.get("view_count", 0) or 0,
-                        "platform": self.get_platform_name(url),
-                        "thumbnail": info.get("thumbnail", ""),
-                        "description": (info.get("description") or "")[:150],
-                        "webpage_url": info.get("webpage_url") or url
-                    }
+                    return self._remember_info(url, info)
                     
                 except json.JSONDecodeError as json_error:
-                    log.error(f"JSON decode error: {json_error}")
-                    log.error(f"Raw output: {stdout_text[:500]}")
+                    download_log.error("JSON decode error: %s", json_error)
+                    download_log.debug("Raw output: %s", stdout_text[:500])
                     return {"success": False, "error": f"JSON parse error: {str(json_error)}"}
                     
             else:
                 error_msg = stderr.decode()
-                log.error(f"yt-dlp info error: {error_msg}")
+                download_log.error("yt-dlp info error: %s", error_msg)
                 
                 # PERBAIKAN: Provide more specific error messages
                 if "unsupported url" in error_msg.lower():
@@ -397,33 +2576,149 @@ class MediaDownloader:
                     return {"success": False, "error": error_msg[:200]}
                 
         except Exception as e:
-            log.error(f"Error getting info: {e}")
-            log.error(traceback.format_exc())
+            download_log.error("Error getting info: %s", e)
+            download_log.debug("Traceback:", exc_info=True)
             return {"success": False, "error": f"Exception: {str(e)}"}
     
+    @metrics.instrument("download.download")
     async def download(self, url: str, media_type: str = "audio", quality: str = "best", chat_id: str = None) -> Dict[str, Any]:
+        """Universal download lewat media store; hasil wajib dilepas dengan release() setelah dipakai
+
+        Hit di store tidak menjalankan yt-dlp sama sekali, miss identik yang bersamaan menumpang satu proses yt-dlp.
+        """
+        url_key = canonical_media_key(url)
+        fmt = f"{media_type}:{quality if media_type == 'video' else 'best'}"
+        
+        entry = await self.store.acquire(self.store.resolve(url_key), fmt)
+        if entry is not None:
+            download_log.info("Media store hit for %s (%s)", entry['media_key'], fmt)
+            return self._store_result(entry, media_type, url_key)
+        
+        result, shared = await self.inflight_downloads.do(
+            (url_key, fmt), lambda: self._download_to_store(url, url_key, fmt, media_type, quality, chat_id)
+        )
+        if not shared or not result.get("success"):
+            return result
+        
+        # Follower memegang referensi sendiri ke file yang sama di store
+        download_log.info("Joined in-flight download for %s (%s)", url_key, fmt)
+        entry = await self.store.acquire(result["info"]["media_key"], fmt)
+        if entry is None:
+            download_log.warning("Shared download no longer in store, downloading again")
+            return await self._download_to_store(url, url_key, fmt, media_type, quality, chat_id)
+        return self._store_result(entry, media_type, url_key)
+    
+    def _store_result(self, entry: Dict[str, Any], media_type: str, url_key: str) -> Dict[str, Any]:
+        """Bentuk hasil download dari entry media store
+
+        Info juga di-cache di bawah url_key request (short link, setelah restart) agar get_info tidak memanggil yt-dlp lagi.
+        """
+        for key in (url_key, canonical_media_key(entry["info"]["webpage_url"]), entry["media_key"]):
+            self.info_cache.set(key, entry["info"])
+        return {
+            "success": True,
+            "file_path": entry["path"],
+            "file_size": entry["size"],
+            "format": os.path.splitext(entry["path"])[1][1:],
+            "type": media_type,
+            "info": dict(entry["info"])
+        }
+    
+    async def _download_to_store(self, url: str, url_key: str, fmt: str, media_type: str,
+                                 quality: str, chat_id: str = None) -> Dict[str, Any]:
+        """Jalankan yt-dlp lalu pindahkan hasilnya ke media store"""
+        result = await self._download(url, media_type, quality, chat_id)
+        if not result["success"]:
+            return result
+        metrics.inc("bot_bytes_total", result["file_size"], channel="download", direction="in")
+        annotate_span(bytes_in=result["file_size"], format=fmt)
+        try:
+            entry = await self.store.put(result["info"]["media_key"], fmt, url_key, result["file_path"], result["info"])
+        except OSError as e:
+            # File tetap di downloads/, release() akan menghapusnya (janitor sebagai jaring pengaman)
+            download_log.warning("Media store unavailable (%s), using download directly", e)
+            if self.janitor is not None:
+                await self.janitor.track(result["file_path"])
+            return result
+        return self._store_result(entry, media_type, url_key)
+    
+    async def release(self, result: Optional[Dict[str, Any]]):
+        """Lepas file hasil download() (pengganti os.remove setelah file dikirim / diproses)"""
+        if result and result.get("success") and result.get("file_path"):
+            await self.store.release(result["file_path"])
+            if self.janitor is not None:
+                # Fallback di luar store sudah dihapus store.release; budget janitor ikut turun
+                self.janitor.forget(result["file_path"])
+    
+    @metrics.instrument("download.yt_dlp")
+    async def _download(self, url: str, media_type: str = "audio", quality: str = "best", chat_id: str = None) -> Dict[str, Any]:
+        """Jalankan yt-dlp; sisa download yang gagal (.part, .ytdl, fragment) langsung dihapus"""
+        # Generate unique filename (suffix acak: download paralel di detik yang sama tidak saling timpa)
+        timestamp = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        result = await self._run_ytdlp(url, media_type, quality, chat_id, timestamp)
+        if not result["success"]:
+            await self._remove_partial(timestamp)
+        return result
+    
+    async def _remove_partial(self, timestamp: str):
+        """Hapus semua file milik satu run yt-dlp (nama mengandung suffix unik run tersebut)"""
+        def remove() -> List[str]:
+            removed = []
+            try:
+                with os.scandir(self.download_dir) as it:
+                    for item in it:
+                        try:
+                            if timestamp in item.name and _remove_file(item.path):
+                                removed.append(item.path)
+                        except OSError as e:
+                            download_log.warning("Failed to remove partial download %s: %s", item.path, e)
+            except FileNotFoundError:
+                pass
+            return removed
+        
+        removed = await run_io(remove)
+        if removed:
+            download_log.info("Removed %s partial download files", len(removed))
+            if self.janitor is not None:
+                for path in removed:
+                    self.janitor.forget(path)
+    
+    async def _run_ytdlp(self, url: str, media_type: str, quality: str, chat_id: Optional[str],
+                         timestamp: str) -> Dict[str, Any]:
         """Universal download method dengan AI processing - IMPROVED ERROR HANDLING"""
         try:
-            log.info(f"Downloading {media_type} from: {url}")
+            download_log.info("Downloading %s from: %s", media_type, url)
             
-            # Generate unique filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_chat = chat_id.replace("@", "").replace(".", "") if chat_id else "unknown"
             
-            if media_type == "audio":
+            if media_type == "speech":
+                # Audio yang hanya untuk AI: ambil stream audio apa adanya (tanpa konversi mp3),
+                # normalisasi ke Opus 16 kHz dilakukan AIProcessor
+                output_template = f"{self.download_dir}/speech_{safe_chat}_{timestamp}.%(ext)s"
+                cmd = [
+                    self.ytdlp_binary,
+                    "-f", SPEECH_AUDIO_FORMAT,
+                    "--no-warnings",
+                    "--no-playlist",
+                    "--print", "after_move:%()j",  # Info JSON + filepath final dari run yang sama
+                    "-o", output_template,
+                    url
+                ]
+                
+            elif media_type == "audio":
                 output_template = f"{self.download_dir}/audio_{safe_chat}_{timestamp}.%(ext)s"
                 cmd = [
-                    "yt-dlp",
+                    self.ytdlp_binary,
                     "-x",  # Extract audio
                     "--audio-format", "mp3",
                     "--audio-quality", "0",  # Best quality
                     "--no-warnings",
                     "--no-playlist",
                     "--embed-metadata",
+                    "--print", "after_move:%()j",  # Info JSON + filepath final dari run yang sama
                     "-o", output_template,
                     url
                 ]
-                expected_ext = ".mp3"
                 
             else:  # video
                 output_template = f"{self.download_dir}/video_{safe_chat}_{timestamp}.%(ext)s"
@@ -440,17 +2735,17 @@ class MediaDownloader:
                 format_selector = quality_formats.get(quality, "best[height<=720]")
                 
                 cmd = [
-                    "yt-dlp",
+                    self.ytdlp_binary,
                     "-f", format_selector,
                     "--no-warnings",
                     "--no-playlist",
                     "--embed-metadata",
+                    "--print", "after_move:%()j",  # Info JSON + filepath final dari run yang sama
                     "-o", output_template,
                     url
                 ]
-                expected_ext = ".mp4"
             
-            log.info(f"Running: {' '.join(cmd)}")
+            download_log.debug("Running: %s", cmd)
             
             process = await asyncio.create_subprocess_exec(
                 *cmd,
@@ -461,170 +2756,210 @@ class MediaDownloader:
             stdout, stderr = await process.communicate()
             
             if process.returncode == 0:
-                # Find downloaded file
-                if media_type == "audio":
-                    file_path = output_template.replace(".%(ext)s", ".mp3")
-                else:
-                    # Check for various video formats
-                    possible_exts = [".mp4", ".webm", ".mkv", ".avi", ".mov"]
-                    file_path = None
-                    for ext in possible_exts:
-                        test_path = output_template.replace(".%(ext)s", ext)
-                        if os.path.exists(test_path):
-                            file_path = test_path
+                # yt-dlp mencetak info JSON setelah file dipindah ke lokasi final
+                info = None
+                for line in reversed(stdout.decode(errors="replace").splitlines()):
+                    if line.startswith("{"):
+                        try:
+                            info = json.loads(line)
                             break
+                        except json.JSONDecodeError:
+                            continue
+                
+                file_path = None
+                if info is not None:
+                    file_path = info.get("filepath")
+                    if not file_path and info.get("requested_downloads"):
+                        file_path = info["requested_downloads"][-1].get("filepath")
                 
-                if file_path and os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
+                size = await file_size(file_path) if file_path else None
+                if size is not None:
                     file_ext = os.path.splitext(file_path)[1][1:]  # Remove dot
                     
-                    log.info(f"{media_type.title()} download successful: {file_path} ({file_size} bytes)")
+                    download_log.info("%s download successful: %s (%s bytes)", media_type.title(), file_path, size)
                     
                     return {
                         "success": True,
                         "file_path": file_path,
-                        "file_size": file_size,
+                        "file_size": size,
                         "format": file_ext,
-                        "type": media_type
+                        "type": media_type,
+                        "info": self._remember_info(url, info)
                     }
                 else:
-                    log.error("Downloaded file not found")
+                    download_log.error("Downloaded file not found")
                     return {"success": False, "error": "Downloaded file not found"}
             else:
                 error_msg = stderr.decode()
-                log.error(f"yt-dlp error: {error_msg}")
+                download_log.error("yt-dlp error: %s", error_msg)
                 return {"success": False, "error": error_msg}
                 
         except Exception as e:
-            log.error(f"Error in download: {e}")
-            log.error(traceback.format_exc())
+            download_log.error("Error in download: %s", e)
+            download_log.debug("Traceback:", exc_info=True)
             return {"success": False, "error": str(e)}
     
-    async def download_with_ai(self, url: str, ai_features: List[str] = None, quality: str = "720p", chat_id: str = None) -> Dict[str, Any]:
-        """Download dengan AI processing (transcription, summary, analysis) - IMPROVED"""
+    async def download_with_ai(self, url: str, ai_features: List[str] = None, quality: str = "720p", chat_id: str = None,
+                               on_summary_text: Optional[TextCallback] = None) -> Dict[str, Any]:
+        """Download dengan AI processing (transcription, summary, analysis) - cabang audio & video paralel"""
         try:
-            platform = self.get_platform_name(url)
             ai_features = ai_features or []
-            
-            # Get info first - IMPROVED ERROR HANDLING
-            log.info("Getting media info...")
-            info_result = await self.get_info(url)
-            if not info_result["success"]:
-                log.error(f"Failed to get info: {info_result['error']}")
-                return {"success": False, "error": f"Failed to get media info: {info_result['error']}"}
+            pipeline = StagePipeline()
+            # Summary dari mode gabungan (satu request), diisi transcribe_stage
+            combined = COMBINED_TRANSCRIBE_SUMMARY and "summary" in ai_features
+            structured: Dict[str, Any] = {}
+            
+            async def audio_stage():
+                download_log.info("Downloading audio for AI processing...")
+                return await self.download(url, "speech", "best", chat_id)
+            
+            async def transcribe_stage(audio_result):
+                if not audio_result["success"]:
+                    return {"success": False, "error": f"Failed to download audio: {audio_result.get('error', 'Unknown error')}"}
+                try:
+                    # File di-stream langsung ke Gemini, tidak dibaca utuh ke memory
+                    duration = audio_result["info"].get("duration") or 0
+                    mime_type = guess_mime_type(audio_result["file_path"], "audio/mp3")
+                    if duration >= LONG_AUDIO_THRESHOLD:
+                        download_log.info("Starting long-audio transcription (%s)...", format_duration(int(duration)))
+                        return await self.ai_processor.transcribe_long_audio(audio_result["file_path"], mime_type)
+                    if combined:
+                        download_log.info("Starting transcription + summary...")
+                        result = await self.ai_processor.transcribe_and_summarize(audio_result["file_path"], mime_type)
+                        if result["success"]:
+                            structured["summary"] = {"success": True, "summary": result["summary"]}
+                            return {"success": True, "transcription": result["transcription"]}
+                        if not result.get("fallback"):
+                            return result
+                        download_log.warning("Combined transcription + summary unusable, falling back to separate requests")
+                    download_log.info("Starting transcription...")
+                    return await self.ai_processor.transcribe_audio(audio_result["file_path"], mime_type)
+                except Exception as audio_error:
+                    download_log.error("Error processing audio: %s", audio_error)
+                    return {"success": False, "error": f"Audio processing error: {str(audio_error)}"}
+                finally:
+                    # Lepas file audio setelah AI processing (tetap di media store untuk request berikutnya)
+                    await self.release(audio_result)
+            
+            async def summary_stage(transcribe_result):
+                if not transcribe_result.get("success"):
+                    return None
+                if "summary" in structured:
+                    return structured["summary"]
+                download_log.info("Creating summary from transcription...")
+                return await self.ai_processor.summarize_content(
+                    transcribe_result["transcription"], "transcription", on_summary_text
+                )
+            
+            async def video_stage():
+                download_log.info("Downloading video for analysis...")
+                return await self.download(url, "video", quality, chat_id)
+            
+            async def analysis_stage(video_result):
+                if not video_result["success"]:
+                    return {"success": False, "error": f"Failed to download video: {video_result.get('error', 'Unknown error')}"}
+                try:
+                    # Storyboard (frame kunci + audio) mencakup seluruh video, bukan potongan byte awal
+                    download_log.info("Starting video analysis...")
+                    return await self.ai_processor.analyze_video(
+                        video_result["file_path"], "Analyze this video content"
+                    )
+                except Exception as video_error:
+                    download_log.error("Error processing video: %s", video_error)
+                    return {"success": False, "error": f"Video processing error: {str(video_error)}"}
+            
+            if "transcribe" in ai_features:
+                pipeline.add("audio_download", audio_stage)
+                pipeline.add("transcription", transcribe_stage, ("audio_download",))
+                if "summary" in ai_features:
+                    pipeline.add("summary", summary_stage, ("transcription",))
+            if "analyze" in ai_features:
+                pipeline.add("video_download", video_stage)
+                pipeline.add("analysis", analysis_stage, ("video_download",))
+            if "transcribe" not in ai_features and "analyze" not in ai_features:
+                # Tanpa download, info diambil sendiri; kalau ada download, info ikut dari run yt-dlp yang sama
+                pipeline.add("info", lambda: self.get_info(url))
+            
+            stage_results = await pipeline.run()
+            critical_path = pipeline.critical_path()
+            if download_log.isEnabledFor(logging.DEBUG):
+                download_log.debug("Pipeline timings: %s | critical path: %s",
+                                   ", ".join(f"{name}={timing['duration']:.2f}s" for name, timing in pipeline.timings.items()),
+                                   " -> ".join(critical_path))
+            
+            for name, value in stage_results.items():
+                if isinstance(value, BaseException):
+                    download_log.error("Stage %s failed: %s", name, value)
+                    stage_results[name] = {"success": False, "error": str(value)}
+            
+            video_result = stage_results.get("video_download")
+            
+            downloads = [stage_results[name] for name in ("audio_download", "video_download") if name in stage_results]
+            if downloads:
+                info_result = next((result["info"] for result in downloads if result.get("success")), None)
+                if info_result is None:
+                    error = str(downloads[0].get("error", "Unknown error")).strip()
+                    download_log.error("All downloads failed: %s", error)
+                    return {"success": False, "error": f"Failed to download media: {error}"}
+            else:
+                info_result = stage_results["info"]
+                if not info_result["success"]:
+                    download_log.error("Failed to get info: %s", info_result['error'])
+                    return {"success": False, "error": f"Failed to get media info: {info_result['error']}"}
             
             results = {
                 "success": True,
                 "info": info_result,
-                "ai_results": {}
+                "ai_results": {},
+                "timings": pipeline.timings,
+                "critical_path": critical_path
             }
             
-            # Download audio for transcription/summary
-            if "transcribe" in ai_features or "summary" in ai_features:
-                log.info("Downloading audio for AI processing...")
-                audio_result = await self.download(url, "audio", "best", chat_id)
-                if audio_result["success"]:
-                    try:
-                        # Read audio file
-                        with open(audio_result["file_path"], "rb") as f:
-                            audio_bytes = f.read()
-                        
-                        # Transcription
-                        if "transcribe" in ai_features:
-                            log.info("Starting transcription...")
-                            transcribe_result = await self.ai_processor.transcribe_audio(audio_bytes, "audio/mp3")
-                            results["ai_results"]["transcription"] = transcribe_result
-                            
-                            # Summary dari transcription
-                            if "summary" in ai_features and transcribe_result.get("success"):
-                                log.info("Creating summary from transcription...")
-                                summary_result = await self.ai_processor.summarize_content(
-                                    transcribe_result["transcription"], "transcription"
-                                )
-                                results["ai_results"]["summary"] = summary_result
-                        
-                        # Cleanup audio file after AI processing
-                        if os.path.exists(audio_result["file_path"]):
-                            os.remove(audio_result["file_path"])
-                            
-                    except Exception as audio_error:
-                        log.error(f"Error processing audio: {audio_error}")
-                        results["ai_results"]["transcription"] = {"success": False, "error": f"Audio processing error: {str(audio_error)}"}
-                        # Cleanup on error
-                        if os.path.exists(audio_result["file_path"]):
-                            os.remove(audio_result["file_path"])
-                else:
-                    results["ai_results"]["transcription"] = {"success": False, "error": f"Failed to download audio: {audio_result.get('error', 'Unknown error')}"}
+            for stage_name, result_key in (("transcription", "transcription"), ("summary", "summary"), ("analysis", "analysis")):
+                if stage_results.get(stage_name) is not None:
+                    results["ai_results"][result_key] = stage_results[stage_name]
             
-            # Download video for analysis
-            if "analyze" in ai_features:
-                log.info("Downloading video for analysis...")
-                video_result = await self.download(url, "video", quality, chat_id)
-                if video_result["success"]:
-                    try:
-                        # Read video file (sample)
-                        with open(video_result["file_path"], "rb") as f:
-                            # Read first 5MB for analysis to avoid huge files
-                            video_bytes = f.read(5 * 1024 * 1024)
-                        
-                        log.info("Starting video analysis...")
-                        analysis_result = await self.ai_processor.analyze_media(
-                            video_bytes, "video/mp4", "Analyze this video content"
-                        )
-                        results["ai_results"]["analysis"] = analysis_result
-                        results["video_file"] = video_result
-                        
-                    except Exception as video_error:
-                        log.error(f"Error processing video: {video_error}")
-                        results["ai_results"]["analysis"] = {"success": False, "error": f"Video processing error: {str(video_error)}"}
-                        # Cleanup on error
-                        if os.path.exists(video_result["file_path"]):
-                            os.remove(video_result["file_path"])
-                else:
-                    results["ai_results"]["analysis"] = {"success": False, "error": f"Failed to download video: {video_result.get('error', 'Unknown error')}"}
+            # Caller wajib release() video_file setelah selesai dipakai
+            if video_result and video_result.get("success"):
+                results["video_file"] = video_result
             
             return results
             
         except Exception as e:
-            log.error(f"Error in download_with_ai: {e}")
-            log.error(traceback.format_exc())
+            download_log.error("Error in download_with_ai: %s", e)
+            download_log.debug("Traceback:", exc_info=True)
             return {"success": False, "error": str(e)}
 
-    async def download_for_youtube_analysis(self, url: str, media_type: str = "video", chat_id: str = None) -> Dict[str, Any]:
+    async def download_for_youtube_analysis(self, url: str, media_type: str = "video", chat_id: str = None,
+                                            on_text: Optional[TextCallback] = None) -> Dict[str, Any]:
         """Download media khusus untuk analisis YouTube dengan kualitas worst - IMPROVED"""
         try:
             platform = self.get_platform_name(url)
-            log.info(f"Downloading {media_type} for YouTube analysis from {platform}")
-            
-            # Get info first - IMPROVED ERROR HANDLING  
-            info_result = await self.get_info(url)
-            if not info_result["success"]:
-                return {"success": False, "error": f"Failed to get media info: {info_result['error']}"}
+            download_log.info("Downloading %s for YouTube analysis from %s", media_type, platform)
             
-            # Download dengan kualitas worst untuk menghemat bandwidth
-            download_result = await self.download(url, media_type, "worst", chat_id)
+            # Download dengan kualitas worst untuk menghemat bandwidth (info ikut dari run yang sama)
+            # Audio diambil apa adanya tanpa konversi mp3; AIProcessor menormalisasi ke Opus
+            download_media_type = "speech" if media_type == "audio" else media_type
+            download_result = await self.download(url, download_media_type, "worst", chat_id)
             
             if download_result["success"]:
+                info_result = download_result["info"]
                 try:
-                    # Read file for AI analysis
-                    with open(download_result["file_path"], "rb") as f:
-                        if media_type == "video":
-                            # Read first 10MB for video analysis
-                            media_bytes = f.read(10 * 1024 * 1024)
-                            mime_type = "video/mp4"
-                        else:  # audio
-                            # Read entire audio file (should be smaller with worst quality)
-                            media_bytes = f.read()
-                            mime_type = "audio/mp3"
-                    
                     # YouTube analysis
-                    youtube_result = await self.ai_processor.analyze_for_youtube(
-                        media_bytes, mime_type, media_type
-                    )
+                    if media_type == "video":
+                        # Storyboard (frame kunci + audio) mencakup seluruh video
+                        youtube_result = await self.ai_processor.analyze_video(
+                            download_result["file_path"], youtube_prompt("video"),
+                            "youtube_analysis", "YouTube analysis", on_text
+                        )
+                    else:  # audio
+                        # Audio dikirim utuh, di-stream langsung dari file
+                        youtube_result = await self.ai_processor.analyze_for_youtube(
+                            download_result["file_path"], guess_mime_type(download_result["file_path"], "audio/mp3"), media_type,
+                            on_text
+                        )
                     
-                    # Cleanup downloaded file
-                    if os.path.exists(download_result["file_path"]):
-                        os.remove(download_result["file_path"])
+                    await self.release(download_result)
                     
                     return {
                         "success": True,
@@ -633,159 +2968,74 @@ class MediaDownloader:
                     }
                     
                 except Exception as analysis_error:
-                    log.error(f"Error in YouTube analysis: {analysis_error}")
-                    # Cleanup on error
-                    if os.path.exists(download_result["file_path"]):
-                        os.remove(download_result["file_path"])
+                    download_log.error("Error in YouTube analysis: %s", analysis_error)
+                    await self.release(download_result)
                     return {"success": False, "error": f"YouTube analysis error: {str(analysis_error)}"}
             else:
                 return {"success": False, "error": f"Download failed: {download_result.get('error', 'Unknown error')}"}
                 
         except Exception as e:
-            log.error(f"Error in download_for_youtube_analysis: {e}")
-            log.error(traceback.format_exc())
+            download_log.error("Error in download_for_youtube_analysis: %s", e)
+            download_log.debug("Traceback:", exc_info=True)
             return {"success": False, "error": str(e)}
-    
-    def cleanup_old_files(self, max_age_hours: int = 24):
-        """Clean up old files"""
-        try:
-            import time
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-            
-            for filename in os.listdir(self.download_dir):
-                file_path = os.path.join(self.download_dir, filename)
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getmtime(file_path)
-                    if file_age > max_age_seconds:
-                        os.remove(file_path)
-                        log.info(f"Cleaned up: {filename}")
-        except Exception as e:
-            log.error(f"Cleanup error: {e}")
 
 # Helper functions for quoted message handling
+# Field media protobuf -> (quoted_type, mime default); urutan = prioritas jika ada lebih dari satu
+QUOTED_MEDIA_FIELDS = {
+    "audioMessage": ("audio", "audio/ogg"),
+    "videoMessage": ("video", "video/mp4"),
+    "imageMessage": ("image", "image/jpeg"),
+    "documentMessage": ("document", "application/pdf"),
+    "stickerMessage": ("sticker", "image/webp"),
+}
+QUOTED_FIELD_PRIORITY = {field: index for index, field in enumerate(QUOTED_MEDIA_FIELDS)}
+QUOTED_TYPE_FIELDS = {quoted_type: field for field, (quoted_type, _) in QUOTED_MEDIA_FIELDS.items()}
+
+def detect_quoted_media(quoted_message) -> Tuple[Optional[str], Optional[str]]:
+    """Satu pass atas field yang ter-set (ListFields) -> (quoted_type, field name)"""
+    best_field = None
+    for descriptor, _ in quoted_message.ListFields():
+        priority = QUOTED_FIELD_PRIORITY.get(descriptor.name)
+        if priority is not None and (best_field is None or priority < QUOTED_FIELD_PRIORITY[best_field]):
+            best_field = descriptor.name
+    if best_field is None:
+        return None, None
+    return QUOTED_MEDIA_FIELDS[best_field][0], best_field
+
+@metrics.instrument("message.quoted_info")
 async def get_quoted_message_info(message):
-    """Get quoted message info with balanced detection"""
-    has_quoted = False
-    quoted_message = None
-    quoted_type = None
-    
+    """Get quoted message info: (has_quoted, quoted_message, quoted_type)"""
     try:
-        if (hasattr(message.Message, 'extendedTextMessage') and 
-            hasattr(message.Message.extendedTextMessage, 'contextInfo') and
-            hasattr(message.Message.extendedTextMessage.contextInfo, 'quotedMessage')):
-            
-            quoted_message = message.Message.extendedTextMessage.contextInfo.quotedMessage
-            has_quoted = True
-            
-            log.info("Quoted message detected, analyzing type...")
-            
-            # Method 1: Try thundra_io detection first
-            if THUNDRA_AVAILABLE:
-                try:
-                    msg_type = get_message_type(quoted_message)
-                    if isinstance(msg_type, MediaMessageType):
-                        quoted_type = msg_type.__class__.__name__.lower().replace('message', '')
-                        log.info(f"thundra_io detected type: {quoted_type}")
-                        
-                        # Cross-validate with manual detection
-                        manual_type = None
-                        # Check all types explicitly
-                        if hasattr(quoted_message, 'audioMessage') and quoted_message.audioMessage and quoted_message.audioMessage.ByteSize() > 0:
-                            manual_type = "audio"
-                        elif hasattr(quoted_message, 'videoMessage') and quoted_message.videoMessage and quoted_message.videoMessage.ByteSize() > 0:
-                            manual_type = "video"
-                        elif hasattr(quoted_message, 'imageMessage') and quoted_message.imageMessage and quoted_message.imageMessage.ByteSize() > 0:
-                            manual_type = "image"
-                        elif hasattr(quoted_message, 'documentMessage') and quoted_message.documentMessage and quoted_message.documentMessage.ByteSize() > 0:
-                            manual_type = "document"
-                        
-                        if manual_type and manual_type != quoted_type:
-                            log.warning(f"thundra_io vs manual mismatch: {quoted_type} vs {manual_type}")
-                            quoted_type = manual_type  # Trust manual detection
-                            log.info(f"Using manual detection: {quoted_type}")
-                        
-                        log.info(f"Final thundra_io result: {quoted_type}")
-                        return has_quoted, quoted_message, quoted_type
-                        
-                except Exception as e:
-                    log.error(f"Error using thundra_io for detection: {e}")
-            
-            # Method 2: Manual detection - check all types without priority bias
-            log.info("Using manual detection method...")
-            detected_types = []
-            
-            # Check all possible types and log what we find
-            if hasattr(quoted_message, 'audioMessage') and quoted_message.audioMessage and quoted_message.audioMessage.ByteSize() > 0:
-                detected_types.append("audio")
-                audio_msg = quoted_message.audioMessage
-                is_ptt = getattr(audio_msg, 'ptt', False)
-                mime_type = getattr(audio_msg, 'mimetype', 'unknown')
-                log.info(f"Found AUDIO message - PTT: {is_ptt}, mime: {mime_type}")
-                
-            if hasattr(quoted_message, 'videoMessage') and quoted_message.videoMessage and quoted_message.videoMessage.ByteSize() > 0:
-                detected_types.append("video")
-                video_msg = quoted_message.videoMessage
-                mime_type = getattr(video_msg, 'mimetype', 'unknown')
-                log.info(f"Found VIDEO message - mime: {mime_type}")
-                
-            if hasattr(quoted_message, 'imageMessage') and quoted_message.imageMessage and quoted_message.imageMessage.ByteSize() > 0:
-                detected_types.append("image")
-                image_msg = quoted_message.imageMessage
-                mime_type = getattr(image_msg, 'mimetype', 'unknown')
-                log.info(f"Found IMAGE message - mime: {mime_type}")
-                
-            if hasattr(quoted_message, 'documentMessage') and quoted_message.documentMessage and quoted_message.documentMessage.ByteSize() > 0:
-                detected_types.append("document")
-                doc_msg = quoted_message.documentMessage
-                mime_type = getattr(doc_msg, 'mimetype', 'unknown')
-                log.info(f"Found DOCUMENT message - mime: {mime_type}")
-                
-            if hasattr(quoted_message, 'stickerMessage') and quoted_message.stickerMessage and quoted_message.stickerMessage.ByteSize() > 0:
-                detected_types.append("sticker")
-                log.info("Found STICKER message")
-            
-            # Log what we detected
-            log.info(f"Detected message types: {detected_types}")
-            
-            # Choose the first valid type (or handle multiple types)
-            if len(detected_types) == 1:
-                quoted_type = detected_types[0]
-                log.info(f"Single type detected: {quoted_type}")
-            elif len(detected_types) > 1:
-                log.warning(f"Multiple types detected: {detected_types}, using first: {detected_types[0]}")
-                quoted_type = detected_types[0]
-            else:
-                log.warning("No valid message types detected")
-                # Enhanced debugging for unknown types
-                log.info("Debugging unknown message type:")
-                for attr in dir(quoted_message):
-                    if not attr.startswith('_') and not attr in ['SerializeToString', 'ParseFromString']:
-                        try:
-                            val = getattr(quoted_message, attr)
-                            if val and hasattr(val, 'ByteSize') and val.ByteSize() > 0:
-                                log.info(f"  {attr}: {type(val)} (size: {val.ByteSize()})")
-                            elif val and not callable(val):
-                                log.info(f"  {attr}: {type(val)} = {str(val)[:100]}")
-                        except Exception as e:
-                            log.info(f"  {attr}: Error - {e}")
+        msg = message.Message
+        if not msg.HasField("extendedTextMessage"):
+            return False, None, None
+        context_info = msg.extendedTextMessage.contextInfo
+        if not context_info.HasField("quotedMessage"):
+            return False, None, None
+        
+        quoted_message = context_info.quotedMessage
+        quoted_type, field = detect_quoted_media(quoted_message)
+        if quoted_type is None:
+            message_log.info("Quoted message without supported media: %s", [d.name for d, _ in quoted_message.ListFields()])
+        else:
+            message_log.info("Quoted %s detected (%s)", quoted_type, field)
+        return True, quoted_message, quoted_type
     
     except Exception as e:
-        log.error(f"Error in get_quoted_message_info: {e}")
-        log.error(traceback.format_exc())
-    
-    log.info(f"Final detection result - has_quoted: {has_quoted}, quoted_type: {quoted_type}")
-    return has_quoted, quoted_message, quoted_type
+        message_log.error("Error in get_quoted_message_info: %s", e)
+        message_log.debug("Traceback:", exc_info=True)
+        return False, None, None
 
+@metrics.instrument("message.download_media")
 async def download_media_from_message(client, quoted_message, quoted_type):
     """Download media from quoted message with enhanced fallback methods"""
     try:
-        log.info(f"Downloading {quoted_type} from quoted message")
+        message_log.info("Downloading %s from quoted message", quoted_type)
         
         # Method 1: Try thundra_io first (if available and working)
         if THUNDRA_AVAILABLE:
             try:
-                log.info(f"Trying thundra_io for {quoted_type}")
+                message_log.info("Trying thundra_io for %s", quoted_type)
                 msg_type = get_message_type(quoted_message)
                 if isinstance(msg_type, MediaMessageType):
                     file_obj = File.from_message(msg_type)
@@ -795,7 +3045,7 @@ async def download_media_from_message(client, quoted_message, quoted_type):
                             # Get actual mime type from file_obj if available
                             if hasattr(file_obj, 'mime_type') and file_obj.mime_type:
                                 mime_type = file_obj.mime_type
-                                log.info(f"Got mime_type from thundra_io: {mime_type}")
+                                message_log.info("Got mime_type from thundra_io: %s", mime_type)
                             else:
                                 # Fallback mime types
                                 mime_type_map = {
@@ -805,106 +3055,67 @@ async def download_media_from_message(client, quoted_message, quoted_type):
                                     "document": "application/pdf"
                                 }
                                 mime_type = mime_type_map.get(quoted_type, "application/octet-stream")
-                                log.info(f"Using fallback mime_type: {mime_type}")
+                                message_log.info("Using fallback mime_type: %s", mime_type)
                             
-                            log.info(f"Successfully downloaded {quoted_type} via thundra_io: {len(media_bytes)} bytes")
+                            message_log.info("Successfully downloaded %s via thundra_io: %s bytes", quoted_type, len(media_bytes))
                             return media_bytes, mime_type
                 else:
-                    log.warning(f"thundra_io did not detect a media message type for {quoted_type}")
+                    message_log.warning("thundra_io did not detect a media message type for %s", quoted_type)
             except Exception as e:
-                log.error(f"Error with thundra_io for {quoted_type}: {e}")
+                message_log.error("Error with thundra_io for %s: %s", quoted_type, e)
         
         # Method 2: Standard download with enhanced error handling
-        log.info(f"Trying standard download for {quoted_type}")
+        message_log.info("Trying standard download for %s", quoted_type)
         message = Message()
-        mime_type = None
-        media_obj = None
         
         # Get media object and construct message based on type
-        if quoted_type == "audio":
-            if hasattr(quoted_message, 'audioMessage') and quoted_message.audioMessage:
-                media_obj = quoted_message.audioMessage
-                message.audioMessage.CopyFrom(media_obj)
-                mime_type = getattr(media_obj, 'mimetype', "audio/ogg")
-                log.info(f"Audio message setup complete, mime_type: {mime_type}")
-            else:
-                log.error("No audioMessage found in quoted message")
-                return None, None
-                
-        elif quoted_type == "video":
-            if hasattr(quoted_message, 'videoMessage') and quoted_message.videoMessage:
-                media_obj = quoted_message.videoMessage
-                message.videoMessage.CopyFrom(media_obj)
-                mime_type = getattr(media_obj, 'mimetype', "video/mp4")
-                log.info(f"Video message setup complete, mime_type: {mime_type}")
-            else:
-                log.error("No videoMessage found in quoted message")
-                return None, None
-                
-        elif quoted_type == "image":
-            if hasattr(quoted_message, 'imageMessage') and quoted_message.imageMessage:
-                media_obj = quoted_message.imageMessage
-                message.imageMessage.CopyFrom(media_obj)
-                mime_type = getattr(media_obj, 'mimetype', "image/jpeg")
-                log.info(f"Image message setup complete, mime_type: {mime_type}")
-            else:
-                log.error("No imageMessage found in quoted message")
-                return None, None
-                
-        elif quoted_type == "document":
-            if hasattr(quoted_message, 'documentMessage') and quoted_message.documentMessage:
-                media_obj = quoted_message.documentMessage
-                message.documentMessage.CopyFrom(media_obj)
-                mime_type = getattr(media_obj, 'mimetype', "application/pdf")
-                log.info(f"Document message setup complete, mime_type: {mime_type}")
-            else:
-                log.error("No documentMessage found in quoted message")
-                return None, None
-        else:
-            log.error(f"Unsupported quoted_type: {quoted_type}")
+        field = QUOTED_TYPE_FIELDS.get(quoted_type)
+        if field is None or quoted_type == "sticker":
+            message_log.error("Unsupported quoted_type: %s", quoted_type)
+            return None, None
+        if not quoted_message.HasField(field):
+            message_log.error("No %s found in quoted message", field)
             return None, None
+        media_obj = getattr(quoted_message, field)
+        getattr(message, field).CopyFrom(media_obj)
+        mime_type = media_obj.mimetype or QUOTED_MEDIA_FIELDS[field][1]
+        message_log.info("%s message setup complete, mime_type: %s", quoted_type.title(), mime_type)
         
-        # Log media properties for debugging
-        log.info(f"{quoted_type.title()} message properties:")
-        log.info(f"  mimetype: {getattr(media_obj, 'mimetype', 'None')}")
-        log.info(f"  fileLength: {getattr(media_obj, 'fileLength', 'None')}")
-        if quoted_type in ["audio", "video"]:
-            log.info(f"  seconds: {getattr(media_obj, 'seconds', 'None')}")
-        if quoted_type == "audio":
-            log.info(f"  ptt: {getattr(media_obj, 'ptt', 'None')}")
-        log.info(f"  url: {getattr(media_obj, 'url', 'None')}")
-        log.info(f"  directPath: {getattr(media_obj, 'directPath', 'None')}")
+        # Detail media hanya saat LOG_LEVELS="message=DEBUG"
+        message_log.debug("%s message properties: mimetype=%s fileLength=%s seconds=%s url=%s directPath=%s",
+                          quoted_type.title(), media_obj.mimetype, media_obj.fileLength,
+                          getattr(media_obj, 'seconds', None), media_obj.url, media_obj.directPath)
         
         # Check media availability
         has_url = getattr(media_obj, 'url', None) is not None and getattr(media_obj, 'url', '') != ''
         has_direct_path = getattr(media_obj, 'directPath', None) is not None and getattr(media_obj, 'directPath', '') != ''
         
-        log.info(f"Media availability - URL: {has_url}, DirectPath: {has_direct_path}")
+        message_log.info("Media availability - URL: %s, DirectPath: %s", has_url, has_direct_path)
         
         # Attempt download with proper error handling
         try:
-            log.info(f"Attempting to download {quoted_type} using client.download_any")
+            message_log.info("Attempting to download %s using client.download_any", quoted_type)
             media_bytes = await client.download_any(message)
             
             if media_bytes and len(media_bytes) > 0:
-                log.info(f"Successfully downloaded {quoted_type} via standard method: {len(media_bytes)} bytes")
+                message_log.info("Successfully downloaded %s via standard method: %s bytes", quoted_type, len(media_bytes))
                 return media_bytes, mime_type
             else:
-                log.error(f"download_any returned empty data for {quoted_type}")
+                message_log.error("download_any returned empty data for %s", quoted_type)
                 
         except Exception as download_error:
-            log.error(f"download_any failed for {quoted_type}: {download_error}")
+            message_log.error("download_any failed for %s: %s", quoted_type, download_error)
             
             # Handle specific error cases
             error_str = str(download_error).lower()
             if "no url present" in error_str:
-                log.info(f"Media {quoted_type} has no URL - trying fallback methods...")
+                message_log.info("Media %s has no URL - trying fallback methods...", quoted_type)
                 
                 # Fallback method 1: For images, try thumbnail
                 if quoted_type == "image" and hasattr(media_obj, 'JPEGThumbnail') and media_obj.JPEGThumbnail:
-                    log.info("Using JPEG thumbnail as fallback for image")
+                    message_log.info("Using JPEG thumbnail as fallback for image")
                     thumbnail_bytes = media_obj.JPEGThumbnail
-                    log.info(f"Successfully extracted thumbnail: {len(thumbnail_bytes)} bytes")
+                    message_log.info("Successfully extracted thumbnail: %s bytes", len(thumbnail_bytes))
                     return thumbnail_bytes, "image/jpeg"
                 
                 # Fallback method 2: Check for media data in other fields
@@ -913,35 +3124,302 @@ async def download_media_from_message(client, quoted_message, quoted_type):
                     if hasattr(media_obj, field_name):
                         field_data = getattr(media_obj, field_name)
                         if field_data and len(field_data) > 1000:  # Reasonable size for media
-                            log.info(f"Found potential media data in {field_name}: {len(field_data)} bytes")
+                            message_log.info("Found potential media data in %s: %s bytes", field_name, len(field_data))
                             # This might be encrypted/encoded data, but let's try
                             return field_data, mime_type
                 
                 # For now, return error for media without accessible URLs
-                log.error(f"Cannot download {quoted_type} - no accessible media URL or data found")
+                message_log.error("Cannot download %s - no accessible media URL or data found", quoted_type)
                 return None, None
                 
             elif "media key" in error_str or "decrypt" in error_str:
-                log.error(f"Media decryption failed for {quoted_type} - this might be an old message or encryption issue")
+                message_log.error("Media decryption failed for %s - this might be an old message or encryption issue", quoted_type)
                 return None, None
                 
             else:
                 # Other errors - re-raise
-                log.error(f"Unknown download error for {quoted_type}: {download_error}")
+                message_log.error("Unknown download error for %s: %s", quoted_type, download_error)
                 return None, None
         
         # If we reach here, standard download failed but no exception was thrown
-        log.error(f"Standard download failed silently for {quoted_type}")
+        message_log.error("Standard download failed silently for %s", quoted_type)
         return None, None
         
     except Exception as e:
-        log.error(f"Error downloading {quoted_type} from quoted message: {e}")
-        log.error(traceback.format_exc())
+        message_log.error("Error downloading %s from quoted message: %s", quoted_type, e)
+        message_log.debug("Traceback:", exc_info=True)
         return None, None
 
+class SchedulerLane:
+    """Satu lane scheduler: antrian per chat dengan urutan round-robin"""
+    
+    def __init__(self, name: str, max_running: int, max_per_chat: Optional[int] = None):
+        self.name = name
+        self.max_running = max_running
+        self.max_per_chat = max_per_chat
+        self.running = 0
+        self.running_per_chat: Dict[str, int] = {}
+        # Urutan key = giliran round-robin; chat yang baru dilayani pindah ke belakang
+        self.queues: "OrderedDict[str, deque]" = OrderedDict()
+    
+    @property
+    def queued(self) -> int:
+        return sum(len(pending) for pending in self.queues.values())
+    
+    def position(self, chat_id: str, index: int) -> int:
+        """Posisi (1 = berikutnya) job ke-index (0-based) antrian chat_id dalam urutan round-robin
+
+        Setiap putaran melayani satu job per chat sesuai urutan queues; job ini ada di putaran index + 1.
+        """
+        ahead, before = index, True
+        for other, pending in self.queues.items():
+            if other == chat_id:
+                before = False
+                continue
+            ahead += min(len(pending), index + 1 if before else index)
+        return ahead + 1
+    
+    def next_job(self) -> Optional[Tuple[str, Tuple[float, Callable[[], Awaitable[Any]]]]]:
+        """Ambil (chat_id, (waktu masuk, job)) berikutnya yang boleh jalan (fair antar chat), atau None"""
+        if self.running >= self.max_running:
+            return None
+        for chat_id in list(self.queues):
+            if self.max_per_chat and self.running_per_chat.get(chat_id, 0) >= self.max_per_chat:
+                continue
+            pending = self.queues.pop(chat_id)
+            job = pending.popleft()
+            if pending:
+                self.queues[chat_id] = pending
+            return chat_id, job
+        return None
+
+class JobScheduler:
+    """Bounded job scheduler di antara event intake dan eksekusi handler"""
+    
+    def __init__(self, max_heavy: int = SCHEDULER_MAX_HEAVY, max_heavy_per_chat: int = SCHEDULER_MAX_HEAVY_PER_CHAT,
+                 max_light: int = SCHEDULER_MAX_LIGHT, max_queued_per_chat: int = SCHEDULER_MAX_QUEUED_PER_CHAT,
+                 max_queued: int = SCHEDULER_MAX_QUEUED):
+        self.max_queued_per_chat = max_queued_per_chat
+        self.max_queued = max_queued
+        self.lanes = {
+            "heavy": SchedulerLane("heavy", max_heavy, max_heavy_per_chat),
+            "light": SchedulerLane("light", max_light),
+        }
+        self._tasks = set()
+    
+    def submit(self, chat_id: str, lane_name: str, job: Callable[[], Awaitable[Any]]) -> Tuple[str, int]:
+        """Masukkan job ke lane; return (status, posisi)
+
+        status: "running" (langsung jalan), "queued" (menunggu slot server, posisi round-robin),
+        "chat_busy" (ditahan batas per chat, posisi di antrian chat ini), "chat_full" / "lane_full" (ditolak).
+        """
+        lane = self.lanes[lane_name]
+        pending = lane.queues.get(chat_id)
+        if pending is not None and len(pending) >= self.max_queued_per_chat:
+            metrics.inc("bot_scheduler_rejected_total", lane=lane.name, reason="chat_full")
+            return "chat_full", 0
+        if lane.queued >= self.max_queued:
+            metrics.inc("bot_scheduler_rejected_total", lane=lane.name, reason="lane_full")
+            return "lane_full", 0
+        entry = (time.perf_counter(), job)
+        lane.queues.setdefault(chat_id, deque()).append(entry)
+        self._dispatch(lane)
+        pending = lane.queues.get(chat_id)
+        if not pending or pending[-1] is not entry:
+            return "running", 0
+        if lane.running < lane.max_running:
+            # Server masih punya slot: yang menahan hanya job chat ini sendiri
+            return "chat_busy", len(pending)
+        return "queued", lane.position(chat_id, len(pending) - 1)
+    
+    def _dispatch(self, lane: SchedulerLane):
+        while True:
+            picked = lane.next_job()
+            if picked is None:
+                return
+            chat_id, (queued_at, job) = picked
+            metrics.observe("bot_queue_wait_seconds", time.perf_counter() - queued_at, lane=lane.name)
+            lane.running += 1
+            lane.running_per_chat[chat_id] = lane.running_per_chat.get(chat_id, 0) + 1
+            task = asyncio.ensure_future(self._run(lane, chat_id, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, lane: SchedulerLane, chat_id: str, job: Callable[[], Awaitable[Any]]):
+        try:
+            await job()
+        except Exception as e:
+            message_log.error("Scheduled %s job failed for %s: %s", lane.name, chat_id, e)
+            message_log.debug("Traceback:", exc_info=True)
+        finally:
+            lane.running -= 1
+            lane.running_per_chat[chat_id] -= 1
+            if not lane.running_per_chat[chat_id]:
+                del lane.running_per_chat[chat_id]
+            self._dispatch(lane)
+
+def get_message_text(message) -> str:
+    """Ambil teks dari pesan biasa atau extended text"""
+    text = ""
+    if hasattr(message.Message, 'conversation') and message.Message.conversation:
+        text = message.Message.conversation
+    elif hasattr(message.Message, 'extendedTextMessage') and message.Message.extendedTextMessage.text:
+        text = message.Message.extendedTextMessage.text
+    return text.strip()
+
+class CommandSpec:
+    """Satu command terdaftar: handler, lane scheduler, jenis argumen, handler reply-ke-media"""
+    
+    def __init__(self, name: str, handler: Callable[..., Awaitable[Any]], lane: str, args: str):
+        self.name = name
+        self.handler = handler
+        self.lane = lane
+        self.args = args  # "none" (harus satu kata), "url", atau "text"
+        self.quoted_handler: Optional[Callable[..., Awaitable[Any]]] = None
+
+class CommandRegistry:
+    """Registry command: semua alias di satu dict, pesan biasa ditolak dengan satu hash lookup"""
+    
+    def __init__(self):
+        self._aliases: Dict[str, CommandSpec] = {}
+    
+    def command(self, *aliases: str, lane: str = "heavy", args: str = "url"):
+        """Decorator: daftarkan handler untuk semua alias"""
+        def decorator(handler):
+            spec = CommandSpec(aliases[0], handler, lane, args)
+            for alias in aliases:
+                if alias in self._aliases:
+                    raise ValueError(f"Duplicate command alias '{alias}'")
+                self._aliases[alias] = spec
+            return handler
+        return decorator
+    
+    def quoted(self, name: str):
+        """Decorator: handler alternatif saat command dikirim sebagai reply ke media"""
+        def decorator(handler):
+            self._aliases[name].quoted_handler = handler
+            return handler
+        return decorator
+    
+    def match(self, text: str) -> Optional[Tuple[CommandSpec, List[str]]]:
+        """(spec, parts) jika teks adalah command yang valid, None untuk obrolan biasa"""
+        head = text.split(None, 1)[0].lower() if text else ""
+        spec = self._aliases.get(head)
+        if spec is None:
+            return None
+        parts = text.split()
+        if spec.args == "none" and len(parts) > 1:
+            return None
+        if len(parts) < 2 and (spec.args == "text" or (spec.args == "url" and spec.quoted_handler is None)):
+            return None
+        return spec, parts
+
+class CommandContext:
+    """Data command yang sedang diproses, diteruskan ke handler"""
+    
+    def __init__(self, client, message, parts: List[str]):
+        self.client = client
+        self.message = message
+        self.chat = message.Info.MessageSource.Chat
+        self.parts = parts
+        self.command = parts[0].lower()
+        self.url = parts[1] if len(parts) > 1 else ""
+        self.quality = parts[2] if len(parts) > 2 else "720p"
+        self.platform = ""
+
+class ProgressiveReply:
+    """Kirim teks AI yang di-stream per paragraf; pesan pertama membawa header
+
+    header boleh berupa string atau coroutine function (dievaluasi sekali, saat pesan pertama dikirim).
+    """
+    
+    def __init__(self, client, chat, header: Union[str, Callable[[], Awaitable[str]]] = "",
+                 min_chars: int = STREAM_MIN_CHARS):
+        self.client = client
+        self.chat = chat
+        self.header = header
+        self.min_chars = min_chars
+        self.buffer = ""
+        self.sent = 0                       # Pesan yang berhasil terkirim
+        self.delivered = 0                  # Offset teks lengkap yang sudah sampai ke user
+    
+    async def feed(self, delta: Optional[str]) -> bool:
+        """TextCallback: kirim paragraf yang sudah lengkap begitu cukup panjang
+
+        Return True jika ada pesan yang terkirim; delta None (retry) mengosongkan buffer.
+        Buffer baru dipotong setelah send_message berhasil; error diteruskan ke pemanggil (_read_stream).
+        """
+        if delta is None:
+            self.buffer = ""
+            return False
+        self.buffer += delta
+        cut = self.buffer.rfind("\n\n")
+        if cut < self.min_chars:
+            return False
+        sent_before = self.sent
+        await self._send(self.buffer[:cut])
+        self.buffer = self.buffer[cut + 2:]
+        self.delivered += cut + 2
+        return self.sent > sent_before
+    
+    async def finish(self, full_text: str) -> bool:
+        """Kirim bagian full_text yang belum terkirim (semuanya jika cache hit / streaming mati / pengiriman gagal)
+
+        Return False jika pengiriman gagal; delivered tetap menunjuk ke teks yang benar-benar sampai ke user.
+        """
+        self.buffer = ""
+        try:
+            await self._send(full_text[self.delivered:])
+        except Exception as e:
+            message_log.warning("Failed to send final reply part (%s of %s chars undelivered): %s",
+                                len(full_text) - self.delivered, len(full_text), e)
+            return False
+        self.delivered = len(full_text)
+        return True
+    
+    async def _send(self, text: str):
+        text = text.strip()
+        if not text:
+            return
+        if not self.sent:
+            header = self.header if isinstance(self.header, str) else await self.header()
+            text = header + text
+        await self.client.send_message(self.chat, text)
+        self.sent += 1
+
 # Initialize components
-ai_processor = AIProcessor(GEMINI_API_KEY)
-downloader = MediaDownloader(ai_processor)
+ai_cache = AIResultCache()
+ai_processor = AIProcessor(GEMINI_API_KEYS, cache=ai_cache)
+media_store = MediaStore()
+janitor = DiskJanitor(store=media_store)  # Juga dipakai temp_workdir dan Tracer.export
+downloader = MediaDownloader(ai_processor, media_store, janitor)
+scheduler = JobScheduler()
+commands = CommandRegistry()
+
+metrics.describe("bot_scheduler_jobs", "gauge", "Scheduler jobs by lane and state")
+metrics.describe("bot_scheduler_rejected_total", "counter", "Jobs rejected because a chat or lane queue is full")
+metrics.describe("bot_cache_requests_total", "counter", "Cache lookups by cache and result")
+metrics.describe("bot_cache_hit_ratio", "gauge", "Cache hit ratio since start")
+metrics.describe("bot_media_store_bytes", "gauge", "Bytes held by the media store")
+metrics.describe("bot_gemini_circuit_open", "gauge", "1 while the Gemini circuit breaker is open or half-open")
+metrics.describe("bot_gemini_key_pending", "gauge", "Gemini requests waiting for or running on each API key")
+metrics.describe("bot_gemini_key_cooling_down", "gauge", "1 while an API key is paused after a 429")
+
+@metrics.collector
+def collect_runtime_metrics():
+    for lane in scheduler.lanes.values():
+        yield "bot_scheduler_jobs", {"lane": lane.name, "state": "queued"}, lane.queued
+        yield "bot_scheduler_jobs", {"lane": lane.name, "state": "running"}, lane.running
+    for name, cache in (("ai_result", ai_cache), ("media_info", downloader.info_cache), ("media_store", media_store)):
+        yield "bot_cache_requests_total", {"cache": name, "result": "hit"}, cache.hits
+        yield "bot_cache_requests_total", {"cache": name, "result": "miss"}, cache.misses
+        total = cache.hits + cache.misses
+        yield "bot_cache_hit_ratio", {"cache": name}, cache.hits / total if total else 0
+    yield "bot_media_store_bytes", {}, media_store.total_bytes
+    yield "bot_gemini_circuit_open", {}, 0 if ai_processor.breaker.state == "closed" else 1
+    for key in ai_processor.key_pool.keys:
+        yield "bot_gemini_key_pending", {"key": key.name}, key.pending
+        yield "bot_gemini_key_cooling_down", {"key": key.name}, int(key.cooling_down)
 
 def validate_url(url: str) -> bool:
     """Simple URL validation"""
@@ -980,35 +3458,97 @@ def format_number(num: int) -> str:
 
 @client_factory.event(ConnectedEv)
 async def on_connected(_: NewAClient, __: ConnectedEv):
-    log.info("⚡ WhatsApp connected with AI features!")
+    message_log.info("⚡ WhatsApp connected with AI features!")
 
 @client_factory.event(MessageEv)
 async def on_message(client: NewAClient, message: MessageEv):
-    await handle_message(client, message)
+    # Prefilter: obrolan biasa berhenti di sini tanpa inspeksi protobuf / quoted message
+    match = commands.match(get_message_text(message))
+    if match is None:
+        return
+    chat = message.Info.MessageSource.Chat
+    client = InstrumentedClient(client)
+    trace = tracer.start(f"command.{match[0].name}", chat=str(chat), lane=match[0].lane)
+    queued = trace.open("scheduler.queue", tid=1)
+    
+    async def job():
+        queued.end = time.perf_counter()
+        await handle_message(client, message, match)
+    
+    status, position = scheduler.submit(str(chat), match[0].lane, lambda: tracer.run(trace, job))
+    queued.args.update(status=status, position=position)
+    if status == "running":
+        return
+    if status in ("chat_full", "lane_full"):
+        queued.end = time.perf_counter()
+        trace.root.args["outcome"] = "rejected"
+        trace.finish()
+    notices = {
+        "queued": f"⏳ Server busy, your request is queued (position {position})...",
+        "chat_busy": f"⏳ Your previous request is still running, this one will start after it (position {position})...",
+        "chat_full": "⚠️ You have too many pending requests. Please wait for them to finish before sending more.",
+        "lane_full": "⚠️ Server is overloaded right now. Please try again in a few minutes.",
+    }
+    try:
+        await client.send_message(chat, notices[status])
+    except Exception as e:
+        message_log.error("Failed to send queue status: %s", e)
 
-async def handle_message(client, message):
+async def handle_message(client, message, match: Optional[Tuple[CommandSpec, List[str]]] = None):
+    started = time.perf_counter()
+    command = None
+    outcome = "ok"
     try:
         chat = message.Info.MessageSource.Chat
+        match = match or commands.match(get_message_text(message))
+        if match is None:
+            return
+        spec, parts = match
+        command = spec.name
+        ctx = CommandContext(client, message, parts)
         
-        # Extract message text
-        text = ""
-        if hasattr(message.Message, 'conversation') and message.Message.conversation:
-            text = message.Message.conversation
-        elif hasattr(message.Message, 'extendedTextMessage') and message.Message.extendedTextMessage.text:
-            text = message.Message.extendedTextMessage.text
-        
-        text = text.strip()
+        # Hanya command dengan mode reply-ke-media yang memeriksa quoted message
+        if spec.quoted_handler is not None:
+            has_quoted, quoted_message, quoted_type = await get_quoted_message_info(message)
+            if has_quoted:
+                await spec.quoted_handler(ctx, quoted_message, quoted_type)
+                return
         
-        # Get quoted message info
-        has_quoted, quoted_message, quoted_type = await get_quoted_message_info(message)
+        # URL-based commands
+        if spec.args == "url":
+            if len(parts) < 2:
+                return
+            if not validate_url(ctx.url):
+                await client.send_message(chat, "❌ Invalid URL! Use: https://...")
+                return
+            ctx.platform = downloader.get_platform_name(ctx.url)
         
-        # Basic commands
-        if text.lower() == "ping":
-            await client.reply_message("🏓 Pong! AI features ready!", message)
-            return
+        await spec.handler(ctx)
             
-        elif text.lower() in ["help", "/help", "menu"]:
-            help_text = """
+    except Exception as e:
+        outcome = "error"
+        metrics.inc("bot_errors_total", stage="command", type=type(e).__name__)
+        message_log.error("Error in message handler: %s", e)
+        message_log.debug("Traceback:", exc_info=True)
+        try:
+            await client.send_message(chat, f"❌ Error: {str(e)}")
+        except:
+            pass
+    finally:
+        if command is not None:
+            metrics.observe("bot_command_duration_seconds", time.perf_counter() - started,
+                            command=command, outcome=outcome)
+
+# Command handlers (alias -> handler lewat CommandRegistry)
+@commands.command("ping", lane="light", args="none")
+async def cmd_ping(ctx):
+    client, message = ctx.client, ctx.message
+    await client.reply_message("🏓 Pong! AI features ready!", message)
+
+@commands.command("help", "/help", "menu", lane="light", args="none")
+async def cmd_help(ctx):
+    client, chat = ctx.client, ctx.chat
+    help_text = """
 🤖 *Universal Media Downloader + AI*
 
 *📥 Download Commands:*
@@ -1044,432 +3584,350 @@ async def handle_message(client, message):
 
 *Powered by Gemini AI* ✨
 """
-            await client.send_message(chat, help_text)
-            return
+    await client.send_message(chat, help_text)
+
+@commands.command("info", "i", lane="light")
+async def cmd_info(ctx):
+    client, chat, url, platform = ctx.client, ctx.chat, ctx.url, ctx.platform
+    await client.send_message(chat, f"🔍 Getting info from {platform}...")
+    
+    info = await downloader.get_info(url)
+    
+    if info["success"]:
+        info_text = f"""
+📺 *{info['title']}*
+
+👤 *Creator:* {info['uploader']}
+🌐 *Platform:* {info['platform']}
+⏱️ *Duration:* {format_duration(info['duration'])}
+👁️ *Views:* {format_number(info['view_count'])}
+
+📝 *Description:*
+{info['description']}...
+"""
+        await client.send_message(chat, info_text)
+    else:
+        await client.send_message(chat, f"❌ Error: {info['error']}")
+
+@commands.command("mp3", "audio", "music", "a")
+async def cmd_mp3(ctx):
+    client, chat, url, platform = ctx.client, ctx.chat, ctx.url, ctx.platform
+    await client.send_message(chat, f"🎵 Downloading audio from {platform}...")
+    
+    result = await downloader.download(url, "audio", "best", str(chat))
+    
+    if result["success"]:
+        await client.send_message(chat, f"📝 {result['info']['title']}")
         
-        # Parse command
-        parts = text.split()
-        if len(parts) < 1:
-            return
-            
-        command = parts[0].lower()
+        file_path = result["file_path"]
+        file_size = result["file_size"]
         
-        # Handle quoted media AI commands
-        if has_quoted and command in ["analyze", "transcribe"]:
-            log.info(f"Processing quoted {quoted_type} with command: {command}")
-            
-            # Check if media type is supported for the command
-            if command == "transcribe":
-                if quoted_type not in ["audio", "video"]:
-                    await client.send_message(chat, f"❌ Transcription only supports audio and video. Detected: {quoted_type}")
-                    return
-                await client.send_message(chat, f"🎵📝 Transcribing {quoted_type}...")
-            elif command == "analyze":
-                if quoted_type not in ["audio", "video", "image"]:
-                    await client.send_message(chat, f"❌ Analysis supports audio, video, and image. Detected: {quoted_type}")
-                    return
-                await client.send_message(chat, f"🧠🔍 Analyzing {quoted_type}...")
-            
-            # Download media
-            media_bytes, mime_type = await download_media_from_message(client, quoted_message, quoted_type)
-            
-            if media_bytes:
-                log.info(f"Successfully downloaded {quoted_type}, size: {len(media_bytes)} bytes, mime: {mime_type}")
-                
-                if command == "transcribe":
-                    # For video files, we still use transcribe_audio since Gemini can extract audio
-                    if quoted_type == "video":
-                        await client.send_message(chat, "📹➡️🎵 Extracting audio from video for transcription...")
-                    
-                    result = await ai_processor.transcribe_audio(media_bytes, mime_type)
-                    if result["success"]:
-                        # Format response based on media type
-                        if quoted_type == "audio":
-                            response = f"🎵📝 *Audio Transcription:*\n\n{result['transcription']}"
-                        else:  # video
-                            response = f"📹📝 *Video Transcription:*\n\n{result['transcription']}"
-                        await client.send_message(chat, response)
-                    else:
-                        await client.send_message(chat, f"❌ Transcription failed: {result['error']}")
-                
-                elif command == "analyze":
-                    # Media analysis with appropriate prompts
-                    if quoted_type == "audio":
-                        prompt = "Analyze this audio content. Describe what you hear, identify the type of content (music, speech, etc.), and provide insights. Respond in Indonesian."
-                    elif quoted_type == "video":
-                        prompt = "Analyze this video content. Describe what you see and hear, identify the type of content, and provide insights. Respond in Indonesian."
-                    elif quoted_type == "image":
-                        prompt = "Analyze this image in detail. Describe what you see, identify objects, people, text, and provide insights. Respond in Indonesian."
-                    else:
-                        prompt = "Analyze this media content and provide insights. Respond in Indonesian."
-                    
-                    result = await ai_processor.analyze_media(media_bytes, mime_type, prompt)
-                    if result["success"]:
-                        # Format response based on media type
-                        media_emoji = {"audio": "🎵", "video": "📹", "image": "🖼️"}.get(quoted_type, "📄")
-                        response = f"{media_emoji}🔍 *{quoted_type.title()} Analysis:*\n\n{result['analysis']}"
-                        await client.send_message(chat, response)
-                    else:
-                        await client.send_message(chat, f"❌ Analysis failed: {result['error']}")
-            else:
-                # More specific error messages based on media type
-                if quoted_type == "audio":
-                    error_msg = "❌ Cannot download audio. This might be:\n"
-                    error_msg += "• Voice note without accessible URL\n"
-                    error_msg += "• Forwarded audio from old message\n" 
-                    error_msg += "• Audio with encryption issues\n\n"
-                    error_msg += "💡 Try with: Recent audio files or voice notes you recorded"
-                elif quoted_type == "video":
-                    error_msg = "❌ Cannot download video. This might be:\n"
-                    error_msg += "• Large video without accessible URL\n"
-                    error_msg += "• Forwarded video from old message\n"
-                    error_msg += "• Video with decryption issues\n\n"
-                    error_msg += "💡 Try with: Recent videos or smaller file sizes"
-                elif quoted_type == "image":
-                    error_msg = "❌ Cannot download image. This might be:\n"
-                    error_msg += "• Forwarded image from old message\n"
-                    error_msg += "• Image with accessibility issues\n\n"
-                    error_msg += "💡 Try with: Recent photos you took or received"
-                else:
-                    error_msg = f"❌ Cannot download {quoted_type}. Please try with a recent media file."
-                
-                await client.send_message(chat, error_msg)
+        # Check WhatsApp audio limit (~16MB)
+        if file_size > 16 * 1024 * 1024:
+            await client.send_message(chat, f"❌ File too large ({format_size(file_size)}). WhatsApp limit: ~16MB")
+            await downloader.release(result)
             return
         
-        # URL-based commands
-        if len(parts) < 2:
-            return
-            
-        url = parts[1]
-        quality = parts[2] if len(parts) > 2 else "720p"
+        await client.send_message(chat, f"✅ Sending audio ({format_size(file_size)})...")
         
-        # Validate URL
-        if not validate_url(url):
-            await client.send_message(chat, "❌ Invalid URL! Use: https://...")
-            return
+        try:
+            # neonize membaca path secara blocking lalu tetap menyalin audio ke file temp,
+            # jadi bytes dibaca di io_executor lebih dulu
+            await client.send_audio(chat, await read_file(file_path))
+            await client.send_message(chat, f"🎵 Audio sent! Size: {format_size(file_size)}")
+        except Exception as e:
+            await client.send_message(chat, f"❌ Send failed: {str(e)}")
+        finally:
+            # File tetap di media store, hanya referensinya yang dilepas
+            await downloader.release(result)
+    else:
+        await client.send_message(chat, f"❌ Download failed: {result['error']}")
+
+@commands.command("video", "vid", "v", "mp4")
+async def cmd_video(ctx):
+    client, chat, url, quality, platform = ctx.client, ctx.chat, ctx.url, ctx.quality, ctx.platform
+    await client.send_message(chat, f"🎬 Downloading video from {platform} ({quality})...")
+    
+    result = await downloader.download(url, "video", quality, str(chat))
+    
+    if result["success"]:
+        await client.send_message(chat, f"📝 {result['info']['title']}")
         
-        platform = downloader.get_platform_name(url)
+        file_path = result["file_path"]
+        file_size = result["file_size"]
         
-        # NEW YOUTUBE ANALYSIS COMMANDS
-        if command == "ytvideo":
-            await client.send_message(chat, f"🎬📊 Analyzing video for YouTube content from {platform}...")
-            
-            result = await downloader.download_for_youtube_analysis(url, "video", str(chat))
-            
-            if result["success"] and result.get("youtube_analysis", {}).get("success"):
-                info = result["info"]
-                youtube_analysis = result["youtube_analysis"]["youtube_analysis"]
-                
-                response = f"🎬 *Original: {info['title']}*\n"
-                response += f"👤 {info['uploader']} | {platform}\n"
-                response += f"⏱️ Duration: {format_duration(info['duration'])}\n\n"
-                response += f"📊 *ANALISIS YOUTUBE CONTENT:*\n\n"
-                response += youtube_analysis
-                
-                await client.send_message(chat, response)
-            else:
-                error_msg = result.get("youtube_analysis", {}).get("error") if result.get("success") else result.get("error", "Unknown error")
-                await client.send_message(chat, f"❌ YouTube video analysis failed: {error_msg}")
-            return
-            
-        elif command == "ytaudio":
-            await client.send_message(chat, f"🎵📊 Analyzing audio for YouTube content from {platform}...")
-            
-            result = await downloader.download_for_youtube_analysis(url, "audio", str(chat))
-            
-            if result["success"] and result.get("youtube_analysis", {}).get("success"):
-                info = result["info"]
-                youtube_analysis = result["youtube_analysis"]["youtube_analysis"]
-                
-                response = f"🎵 *Original: {info['title']}*\n"
-                response += f"👤 {info['uploader']} | {platform}\n"
-                response += f"⏱️ Duration: {format_duration(info['duration'])}\n\n"
-                response += f"📊 *ANALISIS YOUTUBE CONTENT:*\n\n"
-                response += youtube_analysis
-                
-                await client.send_message(chat, response)
-            else:
-                error_msg = result.get("youtube_analysis", {}).get("error") if result.get("success") else result.get("error", "Unknown error")
-                await client.send_message(chat, f"❌ YouTube audio analysis failed: {error_msg}")
+        # Check WhatsApp video limit (~64MB)
+        if file_size > 64 * 1024 * 1024:
+            await client.send_message(chat, f"❌ File too large ({format_size(file_size)}). WhatsApp limit: ~64MB")
+            await downloader.release(result)
             return
         
-        # AI-powered download commands
-        if command == "transcribe":
-            await client.send_message(chat, f"🎵📝 Downloading and transcribing from {platform}...")
-            
-            result = await downloader.download_with_ai(url, ["transcribe"], quality, str(chat))
-            
-            if result["success"] and "transcription" in result["ai_results"]:
-                transcription = result["ai_results"]["transcription"]
-                if transcription["success"]:
-                    info = result["info"]
-                    response = f"🎵 *{info['title']}*\n"
-                    response += f"👤 {info['uploader']} | {platform}\n\n"
-                    response += f"📝 *Transcription:*\n{transcription['transcription']}"
-                    await client.send_message(chat, response)
-                else:
-                    await client.send_message(chat, f"❌ Transcription failed: {transcription['error']}")
-            else:
-                await client.send_message(chat, f"❌ Download failed: {result.get('error', 'Unknown error')}")
-            return
+        await client.send_message(chat, f"✅ Sending video ({format_size(file_size)})...")
         
-        elif command == "summary":
-            await client.send_message(chat, f"🎵📊 Downloading and summarizing from {platform}...")
-            
-            result = await downloader.download_with_ai(url, ["transcribe", "summary"], quality, str(chat))
-            
-            if result["success"] and "summary" in result["ai_results"]:
-                summary = result["ai_results"]["summary"]
-                if summary["success"]:
-                    info = result["info"]
-                    response = f"🎵 *{info['title']}*\n"
-                    response += f"👤 {info['uploader']} | {platform}\n\n"
-                    response += f"📊 *AI Summary:*\n{summary['summary']}"
-                    await client.send_message(chat, response)
-                else:
-                    await client.send_message(chat, f"❌ Summary failed: {summary['error']}")
-            else:
-                await client.send_message(chat, f"❌ Download failed: {result.get('error', 'Unknown error')}")
-            return
+        try:
+            await client.send_video(chat, file_path)
+            await client.send_message(chat, f"🎬 Video sent! Size: {format_size(file_size)}")
+        except Exception as e:
+            await client.send_message(chat, f"❌ Send failed: {str(e)}")
+        finally:
+            # File tetap di media store, hanya referensinya yang dilepas
+            await downloader.release(result)
+    else:
+        await client.send_message(chat, f"❌ Download failed: {result['error']}")
+
+@commands.command("transcribe")
+async def cmd_transcribe(ctx):
+    client, chat, url, quality, platform = ctx.client, ctx.chat, ctx.url, ctx.quality, ctx.platform
+    await client.send_message(chat, f"🎵📝 Downloading and transcribing from {platform}...")
+    
+    result = await downloader.download_with_ai(url, ["transcribe"], quality, str(chat))
+    
+    if result["success"] and "transcription" in result["ai_results"]:
+        transcription = result["ai_results"]["transcription"]
+        if transcription["success"]:
+            info = result["info"]
+            response = f"🎵 *{info['title']}*\n"
+            response += f"👤 {info['uploader']} | {platform}\n\n"
+            response += f"📝 *Transcription:*\n{transcription['transcription']}"
+            await client.send_message(chat, response)
+        else:
+            await client.send_message(chat, f"❌ Transcription failed: {transcription['error']}")
+    else:
+        await client.send_message(chat, f"❌ Download failed: {result.get('error', 'Unknown error')}")
+
+@commands.command("summary")
+async def cmd_summary(ctx):
+    client, chat, url, quality, platform = ctx.client, ctx.chat, ctx.url, ctx.quality, ctx.platform
+    await client.send_message(chat, f"🎵📊 Downloading and summarizing from {platform}...")
+    
+    async def header():
+        # Info sudah di-cache oleh stage info download_with_ai
+        info = await downloader.get_info(url)
+        return f"🎵 *{info.get('title', 'Unknown Title')}*\n👤 {info.get('uploader', 'Unknown')} | {platform}\n\n📊 *AI Summary:*\n"
+    
+    reply = ProgressiveReply(client, chat, header)
+    result = await downloader.download_with_ai(url, ["transcribe", "summary"], quality, str(chat), reply.feed)
+    
+    if result["success"] and "summary" in result["ai_results"]:
+        summary = result["ai_results"]["summary"]
+        if summary["success"]:
+            await reply.finish(summary["summary"])
+        else:
+            await client.send_message(chat, f"❌ Summary failed: {summary['error']}")
+    else:
+        await client.send_message(chat, f"❌ Download failed: {result.get('error', 'Unknown error')}")
+
+@commands.command("smart")
+async def cmd_smart(ctx):
+    client, chat, url, quality, platform = ctx.client, ctx.chat, ctx.url, ctx.quality, ctx.platform
+    await client.send_message(chat, f"🧠✨ Full AI processing from {platform}...")
+    
+    result = await downloader.download_with_ai(url, ["transcribe", "summary", "analyze"], quality, str(chat))
+    
+    if result["success"]:
+        info = result["info"]
+        ai_results = result["ai_results"]
         
-        elif command == "smart":
-            await client.send_message(chat, f"🧠✨ Full AI processing from {platform}...")
-            
-            result = await downloader.download_with_ai(url, ["transcribe", "summary", "analyze"], quality, str(chat))
-            
-            if result["success"]:
-                info = result["info"]
-                ai_results = result["ai_results"]
-                
-                response = f"🎵 *{info['title']}*\n"
-                response += f"👤 {info['uploader']} | {platform}\n"
-                response += f"⏱️ Duration: {format_duration(info['duration'])}\n"
-                response += f"👁️ Views: {format_number(info['view_count'])}\n\n"
-                
-                # Add transcription if available
-                if "transcription" in ai_results and ai_results["transcription"].get("success"):
-                    transcription = ai_results["transcription"]["transcription"]
-                    # Limit transcription length for display
-                    if len(transcription) > 500:
-                        transcription = transcription[:500] + "...\n\n[Transcription truncated]"
-                    response += f"📝 *Transcription:*\n{transcription}\n\n"
-                
-                # Add summary if available
-                if "summary" in ai_results and ai_results["summary"].get("success"):
-                    response += f"📊 *AI Summary:*\n{ai_results['summary']['summary']}\n\n"
-                
-                # Add analysis if available
-                if "analysis" in ai_results and ai_results["analysis"].get("success"):
-                    response += f"🔍 *Video Analysis:*\n{ai_results['analysis']['analysis']}"
-                
-                await client.send_message(chat, response)
-                
-                # Send video file if available
-                if "video_file" in result and result["video_file"].get("success"):
-                    video_file = result["video_file"]
-                    file_size = video_file["file_size"]
-                    
-                    # Check WhatsApp video limit
-                    if file_size <= 64 * 1024 * 1024:
-                        await client.send_message(chat, f"📹 Sending video ({format_size(file_size)})...")
-                        try:
-                            await client.send_video(chat, video_file["file_path"])
-                            # Cleanup after sending
-                            await asyncio.sleep(2)
-                            if os.path.exists(video_file["file_path"]):
-                                os.remove(video_file["file_path"])
-                        except Exception as e:
-                            await client.send_message(chat, f"❌ Failed to send video: {str(e)}")
-                            if os.path.exists(video_file["file_path"]):
-                                os.remove(video_file["file_path"])
-                    else:
-                        await client.send_message(chat, f"⚠️ Video too large ({format_size(file_size)}) for WhatsApp")
-                        if os.path.exists(video_file["file_path"]):
-                            os.remove(video_file["file_path"])
-                        
-            else:
-                await client.send_message(chat, f"❌ Smart processing failed: {result.get('error', 'Unknown error')}")
-            return
+        response = f"🎵 *{info['title']}*\n"
+        response += f"👤 {info['uploader']} | {platform}\n"
+        response += f"⏱️ Duration: {format_duration(info['duration'])}\n"
+        response += f"👁️ Views: {format_number(info['view_count'])}\n\n"
         
-        elif command == "analyze":
-            if len(parts) < 2:
-                return
-                
-            await client.send_message(chat, f"🔍 Analyzing content from {platform}...")
-            
-            result = await downloader.download_with_ai(url, ["analyze"], quality, str(chat))
-            
-            if result["success"] and "analysis" in result["ai_results"]:
-                analysis = result["ai_results"]["analysis"]
-                if analysis.get("success"):
-                    info = result["info"]
-                    response = f"🎬 *{info['title']}*\n"
-                    response += f"👤 {info['uploader']} | {platform}\n\n"
-                    response += f"🔍 *AI Analysis:*\n{analysis['analysis']}"
-                    await client.send_message(chat, response)
-                else:
-                    await client.send_message(chat, f"❌ Analysis failed: {analysis.get('error', 'Unknown error')}")
-            else:
-                await client.send_message(chat, f"❌ Download failed: {result.get('error', 'Unknown error')}")
-            return
+        # Add transcription if available
+        if "transcription" in ai_results and ai_results["transcription"].get("success"):
+            transcription = ai_results["transcription"]["transcription"]
+            # Limit transcription length for display
+            if len(transcription) > 500:
+                transcription = transcription[:500] + "...\n\n[Transcription truncated]"
+            response += f"📝 *Transcription:*\n{transcription}\n\n"
         
-        # Info command
-        elif command in ["info", "i"]:
-            await client.send_message(chat, f"🔍 Getting info from {platform}...")
-            
-            info = await downloader.get_info(url)
-            
-            if info["success"]:
-                info_text = f"""
-📺 *{info['title']}*
+        # Add summary if available
+        if "summary" in ai_results and ai_results["summary"].get("success"):
+            response += f"📊 *AI Summary:*\n{ai_results['summary']['summary']}\n\n"
+        
+        # Add analysis if available
+        if "analysis" in ai_results and ai_results["analysis"].get("success"):
+            response += f"🔍 *Video Analysis:*\n{ai_results['analysis']['analysis']}"
+        
+        await client.send_message(chat, response)
+        
+        # Send video file if available
+        if "video_file" in result and result["video_file"].get("success"):
+            video_file = result["video_file"]
+            file_size = video_file["file_size"]
+            
+            # Check WhatsApp video limit
+            if file_size <= 64 * 1024 * 1024:
+                await client.send_message(chat, f"📹 Sending video ({format_size(file_size)})...")
+                try:
+                    await client.send_video(chat, video_file["file_path"])
+                except Exception as e:
+                    await client.send_message(chat, f"❌ Failed to send video: {str(e)}")
+                finally:
+                    await downloader.release(video_file)
+            else:
+                await client.send_message(chat, f"⚠️ Video too large ({format_size(file_size)}) for WhatsApp")
+                await downloader.release(video_file)
+                
+    else:
+        await client.send_message(chat, f"❌ Smart processing failed: {result.get('error', 'Unknown error')}")
 
-👤 *Creator:* {info['uploader']}
-🌐 *Platform:* {info['platform']}
-⏱️ *Duration:* {format_duration(info['duration'])}
-👁️ *Views:* {format_number(info['view_count'])}
+@commands.command("analyze")
+async def cmd_analyze(ctx):
+    client, chat, url, quality, platform = ctx.client, ctx.chat, ctx.url, ctx.quality, ctx.platform
+    await client.send_message(chat, f"🔍 Analyzing content from {platform}...")
+    
+    result = await downloader.download_with_ai(url, ["analyze"], quality, str(chat))
+    await downloader.release(result.get("video_file"))
+    
+    if result["success"] and "analysis" in result["ai_results"]:
+        analysis = result["ai_results"]["analysis"]
+        if analysis.get("success"):
+            info = result["info"]
+            response = f"🎬 *{info['title']}*\n"
+            response += f"👤 {info['uploader']} | {platform}\n\n"
+            response += f"🔍 *AI Analysis:*\n{analysis['analysis']}"
+            await client.send_message(chat, response)
+        else:
+            await client.send_message(chat, f"❌ Analysis failed: {analysis.get('error', 'Unknown error')}")
+    else:
+        await client.send_message(chat, f"❌ Download failed: {result.get('error', 'Unknown error')}")
 
-📝 *Description:*
-{info['description']}...
-"""
-                await client.send_message(chat, info_text)
-            else:
-                await client.send_message(chat, f"❌ Error: {info['error']}")
+async def youtube_analysis_header(url: str, emoji: str, platform: str) -> str:
+    """Header hasil ytvideo/ytaudio (info sudah di-cache oleh download)"""
+    info = await downloader.get_info(url)
+    response = f"{emoji} *Original: {info.get('title', 'Unknown Title')}*\n"
+    response += f"👤 {info.get('uploader', 'Unknown')} | {platform}\n"
+    response += f"⏱️ Duration: {format_duration(info.get('duration', 0))}\n\n"
+    response += "📊 *ANALISIS YOUTUBE CONTENT:*\n\n"
+    return response
+
+@commands.command("ytvideo")
+async def cmd_ytvideo(ctx):
+    client, chat, url, platform = ctx.client, ctx.chat, ctx.url, ctx.platform
+    await client.send_message(chat, f"🎬📊 Analyzing video for YouTube content from {platform}...")
+    
+    reply = ProgressiveReply(client, chat, lambda: youtube_analysis_header(url, "🎬", platform))
+    result = await downloader.download_for_youtube_analysis(url, "video", str(chat), reply.feed)
+    
+    if result["success"] and result.get("youtube_analysis", {}).get("success"):
+        await reply.finish(result["youtube_analysis"]["youtube_analysis"])
+    else:
+        error_msg = result.get("youtube_analysis", {}).get("error") if result.get("success") else result.get("error", "Unknown error")
+        await client.send_message(chat, f"❌ YouTube video analysis failed: {error_msg}")
+
+@commands.command("ytaudio")
+async def cmd_ytaudio(ctx):
+    client, chat, url, platform = ctx.client, ctx.chat, ctx.url, ctx.platform
+    await client.send_message(chat, f"🎵📊 Analyzing audio for YouTube content from {platform}...")
+    
+    reply = ProgressiveReply(client, chat, lambda: youtube_analysis_header(url, "🎵", platform))
+    result = await downloader.download_for_youtube_analysis(url, "audio", str(chat), reply.feed)
+    
+    if result["success"] and result.get("youtube_analysis", {}).get("success"):
+        await reply.finish(result["youtube_analysis"]["youtube_analysis"])
+    else:
+        error_msg = result.get("youtube_analysis", {}).get("error") if result.get("success") else result.get("error", "Unknown error")
+        await client.send_message(chat, f"❌ YouTube audio analysis failed: {error_msg}")
+
+@commands.command("ai", args="text")
+async def cmd_ai(ctx):
+    client, chat, parts = ctx.client, ctx.chat, ctx.parts
+    query = " ".join(parts[1:])
+    await client.send_message(chat, "🧠 Processing with Gemini AI...")
+    
+    reply = ProgressiveReply(client, chat, "🤖 *Gemini AI:*\n\n")
+    result = await ai_processor.chat(query, reply.feed)
+    if result["success"]:
+        await reply.finish(result["response"])
+    else:
+        await client.send_message(chat, f"❌ AI error: {result['error']}")
+
+@commands.quoted("analyze")
+@commands.quoted("transcribe")
+async def cmd_quoted_media(ctx, quoted_message, quoted_type):
+    client, chat, command = ctx.client, ctx.chat, ctx.command
+    message_log.info("Processing quoted %s with command: %s", quoted_type, command)
+    
+    # Check if media type is supported for the command
+    if command == "transcribe":
+        if quoted_type not in ["audio", "video"]:
+            await client.send_message(chat, f"❌ Transcription only supports audio and video. Detected: {quoted_type}")
+            return
+        await client.send_message(chat, f"🎵📝 Transcribing {quoted_type}...")
+    elif command == "analyze":
+        if quoted_type not in ["audio", "video", "image"]:
+            await client.send_message(chat, f"❌ Analysis supports audio, video, and image. Detected: {quoted_type}")
             return
+        await client.send_message(chat, f"🧠🔍 Analyzing {quoted_type}...")
+    
+    # Download media
+    media_bytes, mime_type = await download_media_from_message(client, quoted_message, quoted_type)
+    
+    if media_bytes:
+        message_log.info("Successfully downloaded %s, size: %s bytes, mime: %s", quoted_type, len(media_bytes), mime_type)
         
-        # Audio download
-        elif command in ["mp3", "audio", "music", "a"]:
-            await client.send_message(chat, f"🎵 Downloading audio from {platform}...")
-            
-            # Get info first
-            info = await downloader.get_info(url)
-            if info["success"]:
-                await client.send_message(chat, f"📝 {info['title']}")
-            
-            result = await downloader.download(url, "audio", "best", str(chat))
+        if command == "transcribe":
+            # Untuk video, track video dibuang oleh normalisasi sebelum upload (hanya suara)
+            if quoted_type == "video":
+                await client.send_message(chat, "📹➡️🎵 Extracting audio from video for transcription...")
             
+            result = await ai_processor.transcribe_audio(media_bytes, mime_type)
             if result["success"]:
-                file_path = result["file_path"]
-                file_size = result["file_size"]
-                
-                # Check WhatsApp audio limit (~16MB)
-                if file_size > 16 * 1024 * 1024:
-                    await client.send_message(chat, f"❌ File too large ({format_size(file_size)}). WhatsApp limit: ~16MB")
-                    os.remove(file_path)
-                    return
-                
-                await client.send_message(chat, f"✅ Sending audio ({format_size(file_size)})...")
-                
-                try:
-                    await client.send_audio(chat, file_path)
-                    await client.send_message(chat, f"🎵 Audio sent! Size: {format_size(file_size)}")
-                    
-                    # Cleanup
-                    await asyncio.sleep(2)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        
-                except Exception as e:
-                    await client.send_message(chat, f"❌ Send failed: {str(e)}")
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                # Format response based on media type
+                if quoted_type == "audio":
+                    response = f"🎵📝 *Audio Transcription:*\n\n{result['transcription']}"
+                else:  # video
+                    response = f"📹📝 *Video Transcription:*\n\n{result['transcription']}"
+                await client.send_message(chat, response)
             else:
-                await client.send_message(chat, f"❌ Download failed: {result['error']}")
-            return
+                await client.send_message(chat, f"❌ Transcription failed: {result['error']}")
         
-        # Video download
-        elif command in ["video", "vid", "v", "mp4"]:
-            await client.send_message(chat, f"🎬 Downloading video from {platform} ({quality})...")
-            
-            # Get info first
-            info = await downloader.get_info(url)
-            if info["success"]:
-                await client.send_message(chat, f"📝 {info['title']}")
-            
-            result = await downloader.download(url, "video", quality, str(chat))
+        elif command == "analyze":
+            # Media analysis with appropriate prompts
+            if quoted_type == "audio":
+                prompt = "Analyze this audio content. Describe what you hear, identify the type of content (music, speech, etc.), and provide insights. Respond in Indonesian."
+            elif quoted_type == "video":
+                prompt = "Analyze this video content. Describe what you see and hear, identify the type of content, and provide insights. Respond in Indonesian."
+            elif quoted_type == "image":
+                prompt = "Analyze this image in detail. Describe what you see, identify objects, people, text, and provide insights. Respond in Indonesian."
+            else:
+                prompt = "Analyze this media content and provide insights. Respond in Indonesian."
             
+            if quoted_type == "video":
+                result = await ai_processor.analyze_video(media_bytes, prompt)
+            else:
+                result = await ai_processor.analyze_media(media_bytes, mime_type, prompt)
             if result["success"]:
-                file_path = result["file_path"]
-                file_size = result["file_size"]
-                
-                # Check WhatsApp video limit (~64MB)
-                if file_size > 64 * 1024 * 1024:
-                    await client.send_message(chat, f"❌ File too large ({format_size(file_size)}). WhatsApp limit: ~64MB")
-                    os.remove(file_path)
-                    return
-                
-                await client.send_message(chat, f"✅ Sending video ({format_size(file_size)})...")
-                
-                try:
-                    await client.send_video(chat, file_path)
-                    await client.send_message(chat, f"🎬 Video sent! Size: {format_size(file_size)}")
-                    
-                    # Cleanup
-                    await asyncio.sleep(2)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        
-                except Exception as e:
-                    await client.send_message(chat, f"❌ Send failed: {str(e)}")
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                # Format response based on media type
+                media_emoji = {"audio": "🎵", "video": "📹", "image": "🖼️"}.get(quoted_type, "📄")
+                response = f"{media_emoji}🔍 *{quoted_type.title()} Analysis:*\n\n{result['analysis']}"
+                await client.send_message(chat, response)
             else:
-                await client.send_message(chat, f"❌ Download failed: {result['error']}")
-            return
+                await client.send_message(chat, f"❌ Analysis failed: {result['error']}")
+    else:
+        # More specific error messages based on media type
+        if quoted_type == "audio":
+            error_msg = "❌ Cannot download audio. This might be:\n"
+            error_msg += "• Voice note without accessible URL\n"
+            error_msg += "• Forwarded audio from old message\n" 
+            error_msg += "• Audio with encryption issues\n\n"
+            error_msg += "💡 Try with: Recent audio files or voice notes you recorded"
+        elif quoted_type == "video":
+            error_msg = "❌ Cannot download video. This might be:\n"
+            error_msg += "• Large video without accessible URL\n"
+            error_msg += "• Forwarded video from old message\n"
+            error_msg += "• Video with decryption issues\n\n"
+            error_msg += "💡 Try with: Recent videos or smaller file sizes"
+        elif quoted_type == "image":
+            error_msg = "❌ Cannot download image. This might be:\n"
+            error_msg += "• Forwarded image from old message\n"
+            error_msg += "• Image with accessibility issues\n\n"
+            error_msg += "💡 Try with: Recent photos you took or received"
+        else:
+            error_msg = f"❌ Cannot download {quoted_type}. Please try with a recent media file."
         
-        # Direct AI chat with Gemini
-        elif command == "ai" and len(parts) > 1:
-            query = " ".join(parts[1:])
-            await client.send_message(chat, "🧠 Processing with Gemini AI...")
-            
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {
-                                "text": f"Respond in Indonesian. {query}"
-                            }
-                        ]
-                    }
-                ]
-            }
-            
-            headers = {"Content-Type": "application/json"}
-            
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(ai_processor.gemini_url, json=payload, headers=headers) as response:
-                        response_text = await response.text()
-                        
-                        if response.status == 200:
-                            response_json = json.loads(response_text)
-                            try:
-                                ai_response = response_json["candidates"][0]["content"]["parts"][0]["text"]
-                                await client.send_message(chat, f"🤖 *Gemini AI:*\n\n{ai_response}")
-                            except (KeyError, IndexError):
-                                await client.send_message(chat, "❌ Failed to parse AI response")
-                        else:
-                            await client.send_message(chat, f"❌ AI error: {response.status}")
-            except Exception as e:
-                await client.send_message(chat, f"❌ AI error: {str(e)}")
-            return
-            
-    except Exception as e:
-        log.error(f"Error in message handler: {e}")
-        log.error(traceback.format_exc())
-        try:
-            await client.send_message(chat, f"❌ Error: {str(e)}")
-        except:
-            pass
-
-# Background cleanup task
-async def cleanup_task():
-    """Auto cleanup old files"""
-    while True:
-        try:
-            await asyncio.sleep(3600)  # Every hour
-            downloader.cleanup_old_files(24)  # Remove files older than 24h
-        except Exception as e:
-            log.error(f"Cleanup task error: {e}")
+        await client.send_message(chat, error_msg)
 
 if __name__ == "__main__":
     print("🚀 Starting Universal Media Downloader Bot with AI...")
@@ -1482,9 +3940,19 @@ if __name__ == "__main__":
     print("⚡ Commands: mp3, video, transcribe, summary, smart, analyze, ai, ytvideo, ytaudio")
     print("⚠️  Make sure yt-dlp is installed and Gemini API key is valid!")
     
-    # Start cleanup task
+    # Start disk janitor
     loop = asyncio.get_event_loop()
-    loop.create_task(cleanup_task())
+    loop.create_task(janitor.run())
+    
+    # Prewarm Gemini connection pool
+    loop.run_until_complete(ai_processor.start())
+    
+    # Endpoint metrics lokal
+    loop.run_until_complete(metrics.start_server())
     
     # Run bot
-    loop.run_until_complete(client_factory.run())
+    try:
+        loop.run_until_complete(client_factory.run())
+    finally:
+        loop.run_until_complete(metrics.stop_server())
+        loop.run_until_complete(ai_processor.close())